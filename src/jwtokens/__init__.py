@@ -1,30 +1,162 @@
+import math
+import secrets
+from concurrent.futures import ThreadPoolExecutor
 from time import time
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 import jwt
 
+from src.jwtokens.chaves import ALGORITMOS, HS256, ChaveAssinatura, preparar_chave
+from src.jwtokens.chaveiro import Chaveiro
+from src.jwtokens.rapido import codec_hs256, codec_rapido_ativo
+from src.jwtokens.revogacao import ListaRevogacao
+
+# Validade padrão, em segundos, dos tokens de `criar_token_jwt()`
+EXPIRES_IN_PADRAO = 600
+
 
 def verifica_token_jwt(text: str = None,
-                       sign_key: bytes = None) -> Dict[str, Any]:
+                       sign_key: Any = None,
+                       chaveiro: Optional[Chaveiro] = None,
+                       algorithm: str = HS256,
+                       revogacao: Optional[ListaRevogacao] = None) -> Dict[str, Any]:
+    if chaveiro is not None:
+        kid, chave, reason = _chave_token(text, chaveiro)
+        if reason is not None:
+            return {'valid': False, 'reason': reason}
+        sign_key, algorithm = chave.verificacao, chave.algoritmo
+    return _verifica_token_jwt(text, sign_key, algorithm, revogacao)[0]
+
+
+def verifica_tokens_lote(tokens: Iterable[str],
+                         chaveiro: Chaveiro,
+                         revogacao: Optional[ListaRevogacao] = None,
+                         max_threads: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Verifica um lote de tokens, por exemplo os de uma fila de tarefas.
+
+    - Tokens repetidos são verificados uma única vez
+    - Os tokens são agrupados pela chave indicada no `kid`, que é obtida do chaveiro uma
+      vez por grupo
+    - Com `max_threads` maior que 1, os grupos são divididos entre threads; o cálculo do
+      HMAC e das assinaturas assimétricas libera o GIL
+
+    Args:
+        tokens (Iterable[str]): Os tokens JWT.
+        chaveiro (Chaveiro): O chaveiro de onde as chaves são obtidas.
+        revogacao (Optional[ListaRevogacao]): Lista de tokens revogados.
+        max_threads (Optional[int]): Número de threads (default: verifica na thread atual).
+
+    Returns:
+        List[Dict[str, Any]]: As claims de cada token, na ordem da entrada, como em
+                              `verifica_token_jwt()`.
+    """
+    tokens = list(tokens)
+    resultados: Dict[str, Dict[str, Any]] = {}
+    grupos: Dict[Optional[str], List[str]] = {}
+    chaves: Dict[Optional[str], ChaveAssinatura] = {}
+    for token in dict.fromkeys(t for t in tokens if isinstance(t, str)):
+        kid, chave, reason = _chave_token(token, chaveiro)
+        if reason is not None:
+            resultados[token] = {'valid': False, 'reason': reason}
+        else:
+            grupos.setdefault(kid, []).append(token)
+            chaves[kid] = chave
+
+    # Divide cada grupo em partes para distribuí-las entre as threads
+    threads = max(max_threads or 1, 1)
+    partes = []
+    for kid, grupo in grupos.items():
+        chave = chaves[kid]
+        verificacao = preparar_chave(chave.verificacao, chave.algoritmo)
+        tamanho = -(-len(grupo) // threads)
+        for i in range(0, len(grupo), tamanho):
+            partes.append((grupo[i:i + tamanho], verificacao, chave.algoritmo))
+
+    def verificar(parte):
+        grupo, verificacao, algoritmo = parte
+        return [(token, _verifica_token_jwt(token, verificacao, algoritmo, revogacao)[0])
+                for token in grupo]
+
+    if threads > 1 and len(partes) > 1:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            verificados = list(executor.map(verificar, partes))
+    else:
+        verificados = [verificar(parte) for parte in partes]
+    for parte in verificados:
+        resultados.update(parte)
+
+    return [dict(resultados[t]) if isinstance(t, str) else {'valid': False, 'reason': "invalid"}
+            for t in tokens]
+
+
+def _chave_token(text: str,
+                 chaveiro: Chaveiro) -> Tuple[Optional[str],
+                                              Optional[ChaveAssinatura],
+                                              Optional[str]]:
+    """
+    Obtém do chaveiro a chave indicada pelo `kid` do cabeçalho do token
+
+    Returns:
+        O `kid`, a chave e, se a chave não puder ser obtida, o motivo
+    """
+    try:
+        kid = jwt.get_unverified_header(text).get('kid')
+    except jwt.InvalidTokenError:
+        return None, None, "invalid"
+    if kid is not None and not isinstance(kid, str):
+        return None, None, "invalid"
+    chave = chaveiro.chave(kid)
+    if chave is None:
+        return kid, None, "unknown_key"
+    return kid, chave, None
+
+
+def _claims_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    claims: Dict[str, Any] = {'valid' : True,
+                              'sub'   : payload.get('sub', None),
+                              'action': payload.get('action', None)}
+
+    if 'iat' in payload:
+        claims.update({'age': int(time()) - int(payload.get('iat'))})
+
+    if 'extra_data' in payload:
+        claims.update({'extra_data': payload.get('extra_data')})
+
+    if 'jti' in payload:
+        claims.update({'jti': payload.get('jti'), 'exp': payload.get('exp')})
+
+    return claims
+
+
+def _verifica_token_jwt(text: str,
+                        sign_key: Any,
+                        algorithm: str = HS256,
+                        revogacao: Optional[ListaRevogacao] = None
+                        ) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    """
+    Verifica o token e retorna as claims e, se for válido, o payload decodificado
+
+    - Apenas o algoritmo da chave é aceito, o que impede a troca do algoritmo no cabeçalho
+    - Com o codec rápido ativo, os tokens HS256 são verificados pelo `CodecHS256`
+    """
     claims: Dict[str, Any] = {'valid': False}
 
     if sign_key is None:
         claims.update({'reason': "missing_key"})
-        return claims
+        return claims, None
 
     try:
-        payload = jwt.decode(jwt=text,
-                             algorithms=['HS256'],
-                             key=sign_key)
-        claims.update({'valid' : True,
-                       'sub'   : payload.get('sub', None),
-                       'action': payload.get('action', None)})
-
-        if 'iat' in payload:
-            claims.update({'age': int(time()) - int(payload.get('iat'))})
-
-        if 'extra_data' in payload:
-            claims.update({'extra_data': payload.get('extra_data')})
+        if algorithm == HS256 and codec_rapido_ativo():
+            payload = codec_hs256(sign_key).decodificar(text)
+        else:
+            payload = jwt.decode(jwt=text,
+                                 algorithms=[algorithm],
+                                 key=preparar_chave(sign_key, algorithm))
+        if revogacao is not None and revogacao.revogado(payload):
+            claims.update({'reason': "revoked"})
+            return claims, None
+        return _claims_payload(payload), payload
 
     except jwt.ExpiredSignatureError:
         claims.update({'reason': "expired"})
@@ -38,24 +170,43 @@ def verifica_token_jwt(text: str = None,
     except jwt.InvalidTokenError:
         claims.update({'reason': "invalid"})
 
-    return claims
+    except (jwt.InvalidKeyError, ValueError):
+        claims.update({'reason': "invalid_key"})
+
+    return claims, None
 
 
 def criar_token_jwt(sub: Any,
-                    sign_key: bytes = None,
+                    sign_key: Any = None,
                     action: str = None,
-                    expires_in: int = 600,
+                    expires_in: int = EXPIRES_IN_PADRAO,
                     issued_at: int = None,
-                    extra_data: Optional[Dict[str, str]] = None) -> Optional[str]:
+                    extra_data: Optional[Dict[str, str]] = None,
+                    chaveiro: Optional[Chaveiro] = None,
+                    algorithm: str = HS256) -> Optional[str]:
+    headers = None
+    if chaveiro is not None:
+        kid, chave = chaveiro.ativa
+        if chave is None:
+            return None
+        sign_key, algorithm = chave.assinatura, chave.algoritmo
+        headers = {'kid': kid}
+
+    if algorithm not in ALGORITMOS:
+        raise ValueError(f"Algoritmo desconhecido: {algorithm}")
+
     if sign_key is None or sub is None:
         return None  # Poderia gerar uma chave
 
-    iat = int(time()) if issued_at is None else int(issued_at)
+    # `iat` com milissegundos (truncados), para que a revogação de todos os tokens de um
+    # usuário não alcance os emitidos logo depois, no mesmo segundo
+    iat = math.floor(time() * 1000) / 1000 if issued_at is None else int(issued_at)
     claims = {
         'sub': str(sub),  # Assunto do token
         'iat': iat,  # Quando foi emitido
-        'nbf': iat,  # Não é valido antes de
-        'exp': iat + expires_in,  # Não é valido depois de
+        'nbf': int(iat),  # Não é valido antes de
+        'exp': int(iat) + expires_in,  # Não é valido depois de
+        'jti': secrets.token_urlsafe(16),  # Identificador, usado para revogar o token
     }
     if action is not None:
         claims.update({'action': action.lower()})
@@ -63,7 +214,11 @@ def criar_token_jwt(sub: Any,
     if extra_data is not None and isinstance(extra_data, dict):
         claims.update({'extra_data': extra_data})
 
+    if algorithm == HS256 and codec_rapido_ativo():
+        return codec_hs256(sign_key).codificar(claims, headers['kid'] if headers else None)
+
     token = jwt.encode(payload=claims,
-                       algorithm='HS256',
-                       key=sign_key)
+                       algorithm=algorithm,
+                       key=preparar_chave(sign_key, algorithm),
+                       headers=headers)
     return token
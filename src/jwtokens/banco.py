@@ -0,0 +1,197 @@
+import asyncio
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator
+
+# Ajustes aplicados a cada nova conexão:
+# - WAL permite leituras concorrentes com uma escrita
+# - synchronous=NORMAL é seguro com WAL e evita um fsync por transação
+# - mmap_size mapeia o arquivo em memória, poupando cópias nas leituras
+# - busy_timeout espera pelo lock em vez de falhar imediatamente com "database is locked"
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL;",
+    "PRAGMA synchronous = NORMAL;",
+    "PRAGMA mmap_size = 268435456;",
+    "PRAGMA busy_timeout = 5000;",
+    "PRAGMA foreign_keys = ON;",
+)
+
+# Número de comandos SQL preparados mantidos em cache por conexão
+CACHE_COMANDOS = 256
+
+
+def conectar(caminho: str) -> sqlite3.Connection:
+    """
+    Abre uma conexão SQLite com os ajustes de `PRAGMAS`.
+
+    - A conexão pode ser usada por outras threads, desde que uma de cada vez (garantido
+      pelo `PoolConexoes`)
+
+    Args:
+        caminho (str): Caminho do arquivo do banco de dados.
+
+    Returns:
+        sqlite3.Connection: A conexão aberta.
+    """
+    conn = sqlite3.connect(caminho,
+                           timeout=5.0,
+                           check_same_thread=False,
+                           cached_statements=CACHE_COMANDOS)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class PoolConexoes:
+    """
+    Pool de conexões reutilizáveis para um banco de dados SQLite.
+
+    - Evita abrir e configurar uma conexão por requisição; como cada conexão mantém seu
+      cache de comandos preparados, os comandos também são reaproveitados
+    - Conexões devolvidas com uma transação aberta são desfeitas com `rollback()`
+    - Conexões além de `tamanho` são fechadas ao serem devolvidas
+
+    Args:
+        caminho (str): Caminho do arquivo do banco de dados.
+        tamanho (int): Número máximo de conexões ociosas mantidas (default: 8).
+    """
+
+    def __init__(self, caminho: str, tamanho: int = 8):
+        self.caminho = caminho
+        self._ociosas: queue.LifoQueue = queue.LifoQueue(maxsize=tamanho)
+
+    def obter(self) -> sqlite3.Connection:
+        """
+        Retira uma conexão ociosa do pool ou abre uma nova.
+
+        Returns:
+            sqlite3.Connection: A conexão, que deve ser devolvida com `devolver()`.
+        """
+        try:
+            return self._ociosas.get_nowait()
+        except queue.Empty:
+            return conectar(self.caminho)
+
+    def devolver(self, conn: sqlite3.Connection) -> None:
+        """
+        Devolve uma conexão ao pool.
+
+        Args:
+            conn (sqlite3.Connection): A conexão obtida com `obter()`.
+        """
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._ociosas.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    @contextmanager
+    def conexao(self) -> Iterator[sqlite3.Connection]:
+        """
+        Gerenciador de contexto que obtém uma conexão e a devolve ao final.
+        """
+        conn = self.obter()
+        try:
+            yield conn
+        finally:
+            self.devolver(conn)
+
+    def fechar(self) -> None:
+        """
+        Fecha todas as conexões ociosas.
+        """
+        while True:
+            try:
+                self._ociosas.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_pools: Dict[str, PoolConexoes] = {}
+_pools_lock = threading.Lock()
+
+
+def pool_conexoes(caminho: str) -> PoolConexoes:
+    """
+    Retorna o pool de conexões do banco de dados, criando-o na primeira chamada.
+
+    Args:
+        caminho (str): Caminho do arquivo do banco de dados.
+
+    Returns:
+        PoolConexoes: O pool compartilhado para esse caminho.
+    """
+    pool = _pools.get(caminho)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(caminho, PoolConexoes(caminho))
+    return pool
+
+
+class BancoAsync:
+    """
+    Acesso ao SQLite a partir de código assíncrono.
+
+    - As chamadas bloqueantes rodam em um pool pequeno de threads, sem bloquear o loop de
+      eventos; o número de threads limita também os acessos simultâneos ao banco
+    - Cada chamada usa uma conexão do `PoolConexoes` informado, devolvida ao final
+    - As threads são criadas na primeira chamada, e de novo após `encerrar()`
+
+    Args:
+        max_threads (int): Número de threads do pool (default: 4).
+    """
+
+    def __init__(self, max_threads: int = 4):
+        self.max_threads = max_threads
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _threads(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_threads,
+                                                        thread_name_prefix='sqlite')
+        return self._executor
+
+    @staticmethod
+    def _com_conexao(pool: PoolConexoes, funcao: Callable, args: tuple) -> Any:
+        with pool.conexao() as conn:
+            return funcao(conn, *args)
+
+    async def executar(self, pool: PoolConexoes, funcao: Callable, *args) -> Any:
+        """
+        Executa `funcao(conn, *args)` em uma thread do pool, com uma conexão de `pool`.
+
+        Args:
+            pool (PoolConexoes): O pool de conexões do banco.
+            funcao (Callable): A função, que recebe a conexão e `args`.
+
+        Returns:
+            Any: O retorno da função.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self._threads(), self._com_conexao, pool, funcao, args)
+
+    async def chamar(self, funcao: Callable, *args) -> Any:
+        """
+        Executa `funcao(*args)` em uma thread do pool, para funções que acessam o banco por
+        conta própria.
+
+        Returns:
+            Any: O retorno da função.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._threads(), funcao, *args)
+
+    def encerrar(self) -> None:
+        """
+        Encerra o pool de threads, aguardando as chamadas pendentes.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -0,0 +1,84 @@
+import argparse
+from time import perf_counter
+from typing import List, Optional, Tuple
+
+import jwt
+
+from src.jwtokens import criar_token_jwt, verifica_token_jwt
+from src.jwtokens.chaves import ALGORITMOS, ASSIMETRICOS, HS256, ChaveAssinatura
+from src.jwtokens.rapido import codec_rapido_ativo, definir_codec_rapido
+
+
+def _medir(funcao, repeticoes: int) -> float:
+    """
+    Executa `funcao` `repeticoes` vezes e retorna o número de operações por segundo
+    """
+    inicio = perf_counter()
+    for _ in range(repeticoes):
+        funcao()
+    return repeticoes / (perf_counter() - inicio)
+
+
+def comparar_algoritmos(repeticoes: int = 2000) -> List[Tuple[str, float, float, Optional[float]]]:
+    """
+    Mede a vazão de assinatura e verificação de tokens para cada algoritmo suportado.
+
+    - 'verificar' usa a chave pública já interpretada (como o `Chaveiro` faz)
+    - 'verificar (PEM)' passa a chave PEM ao PyJWT a cada chamada, que a interpreta de novo
+    - 'HS256 (rápido)' usa o `CodecHS256` em vez do PyJWT
+
+    Args:
+        repeticoes (int): Número de operações medidas por algoritmo (default: 2000).
+
+    Returns:
+        List[Tuple[str, float, float, Optional[float]]]: Por algoritmo, as operações por
+                                                         segundo de assinatura, verificação
+                                                         e verificação com PEM.
+    """
+    resultados = []
+    ativo = codec_rapido_ativo()
+    definir_codec_rapido(False)
+    try:
+        for algoritmo in ALGORITMOS:
+            resultados.append(_comparar(algoritmo, repeticoes))
+        definir_codec_rapido(True)
+        resultados.append((f'{HS256} (rápido)', *_comparar(HS256, repeticoes)[1:]))
+    finally:
+        definir_codec_rapido(ativo)
+    return resultados
+
+
+def _comparar(algoritmo: str, repeticoes: int) -> Tuple[str, float, float, Optional[float]]:
+    """
+    Mede a vazão de um algoritmo
+    """
+    chave = ChaveAssinatura.gerar(algoritmo)
+    token = criar_token_jwt(sub='user@domain.tld', sign_key=chave.assinatura,
+                            algorithm=algoritmo, extra_data={'role': 'admin'})
+    assert verifica_token_jwt(token, chave.verificacao, algorithm=algoritmo)['valid']
+
+    assinar = _medir(lambda: criar_token_jwt(sub='user@domain.tld',
+                                             sign_key=chave.assinatura,
+                                             algorithm=algoritmo,
+                                             extra_data={'role': 'admin'}), repeticoes)
+    verificar = _medir(lambda: verifica_token_jwt(token, chave.verificacao,
+                                                  algorithm=algoritmo), repeticoes)
+    verificar_pem = None
+    if algoritmo in ASSIMETRICOS:
+        pem = chave.json()['publica']
+        verificar_pem = _medir(lambda: jwt.decode(token, pem, algorithms=[algoritmo]),
+                               repeticoes)
+    return algoritmo, assinar, verificar, verificar_pem
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compara a vazão de assinatura e verificação "
+                                                 "de tokens JWT por algoritmo")
+    parser.add_argument('--repeticoes', type=int, default=2000,
+                        help="operações medidas por algoritmo (default: 2000)")
+    args = parser.parse_args()
+
+    print(f"{'algoritmo':<16}{'assinar/s':>14}{'verificar/s':>14}{'verificar PEM/s':>18}")
+    for algoritmo, assinar, verificar, verificar_pem in comparar_algoritmos(args.repeticoes):
+        pem = f"{verificar_pem:>18.0f}" if verificar_pem is not None else f"{'-':>18}"
+        print(f"{algoritmo:<16}{assinar:>14.0f}{verificar:>14.0f}{pem}")
@@ -0,0 +1,396 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from time import monotonic, time
+from typing import Any, Dict, Optional, Tuple
+
+from src.jwtokens import _chave_token, _claims_payload, _verifica_token_jwt, verifica_token_jwt
+from src.jwtokens.chaves import HS256
+from src.jwtokens.chaveiro import Chaveiro
+from src.jwtokens.revogacao import ListaRevogacao
+
+
+def _chave_atual(kid: Optional[str],
+                 sign_key: Any,
+                 chaveiro: Optional[Chaveiro],
+                 algorithm: str) -> Optional[Tuple[Any, str]]:
+    """
+    Retorna a chave de verificação e o algoritmo atuais de um token, ou None se o `kid` não
+    está mais no chaveiro.
+    """
+    if chaveiro is None:
+        return sign_key, algorithm
+    atual = chaveiro.chave(kid)
+    return (atual.verificacao, atual.algoritmo) if atual is not None else None
+
+
+class CacheTokens:
+    """
+    Cache LRU limitado de tokens já verificados.
+
+    - A chave é o SHA-256 do token, e cada entrada guarda o payload decodificado junto com a
+      chave e o algoritmo usados na verificação; um token só é reaproveitado se for
+      verificado com a mesma chave, então a troca da chave invalida o cache imediatamente
+    - Com um `Chaveiro`, a chave é consultada pelo `kid` a cada acerto, então ativar ou
+      aposentar uma chave também tem efeito imediato
+    - Apenas tokens válidos e com `exp` são armazenados, até o instante `exp`; entradas
+      expiradas são descartadas ao serem consultadas e as menos usadas são descartadas
+      quando o cache está cheio
+    - A idade (`age`) é recalculada a cada acerto
+    - Com uma `ListaRevogacao`, a revogação é consultada também nos acertos; sem ela, a
+      revogação de um token deve chamar `invalidar()` (ou `limpar()`)
+
+    Args:
+        max_itens (int): Número máximo de tokens armazenados (default: 1024).
+    """
+
+    def __init__(self, max_itens: int = 1024):
+        self.max_itens = max_itens
+        self.acertos = 0
+        self.falhas = 0
+        # Por token: (kid, chave de verificação, algoritmo, exp, payload)
+        self._itens: 'OrderedDict[bytes, Tuple[Optional[str], Any, str, float, Dict[str, Any]]]' = \
+            OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._itens)
+
+    @staticmethod
+    def _chave(token: str) -> bytes:
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def verificar(self,
+                  token: str,
+                  sign_key: Any = None,
+                  chaveiro: Optional[Chaveiro] = None,
+                  algorithm: str = HS256,
+                  revogacao: Optional[ListaRevogacao] = None) -> Dict[str, Any]:
+        """
+        Verifica um token, consultando o cache antes de decodificá-lo.
+
+        Args:
+            token (str): O token JWT.
+            sign_key (Any): A chave de verificação.
+            chaveiro (Optional[Chaveiro]): O chaveiro de onde a chave é obtida pelo `kid`
+                                           (substitui `sign_key` e `algorithm`).
+            algorithm (str): O algoritmo da chave (default: 'HS256').
+            revogacao (Optional[ListaRevogacao]): Lista de tokens revogados, consultada
+                                                  também nos acertos.
+
+        Returns:
+            Dict[str, Any]: As mesmas claims retornadas por `verifica_token_jwt()`.
+        """
+        if not isinstance(token, str) or (sign_key is None and chaveiro is None):
+            return verifica_token_jwt(token, sign_key, chaveiro, algorithm, revogacao)
+
+        chave = self._chave(token)
+        acerto = self._consultar(chave, sign_key, chaveiro, algorithm)
+        if acerto is not None:
+            if revogacao is not None and revogacao.revogado(acerto):
+                return {'valid': False, 'reason': 'revoked'}
+            return _claims_payload(acerto)
+
+        kid = None
+        if chaveiro is not None:
+            kid, chave_token, reason = _chave_token(token, chaveiro)
+            if reason is not None:
+                return {'valid': False, 'reason': reason}
+            sign_key, algorithm = chave_token.verificacao, chave_token.algoritmo
+
+        claims, payload = _verifica_token_jwt(token, sign_key, algorithm, revogacao)
+        if payload is not None:
+            self._armazenar(chave, kid, sign_key, algorithm, payload)
+        return claims
+
+    def _consultar(self,
+                   chave: bytes,
+                   sign_key: Any,
+                   chaveiro: Optional[Chaveiro],
+                   algorithm: str) -> Optional[Dict[str, Any]]:
+        """
+        Retorna o payload em cache de um token, se ainda vale para a chave de verificação atual.
+        """
+        acerto = None
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None:
+                kid, chave_verificacao, algoritmo, exp, payload = item
+                atual = _chave_atual(kid, sign_key, chaveiro, algorithm)
+                if time() >= exp:
+                    del self._itens[chave]
+                elif (chave_verificacao, algoritmo) == atual:
+                    self._itens.move_to_end(chave)
+                    acerto = payload
+            if acerto is None:
+                self.falhas += 1
+            else:
+                self.acertos += 1
+        return acerto
+
+    def _armazenar(self,
+                   chave: bytes,
+                   kid: Optional[str],
+                   sign_key: Any,
+                   algorithm: str,
+                   payload: Dict[str, Any]) -> None:
+        """
+        Armazena o payload de um token válido com `exp`, descartando os menos usados.
+        """
+        exp = payload.get('exp')
+        if not isinstance(exp, (int, float)):
+            return
+        with self._lock:
+            self._itens[chave] = (kid, sign_key, algorithm, float(exp), payload)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    def invalidar(self, token: str) -> bool:
+        """
+        Remove um token do cache, por exemplo ao revogá-lo.
+
+        Args:
+            token (str): O token JWT.
+
+        Returns:
+            bool: True se o token estava no cache.
+        """
+        with self._lock:
+            return self._itens.pop(self._chave(token), None) is not None
+
+    def limpar(self) -> None:
+        """
+        Remove todos os tokens do cache e zera os contadores.
+        """
+        with self._lock:
+            self._itens.clear()
+            self.acertos = 0
+            self.falhas = 0
+
+    def estatisticas(self) -> Dict[str, Optional[float]]:
+        """
+        Retorna os contadores do cache.
+
+        Returns:
+            Dict[str, Optional[float]]: `acertos`, `falhas`, `itens` e `taxa_acertos`
+                                        (None se ainda não houve consultas).
+        """
+        with self._lock:
+            total = self.acertos + self.falhas
+            return {'acertos'     : self.acertos,
+                    'falhas'      : self.falhas,
+                    'itens'       : len(self._itens),
+                    'taxa_acertos': self.acertos / total if total else None}
+
+
+class BackendMemoria:
+    """
+    Backend compartilhado em memória para o `CacheRespostas`.
+
+    - Tem a interface esperada de um backend compartilhado entre processos (um subconjunto
+      da de clientes memcached ou Redis): `get`, `set` e `add` (grava só se a chave não
+      existir), com valores em bytes e validade em segundos (None: sem validade)
+    - Serve de substituto local nos testes, ou quando há um único processo
+    """
+
+    def __init__(self):
+        self._itens: Dict[str, Tuple[bytes, float]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._itens)
+
+    def _valor(self, chave: str) -> Optional[bytes]:
+        item = self._itens.get(chave)
+        if item is not None and item[1] <= monotonic():
+            del self._itens[chave]
+            return None
+        return item[0] if item is not None else None
+
+    def _gravar(self, chave: str, valor: bytes, ttl: Optional[float]) -> None:
+        self._itens[chave] = (valor, monotonic() + ttl if ttl is not None else float('inf'))
+
+    def get(self, chave: str) -> Optional[bytes]:
+        with self._lock:
+            return self._valor(chave)
+
+    def set(self, chave: str, valor: bytes, ttl: Optional[float]) -> None:
+        with self._lock:
+            self._gravar(chave, valor, ttl)
+
+    def add(self, chave: str, valor: bytes, ttl: Optional[float]) -> bool:
+        with self._lock:
+            if self._valor(chave) is not None:
+                return False
+            self._gravar(chave, valor, ttl)
+            return True
+
+
+class CacheRespostas:
+    """
+    Cache de respostas já serializadas (corpo e cabeçalhos), com leitura pelo banco apenas
+    nas falhas (read-through).
+
+    - Sem backend, as respostas ficam em um LRU local limitado a `max_itens`, cada uma por
+      até `ttl` segundos
+    - Com um backend compartilhado (ver `BackendMemoria`), as respostas ficam só nele, e
+      todos os processos enxergam as mesmas entradas e invalidações
+    - Uma leitura do banco que começou antes de uma invalidação da mesma chave não grava a
+      resposta antiga: localmente, `guardar()` recebe a `versao()` da chave obtida antes da
+      leitura (um contador por faixa de chaves, então escritas em outras chaves raramente
+      descartam a leitura); no backend, a invalidação deixa uma marca por
+      `ttl_invalidacao` segundos e `guardar()` usa `add`, que não a sobrescreve
+    - No backend, as chaves levam o prefixo e uma geração; `limpar()` troca a geração, o que
+      descarta apenas as respostas deste cache, sem apagar outras chaves do backend
+
+    Args:
+        max_itens (int): Número máximo de respostas no LRU local (default: 1024).
+        ttl (float): Validade de uma resposta, em segundos (default: 60).
+        backend (Any): Backend compartilhado, com `get`, `set` e `add`
+                       (default: None, apenas o LRU local).
+        prefixo (str): Prefixo das chaves no backend (default: 'respostas:').
+        ttl_invalidacao (float): Validade da marca de invalidação no backend, maior que a
+                                 duração de uma leitura do banco (default: 5).
+        faixas (int): Número de contadores de invalidação locais (default: 256).
+    """
+
+    # Marca de invalidação no backend
+    _INVALIDADA = b''
+
+    def __init__(self,
+                 max_itens: int = 1024,
+                 ttl: float = 60.0,
+                 backend: Any = None,
+                 prefixo: str = 'respostas:',
+                 ttl_invalidacao: float = 5.0,
+                 faixas: int = 256):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self.backend = backend
+        self.prefixo = prefixo
+        self.ttl_invalidacao = ttl_invalidacao
+        self.acertos = 0
+        self.falhas = 0
+        self._itens: 'OrderedDict[str, Tuple[float, bytes, Dict[str, str]]]' = OrderedDict()
+        self._versoes = [0] * faixas
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._itens)
+
+    def _faixa(self, chave: str) -> int:
+        return hash(chave) % len(self._versoes)
+
+    def _chave_backend(self, chave: str) -> str:
+        geracao = self.backend.get(self.prefixo + 'geracao') or b'0'
+        return f"{self.prefixo}{geracao.decode('ascii')}:{chave}"
+
+    def obter(self, chave: str) -> Optional[Tuple[bytes, Dict[str, str]]]:
+        """
+        Consulta uma resposta.
+
+        Args:
+            chave (str): A chave da resposta.
+
+        Returns:
+            Optional[Tuple[bytes, Dict[str, str]]]: O corpo e os cabeçalhos, ou None.
+        """
+        resposta = None
+        if self.backend is not None:
+            dados = self.backend.get(self._chave_backend(chave))
+            if dados:
+                cabecalhos, _, corpo = dados.partition(b'\n')
+                resposta = (corpo, json.loads(cabecalhos))
+        with self._lock:
+            if self.backend is None:
+                item = self._itens.get(chave)
+                if item is not None and item[0] <= monotonic():
+                    del self._itens[chave]
+                elif item is not None:
+                    self._itens.move_to_end(chave)
+                    resposta = item[1:]
+            if resposta is None:
+                self.falhas += 1
+            else:
+                self.acertos += 1
+        return resposta
+
+    def versao(self, chave: str) -> int:
+        """
+        Versão das invalidações da chave neste processo, obtida antes de ler a resposta no
+        banco e repassada a `guardar()`.
+
+        Args:
+            chave (str): A chave da resposta.
+        """
+        return self._versoes[self._faixa(chave)]
+
+    def guardar(self, chave: str, corpo: bytes, cabecalhos: Dict[str, str], versao: int) -> bool:
+        """
+        Armazena uma resposta lida no banco.
+
+        Args:
+            chave (str): A chave da resposta.
+            corpo (bytes): O corpo serializado.
+            cabecalhos (Dict[str, str]): Os cabeçalhos da resposta.
+            versao (int): O retorno de `versao(chave)` antes da leitura.
+
+        Returns:
+            bool: True se a resposta foi armazenada; False se a chave foi invalidada desde
+                  `versao`.
+        """
+        with self._lock:
+            if versao != self._versoes[self._faixa(chave)]:
+                return False
+            if self.backend is None:
+                self._itens[chave] = (monotonic() + self.ttl, corpo, cabecalhos)
+                self._itens.move_to_end(chave)
+                while len(self._itens) > self.max_itens:
+                    self._itens.popitem(last=False)
+                return True
+        dados = json.dumps(cabecalhos).encode('utf-8') + b'\n' + corpo
+        return self.backend.add(self._chave_backend(chave), dados, self.ttl)
+
+    def invalidar(self, chave: str) -> None:
+        """
+        Descarta a resposta de uma chave, depois de uma alteração no banco.
+
+        Args:
+            chave (str): A chave da resposta.
+        """
+        with self._lock:
+            self._versoes[self._faixa(chave)] += 1
+            self._itens.pop(chave, None)
+        if self.backend is not None:
+            self.backend.set(self._chave_backend(chave), self._INVALIDADA, self.ttl_invalidacao)
+
+    def limpar(self) -> None:
+        """
+        Remove todas as respostas (também do backend, trocando a geração) e zera os
+        contadores.
+        """
+        with self._lock:
+            self._versoes = [versao + 1 for versao in self._versoes]
+            self._itens.clear()
+            self.acertos = 0
+            self.falhas = 0
+        if self.backend is not None:
+            geracao = int(self.backend.get(self.prefixo + 'geracao') or b'0')
+            self.backend.set(self.prefixo + 'geracao', str(geracao + 1).encode('ascii'), None)
+
+    def estatisticas(self) -> Dict[str, Optional[float]]:
+        """
+        Retorna os contadores do cache.
+
+        Returns:
+            Dict[str, Optional[float]]: `acertos`, `falhas`, `itens` (no LRU local) e
+                                        `taxa_acertos` (None se ainda não houve consultas).
+        """
+        with self._lock:
+            total = self.acertos + self.falhas
+            return {'acertos'     : self.acertos,
+                    'falhas'      : self.falhas,
+                    'itens'       : len(self._itens),
+                    'taxa_acertos': self.acertos / total if total else None}
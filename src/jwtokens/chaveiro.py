@@ -0,0 +1,269 @@
+import json
+import os
+import secrets
+import tempfile
+import threading
+from pathlib import Path
+from time import monotonic
+from typing import Dict, Optional, Tuple, Union
+
+from src.jwtokens.chaves import HS256, ChaveAssinatura
+
+# Variáveis de ambiente com as chaves: o conteúdo JSON ou o caminho de um arquivo JSON
+VARIAVEL_CHAVES = 'JWT_CHAVES'
+VARIAVEL_ARQUIVO = 'JWT_CHAVES_ARQUIVO'
+
+
+class Chaveiro:
+    """
+    Conjunto de chaves de assinatura de tokens, identificadas por um `kid`.
+
+    - Os tokens são assinados com a chave ativa, cujo `kid` vai no cabeçalho do token, e com
+      o algoritmo dessa chave (ver `ChaveAssinatura`)
+    - Na verificação, a chave é obtida diretamente pelo `kid` do cabeçalho; tokens sem `kid`
+      são verificados com a chave ativa
+    - A rotação sem interrupção é feita em três passos: publicar uma chave nova (`gerar()`
+      com `ativar=False`), ativá-la depois que todos os processos a carregaram (`ativar()`) e
+      aposentar a anterior depois que os tokens assinados com ela expiraram (`aposentar()`)
+    - Quando carregado de um arquivo, o chaveiro o relê se ele for alterado, verificando a
+      data de modificação no máximo a cada `intervalo` segundos
+
+    O arquivo (ou a variável `JWT_CHAVES`) tem o formato:
+    `{"ativa": "<kid>", "chaves": {"<kid>": "<segredo HS256 em base64url>",
+                                   "<kid>": {"alg": "EdDSA", "privada": "<PEM>",
+                                             "publica": "<PEM>"}, ...}}`
+
+    Args:
+        chaves (Optional[Dict[str, Union[bytes, ChaveAssinatura]]]): As chaves por `kid`;
+                                                                     segredos em bytes são
+                                                                     chaves HS256.
+        ativa (Optional[str]): O `kid` da chave usada para assinar.
+    """
+
+    def __init__(self,
+                 chaves: Optional[Dict[str, Union[bytes, ChaveAssinatura]]] = None,
+                 ativa: Optional[str] = None):
+        chaves = {kid: chave if isinstance(chave, ChaveAssinatura)
+                  else ChaveAssinatura(HS256, chave)
+                  for kid, chave in (chaves or {}).items()}
+        if ativa is not None and ativa not in chaves:
+            raise KeyError(f"Chave ativa desconhecida: {ativa}")
+        # Estado substituído por inteiro a cada alteração, para leituras sem lock
+        self._estado: Tuple[Dict[str, ChaveAssinatura], Optional[str]] = (chaves, ativa)
+        self._lock = threading.Lock()
+        self.arquivo: Optional[Path] = None
+        self.intervalo = 5.0
+        self._mtime: Optional[int] = None
+        self._proxima_verificacao = 0.0
+
+    @classmethod
+    def de_texto(cls, texto: str) -> 'Chaveiro':
+        """
+        Cria o chaveiro a partir do conteúdo JSON.
+
+        Args:
+            texto (str): O JSON com as chaves.
+
+        Returns:
+            Chaveiro: O chaveiro.
+        """
+        dados = json.loads(texto)
+        chaves = {kid: ChaveAssinatura.de_json(chave)
+                  for kid, chave in dados.get('chaves', {}).items()}
+        return cls(chaves, dados.get('ativa'))
+
+    @classmethod
+    def de_arquivo(cls, arquivo: Union[str, Path], intervalo: float = 5.0) -> 'Chaveiro':
+        """
+        Carrega o chaveiro de um arquivo JSON, que é relido quando alterado.
+
+        Args:
+            arquivo (Union[str, Path]): O arquivo com as chaves.
+            intervalo (float): Intervalo mínimo, em segundos, entre verificações de alteração
+                               do arquivo (default: 5).
+
+        Returns:
+            Chaveiro: O chaveiro.
+        """
+        chaveiro = cls()
+        chaveiro.arquivo = Path(arquivo)
+        chaveiro.intervalo = intervalo
+        chaveiro.recarregar()
+        return chaveiro
+
+    @classmethod
+    def de_ambiente(cls) -> Optional['Chaveiro']:
+        """
+        Carrega o chaveiro do arquivo em `JWT_CHAVES_ARQUIVO` ou do JSON em `JWT_CHAVES`.
+
+        Returns:
+            Optional[Chaveiro]: O chaveiro, ou None se nenhuma das variáveis existir.
+        """
+        arquivo = os.environ.get(VARIAVEL_ARQUIVO)
+        if arquivo:
+            return cls.de_arquivo(arquivo)
+        texto = os.environ.get(VARIAVEL_CHAVES)
+        if texto:
+            return cls.de_texto(texto)
+        return None
+
+    @property
+    def texto(self) -> str:
+        """
+        O conteúdo JSON do chaveiro
+        """
+        chaves, ativa = self._estado
+        return json.dumps({'ativa' : ativa,
+                           'chaves': {kid: chave.json() for kid, chave in chaves.items()}},
+                          indent=2)
+
+    @property
+    def kids(self) -> Tuple[str, ...]:
+        """
+        Os identificadores das chaves disponíveis
+        """
+        return tuple(self._estado[0])
+
+    def __len__(self) -> int:
+        return len(self._estado[0])
+
+    def __contains__(self, kid: str) -> bool:
+        return kid in self._estado[0]
+
+    def _verificar_arquivo(self) -> None:
+        if self.arquivo is not None and monotonic() >= self._proxima_verificacao:
+            self.recarregar()
+
+    def recarregar(self) -> bool:
+        """
+        Relê o arquivo do chaveiro, se ele foi alterado desde a última leitura.
+
+        Returns:
+            bool: True se o arquivo foi relido.
+        """
+        if self.arquivo is None:
+            return False
+        with self._lock:
+            self._proxima_verificacao = monotonic() + self.intervalo
+            try:
+                mtime = os.stat(self.arquivo).st_mtime_ns
+            except FileNotFoundError:
+                return False
+            if mtime == self._mtime:
+                return False
+            novo = Chaveiro.de_texto(self.arquivo.read_text(encoding='utf-8'))
+            self._estado = novo._estado
+            self._mtime = mtime
+            return True
+
+    def salvar(self, arquivo: Optional[Union[str, Path]] = None) -> None:
+        """
+        Grava o chaveiro, substituindo o arquivo de forma atômica.
+
+        Args:
+            arquivo (Optional[Union[str, Path]]): O arquivo (default: o arquivo de onde o
+                                                  chaveiro foi carregado).
+        """
+        destino = Path(arquivo) if arquivo is not None else self.arquivo
+        if destino is None:
+            raise ValueError("Nenhum arquivo informado")
+        descritor, temporario = tempfile.mkstemp(dir=destino.parent, prefix=destino.name)
+        try:
+            with os.fdopen(descritor, 'w', encoding='utf-8') as saida:
+                saida.write(self.texto)
+            os.replace(temporario, destino)
+        except BaseException:
+            os.unlink(temporario)
+            raise
+
+    def publico(self) -> 'Chaveiro':
+        """
+        Cópia do chaveiro só com as partes públicas das chaves assimétricas, para os serviços
+        que apenas verificam tokens (as chaves HS256 são omitidas).
+
+        Returns:
+            Chaveiro: O chaveiro público.
+        """
+        chaves, ativa = self._estado
+        publicas = {kid: chave.publica() for kid, chave in chaves.items()
+                    if chave.publica() is not None}
+        return Chaveiro(publicas, ativa if ativa in publicas else None)
+
+    @property
+    def ativa(self) -> Tuple[Optional[str], Optional[ChaveAssinatura]]:
+        """
+        O `kid` e a chave usados para assinar novos tokens
+        """
+        self._verificar_arquivo()
+        chaves, ativa = self._estado
+        return ativa, chaves.get(ativa) if ativa is not None else None
+
+    def chave(self, kid: Optional[str]) -> Optional[ChaveAssinatura]:
+        """
+        Retorna a chave de verificação de um token.
+
+        Args:
+            kid (Optional[str]): O `kid` do cabeçalho do token; se None, a chave ativa.
+
+        Returns:
+            Optional[ChaveAssinatura]: A chave, ou None se o `kid` não existir ou estiver
+                                       aposentado.
+        """
+        self._verificar_arquivo()
+        chaves, ativa = self._estado
+        return chaves.get(ativa if kid is None else kid)
+
+    def gerar(self,
+              kid: Optional[str] = None,
+              ativar: bool = True,
+              algoritmo: str = HS256,
+              tamanho: int = 32) -> str:
+        """
+        Gera uma nova chave aleatória.
+
+        Args:
+            kid (Optional[str]): O identificador da chave (default: aleatório).
+            ativar (bool): Passa a assinar com a nova chave (default: True).
+            algoritmo (str): 'HS256', 'EdDSA' ou 'ES256' (default: 'HS256').
+            tamanho (int): Tamanho do segredo HS256 em bytes (default: 32).
+
+        Returns:
+            str: O `kid` da nova chave.
+        """
+        with self._lock:
+            chaves, ativa = self._estado
+            if kid is None:
+                kid = secrets.token_urlsafe(6)
+            if kid in chaves:
+                raise KeyError(f"Chave já existente: {kid}")
+            chaves = {**chaves, kid: ChaveAssinatura.gerar(algoritmo, tamanho)}
+            self._estado = (chaves, kid if ativar or ativa is None else ativa)
+        return kid
+
+    def ativar(self, kid: str) -> None:
+        """
+        Passa a assinar os novos tokens com a chave `kid`.
+
+        Args:
+            kid (str): O identificador de uma chave existente.
+        """
+        with self._lock:
+            chaves, _ = self._estado
+            if kid not in chaves:
+                raise KeyError(f"Chave desconhecida: {kid}")
+            if chaves[kid].assinatura is None:
+                raise ValueError(f"A chave {kid} não tem a parte privada")
+            self._estado = (chaves, kid)
+
+    def aposentar(self, kid: str) -> None:
+        """
+        Remove uma chave; os tokens assinados com ela deixam de ser aceitos.
+
+        Args:
+            kid (str): O identificador de uma chave que não seja a ativa.
+        """
+        with self._lock:
+            chaves, ativa = self._estado
+            if kid == ativa:
+                raise ValueError("A chave ativa não pode ser aposentada")
+            self._estado = ({k: v for k, v in chaves.items() if k != kid}, ativa)
@@ -0,0 +1,184 @@
+import base64
+import secrets
+from functools import lru_cache
+from typing import Any, Dict, Optional, Union
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+
+# Algoritmos de assinatura suportados
+HS256 = 'HS256'
+EDDSA = 'EdDSA'
+ES256 = 'ES256'
+ALGORITMOS = (HS256, EDDSA, ES256)
+ASSIMETRICOS = (EDDSA, ES256)
+
+
+def _algoritmo_da_chave(chave: Any) -> str:
+    if isinstance(chave, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+        return EDDSA
+    if isinstance(chave, (ec.EllipticCurvePrivateKey, ec.EllipticCurvePublicKey)) and \
+            isinstance(chave.curve, ec.SECP256R1):
+        return ES256
+    raise ValueError(f"Tipo de chave não suportado: {type(chave).__name__}")
+
+
+@lru_cache(maxsize=64)
+def carregar_chave_pem(pem: Union[str, bytes], algoritmo: Optional[str] = None) -> Any:
+    """
+    Converte uma chave PEM (privada ou pública) no objeto usado para assinar ou verificar.
+
+    - O resultado é mantido em cache, então a mesma chave PEM é interpretada uma única vez
+
+    Args:
+        pem (Union[str, bytes]): A chave no formato PEM.
+        algoritmo (Optional[str]): O algoritmo esperado; se informado, chaves de outro
+                                   tipo são recusadas.
+
+    Returns:
+        Any: O objeto da chave, do pacote `cryptography`.
+    """
+    dados = pem.encode('ascii') if isinstance(pem, str) else pem
+    if b'PRIVATE KEY' in dados:
+        chave = serialization.load_pem_private_key(dados, password=None)
+    else:
+        chave = serialization.load_pem_public_key(dados)
+    if algoritmo is not None and _algoritmo_da_chave(chave) != algoritmo:
+        raise ValueError(f"A chave não é do algoritmo {algoritmo}")
+    return chave
+
+
+def preparar_chave(chave: Any, algoritmo: str) -> Any:
+    """
+    Prepara uma chave para `jwt.encode()` / `jwt.decode()`: chaves PEM de algoritmos
+    assimétricos são convertidas (com cache) nos objetos correspondentes.
+
+    Args:
+        chave (Any): Segredo (bytes), chave PEM ou objeto de chave.
+        algoritmo (str): O algoritmo do token.
+
+    Returns:
+        Any: A chave pronta para uso.
+    """
+    if algoritmo in ASSIMETRICOS and isinstance(chave, (str, bytes)):
+        return carregar_chave_pem(chave, algoritmo)
+    return chave
+
+
+class ChaveAssinatura:
+    """
+    Chave de assinatura de tokens, com o algoritmo e os objetos já interpretados.
+
+    - HS256: o mesmo segredo assina e verifica
+    - EdDSA (Ed25519) e ES256 (ECDSA P-256): a chave privada assina e a pública verifica;
+      uma chave só com a parte pública serve apenas para verificar
+
+    Args:
+        algoritmo (str): 'HS256', 'EdDSA' ou 'ES256'.
+        assinatura (Any): Segredo (HS256) ou chave privada; None se a chave só verifica.
+        verificacao (Any): Chave pública (default: derivada da chave privada).
+    """
+
+    __slots__ = ('algoritmo', 'assinatura', 'verificacao')
+
+    def __init__(self, algoritmo: str, assinatura: Any = None, verificacao: Any = None):
+        if algoritmo not in ALGORITMOS:
+            raise ValueError(f"Algoritmo desconhecido: {algoritmo}")
+        if algoritmo == HS256:
+            verificacao = assinatura
+        elif verificacao is None and assinatura is not None:
+            verificacao = assinatura.public_key()
+        if verificacao is None:
+            raise ValueError("Chave sem parte pública")
+        self.algoritmo = algoritmo
+        self.assinatura = assinatura
+        self.verificacao = verificacao
+
+    @classmethod
+    def gerar(cls, algoritmo: str = HS256, tamanho: int = 32) -> 'ChaveAssinatura':
+        """
+        Gera uma nova chave aleatória.
+
+        Args:
+            algoritmo (str): 'HS256', 'EdDSA' ou 'ES256' (default: 'HS256').
+            tamanho (int): Tamanho do segredo HS256 em bytes (default: 32).
+
+        Returns:
+            ChaveAssinatura: A nova chave.
+        """
+        if algoritmo == HS256:
+            return cls(HS256, secrets.token_bytes(tamanho))
+        if algoritmo == EDDSA:
+            return cls(EDDSA, ed25519.Ed25519PrivateKey.generate())
+        if algoritmo == ES256:
+            return cls(ES256, ec.generate_private_key(ec.SECP256R1()))
+        raise ValueError(f"Algoritmo desconhecido: {algoritmo}")
+
+    @classmethod
+    def de_pem(cls,
+               privada: Optional[Union[str, bytes]] = None,
+               publica: Optional[Union[str, bytes]] = None) -> 'ChaveAssinatura':
+        """
+        Cria a chave a partir da chave privada e/ou pública no formato PEM.
+
+        Args:
+            privada (Optional[Union[str, bytes]]): A chave privada.
+            publica (Optional[Union[str, bytes]]): A chave pública (default: derivada da
+                                                   privada).
+
+        Returns:
+            ChaveAssinatura: A chave, com o algoritmo deduzido do tipo da chave.
+        """
+        assinatura = carregar_chave_pem(privada) if privada is not None else None
+        verificacao = carregar_chave_pem(publica) if publica is not None else None
+        algoritmo = _algoritmo_da_chave(assinatura if assinatura is not None else verificacao)
+        return cls(algoritmo, assinatura, verificacao)
+
+    @classmethod
+    def de_json(cls, dados: Union[str, Dict[str, str]]) -> 'ChaveAssinatura':
+        """
+        Cria a chave a partir do formato do arquivo do chaveiro: o segredo HS256 em
+        base64url ou um objeto com as chaves PEM `privada` e/ou `publica`.
+        """
+        if isinstance(dados, str):
+            return cls(HS256, base64.urlsafe_b64decode(dados.encode('ascii') +
+                                                       b'=' * (-len(dados) % 4)))
+        chave = cls.de_pem(dados.get('privada'), dados.get('publica'))
+        if dados.get('alg', chave.algoritmo) != chave.algoritmo:
+            raise ValueError(f"A chave não é do algoritmo {dados['alg']}")
+        return chave
+
+    def json(self) -> Union[str, Dict[str, str]]:
+        """
+        A chave no formato do arquivo do chaveiro
+        """
+        if self.algoritmo == HS256:
+            return base64.urlsafe_b64encode(self.assinatura).decode('ascii')
+        dados = {'alg'    : self.algoritmo,
+                 'publica': self.verificacao.public_bytes(
+                     serialization.Encoding.PEM,
+                     serialization.PublicFormat.SubjectPublicKeyInfo).decode('ascii')}
+        if self.assinatura is not None:
+            dados['privada'] = self.assinatura.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption()).decode('ascii')
+        return dados
+
+    def publica(self) -> Optional['ChaveAssinatura']:
+        """
+        A parte pública da chave, para os serviços que apenas verificam tokens.
+
+        Returns:
+            Optional[ChaveAssinatura]: A chave sem a parte privada, ou None para HS256.
+        """
+        if self.algoritmo == HS256:
+            return None
+        return ChaveAssinatura(self.algoritmo, verificacao=self.verificacao)
+
+    def __eq__(self, outra: object) -> bool:
+        return isinstance(outra, ChaveAssinatura) and self.algoritmo == outra.algoritmo and \
+            self.verificacao == outra.verificacao
+
+    def __hash__(self) -> int:
+        return hash(self.algoritmo)
@@ -0,0 +1,68 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+from typing import Tuple
+
+
+class LimitadorTaxa:
+    """
+    Limitador de taxa por chave (conta, endereço IP...), com um balde de fichas para cada
+    chave, mantido em memória.
+
+    - Cada balde começa cheio, com `capacidade` fichas, e recebe `taxa` fichas por segundo;
+      cada tentativa consome uma ficha, e sem fichas a tentativa é recusada
+    - As fichas são repostas de forma preguiçosa, no momento da consulta, sem threads
+    - No máximo `max_chaves` baldes são mantidos: ao passar do limite, os usados há mais
+      tempo são descartados (um balde descartado volta cheio)
+
+    Args:
+        capacidade (float): Número máximo de fichas de um balde (rajada permitida).
+        taxa (float): Fichas repostas por segundo.
+        max_chaves (int): Número máximo de baldes mantidos (default: 10000).
+    """
+
+    def __init__(self, capacidade: float, taxa: float, max_chaves: int = 10000):
+        self.capacidade = capacidade
+        self.taxa = taxa
+        self.max_chaves = max_chaves
+        self._baldes: OrderedDict = OrderedDict()  # chave -> (fichas, instante)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._baldes)
+
+    def consumir(self, chave: str, fichas: float = 1) -> Tuple[bool, float]:
+        """
+        Consome fichas do balde de uma chave.
+
+        Args:
+            chave (str): A chave limitada.
+            fichas (float): Número de fichas consumidas (default: 1).
+
+        Returns:
+            Tuple[bool, float]: Se a tentativa é permitida e, se não for, quantos segundos
+                                faltam até haver fichas suficientes.
+        """
+        agora = monotonic()
+        with self._lock:
+            disponiveis, instante = self._baldes.pop(chave, (self.capacidade, agora))
+            disponiveis = min(self.capacidade, disponiveis + (agora - instante) * self.taxa)
+            permitido = disponiveis >= fichas
+            if permitido:
+                disponiveis -= fichas
+            self._baldes[chave] = (disponiveis, agora)
+            if len(self._baldes) > self.max_chaves:
+                self._baldes.popitem(last=False)
+        if permitido:
+            return True, 0.0
+        return False, (fichas - disponiveis) / self.taxa
+
+    def limpar(self, chave: str) -> None:
+        """
+        Devolve o balde de uma chave ao estado inicial (cheio).
+
+        Args:
+            chave (str): A chave limitada.
+        """
+        with self._lock:
+            self._baldes.pop(chave, None)
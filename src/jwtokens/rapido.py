@@ -0,0 +1,247 @@
+import binascii
+import hashlib
+import hmac
+import json
+import math
+import os
+import re
+import threading
+from functools import lru_cache
+from time import time
+from typing import Any, Dict, Optional
+
+import jwt
+from jwt.algorithms import HMACAlgorithm
+from jwt.utils import base64url_decode, base64url_encode
+
+# Variável de ambiente que ativa o codec rápido ('1') em `criar_token_jwt()` e
+# `verifica_token_jwt()`
+VARIAVEL_AMBIENTE = 'JWT_CODEC_RAPIDO'
+
+# Número máximo de cabeçalhos (um por `kid`) reconhecidos pelo codec
+_MAX_CABECALHOS = 1024
+
+_HMAC = HMACAlgorithm(HMACAlgorithm.SHA256)
+
+_BASE64URL = re.compile(r'[A-Za-z0-9_-]*')
+
+# Retorno de `CodecHS256._kid_cabecalho()` para cabeçalhos fora do formato gerado pelo codec
+_OUTRO_FORMATO = object()
+
+
+def _decodificar_segmento(segmento: str) -> Optional[bytes]:
+    """
+    Decodifica um segmento em base64url canônico (sem '=' e sem caracteres fora do alfabeto),
+    o único aceito sem ressalvas pelo PyJWT; retorna None para qualquer outro
+    """
+    if len(segmento) % 4 == 1 or not _BASE64URL.fullmatch(segmento):
+        return None
+    try:
+        dados = base64url_decode(segmento)
+    except (ValueError, binascii.Error):
+        return None
+    if base64url_encode(dados).decode('ascii') != segmento:
+        return None
+    return dados
+
+
+def _segmento_cabecalho(kid: Optional[str]) -> str:
+    """
+    Cabeçalho codificado exatamente como o PyJWT o gera (chaves ordenadas, sem espaços)
+    """
+    cabecalho = {'alg': 'HS256', 'typ': 'JWT'}
+    if kid is not None:
+        cabecalho['kid'] = kid
+    return base64url_encode(json.dumps(cabecalho, separators=(',', ':'),
+                                       sort_keys=True).encode()).decode('ascii')
+
+
+class CodecHS256:
+    """
+    Codificador e decodificador HS256 simplificado para os tokens emitidos por este pacote.
+
+    - O segmento do cabeçalho é pré-calculado (um por `kid`) e o objeto `hmac` da chave é
+      criado uma única vez e copiado a cada assinatura
+    - Só entram no cache os cabeçalhos dos tokens emitidos ou com a assinatura já
+      verificada, para que tokens forjados com `kid`s inventados não o ocupem
+    - Os tokens gerados são idênticos aos do `jwt.encode()`
+    - Na decodificação, tokens no formato esperado (cabeçalho conhecido, `exp` e `nbf`
+      inteiros, `iat` numérico e finito, `sub` e `jti` textuais, sem `aud`) são validados
+      diretamente, com as mesmas verificações e exceções do `jwt.decode()`; qualquer outro
+      token é repassado ao `jwt.decode()`, o que mantém o comportamento idêntico
+
+    Args:
+        chave (bytes): O segredo HS256.
+    """
+
+    def __init__(self, chave: bytes):
+        self.chave = chave
+        self._hmac = hmac.new(_HMAC.prepare_key(chave), digestmod=hashlib.sha256)
+        self._cabecalhos: Dict[Optional[str], str] = {}
+        self._conhecidos = set()
+        self._lock = threading.Lock()
+
+    def _cabecalho(self, kid: Optional[str]) -> str:
+        segmento = self._cabecalhos.get(kid)
+        if segmento is None:
+            segmento = _segmento_cabecalho(kid)
+            with self._lock:
+                if len(self._cabecalhos) < _MAX_CABECALHOS:
+                    self._cabecalhos[kid] = segmento
+                    self._conhecidos.add(segmento)
+        return segmento
+
+    def _kid_cabecalho(self, segmento: str) -> Any:
+        """
+        O `kid` de um cabeçalho HS256 no formato gerado por este codec, ou `_OUTRO_FORMATO`;
+        não altera o cache de cabeçalhos
+        """
+        dados = _decodificar_segmento(segmento)
+        if dados is None:
+            return _OUTRO_FORMATO
+        try:
+            cabecalho = json.loads(dados)
+        except ValueError:
+            return _OUTRO_FORMATO
+        if not isinstance(cabecalho, dict) or set(cabecalho) - {'alg', 'typ', 'kid'}:
+            return _OUTRO_FORMATO
+        kid = cabecalho.get('kid')
+        if kid is not None and not isinstance(kid, str):
+            return _OUTRO_FORMATO
+        return kid if _segmento_cabecalho(kid) == segmento else _OUTRO_FORMATO
+
+    def _assinar(self, mensagem: bytes) -> bytes:
+        assinatura = self._hmac.copy()
+        assinatura.update(mensagem)
+        return assinatura.digest()
+
+    def codificar(self, payload: Dict[str, Any], kid: Optional[str] = None) -> str:
+        """
+        Gera o token, igual ao de `jwt.encode(payload, chave, 'HS256', headers)`.
+
+        Args:
+            payload (Dict[str, Any]): As claims, com `exp`, `nbf` e `iat` inteiros.
+            kid (Optional[str]): O `kid` do cabeçalho.
+
+        Returns:
+            str: O token.
+        """
+        if 'iss' in payload and not isinstance(payload['iss'], str):
+            raise TypeError("Issuer (iss) must be a string.")
+        mensagem = (self._cabecalho(kid) + '.').encode('ascii') + \
+            base64url_encode(json.dumps(payload, separators=(',', ':')).encode())
+        return (mensagem + b'.' + base64url_encode(self._assinar(mensagem))).decode('ascii')
+
+    def decodificar(self, token: str) -> Dict[str, Any]:
+        """
+        Verifica o token e retorna o payload, como `jwt.decode(token, chave, ['HS256'])`.
+
+        Args:
+            token (str): O token.
+
+        Returns:
+            Dict[str, Any]: O payload.
+
+        Raises:
+            jwt.InvalidTokenError: As mesmas exceções do `jwt.decode()`.
+        """
+        payload = self._decodificar(token)
+        if payload is None:
+            return jwt.decode(token, self.chave, algorithms=['HS256'])
+        return payload
+
+    def _decodificar(self, token: str) -> Optional[Dict[str, Any]]:
+        """
+        Decodifica um token no formato esperado; retorna None se o formato for outro
+        """
+        if not isinstance(token, str) or token.count('.') != 2:
+            return None
+        mensagem, _, segmento_assinatura = token.rpartition('.')
+        segmento_cabecalho, _, segmento_payload = mensagem.partition('.')
+        conhecido = segmento_cabecalho in self._conhecidos
+        kid = None if conhecido else self._kid_cabecalho(segmento_cabecalho)
+        if kid is _OUTRO_FORMATO:
+            return None
+        conteudo = _decodificar_segmento(segmento_payload)
+        assinatura = _decodificar_segmento(segmento_assinatura)
+        if conteudo is None or assinatura is None:
+            return None
+
+        if not hmac.compare_digest(self._assinar(mensagem.encode('ascii')), assinatura):
+            raise jwt.InvalidSignatureError("Signature verification failed")
+        if not conhecido:
+            self._cabecalho(kid)  # Assinado com a chave: o cabeçalho pode entrar no cache
+
+        payload = _payload_esperado(conteudo)
+        if payload is not None:
+            _verificar_tempos(payload)
+        return payload
+
+
+def _payload_esperado(conteudo: bytes) -> Optional[Dict[str, Any]]:
+    """
+    O payload, se estiver no formato validado pelo codec; None se for outro
+    """
+    try:
+        payload = json.loads(conteudo)
+    except ValueError:
+        return None
+    if not isinstance(payload, dict) or 'aud' in payload:
+        return None
+    if any(claim in payload and type(payload[claim]) is not int for claim in ('nbf', 'exp')):
+        return None
+    if 'iat' in payload and not (type(payload['iat']) is int or
+                                 type(payload['iat']) is float and math.isfinite(payload['iat'])):
+        return None
+    if any(claim in payload and not isinstance(payload[claim], str) for claim in ('sub', 'jti')):
+        return None
+    return payload
+
+
+def _verificar_tempos(payload: Dict[str, Any]) -> None:
+    """
+    Verifica `iat`, `nbf` e `exp` como o `jwt.decode()`, com as mesmas exceções
+    """
+    agora = time()
+    if 'iat' in payload and int(payload['iat']) > agora:
+        raise jwt.ImmatureSignatureError("The token is not yet valid (iat)")
+    if 'nbf' in payload and payload['nbf'] > agora:
+        raise jwt.ImmatureSignatureError("The token is not yet valid (nbf)")
+    if 'exp' in payload and payload['exp'] <= agora:
+        raise jwt.ExpiredSignatureError("Signature has expired")
+
+
+@lru_cache(maxsize=64)
+def codec_hs256(chave: bytes) -> CodecHS256:
+    """
+    Retorna o codec da chave, criando-o na primeira chamada.
+
+    Args:
+        chave (bytes): O segredo HS256.
+
+    Returns:
+        CodecHS256: O codec compartilhado para essa chave.
+    """
+    return CodecHS256(chave)
+
+
+_ativo = os.environ.get(VARIAVEL_AMBIENTE) == '1'
+
+
+def codec_rapido_ativo() -> bool:
+    """
+    Indica se `criar_token_jwt()` e `verifica_token_jwt()` usam o `CodecHS256`.
+    """
+    return _ativo
+
+
+def definir_codec_rapido(ativo: Optional[bool]) -> None:
+    """
+    Ativa ou desativa o uso do `CodecHS256` para os tokens HS256.
+
+    Args:
+        ativo (Optional[bool]): O novo estado; se None, volta a usar a variável de ambiente
+                                `JWT_CODEC_RAPIDO`.
+    """
+    global _ativo
+    _ativo = os.environ.get(VARIAVEL_AMBIENTE) == '1' if ativo is None else ativo
@@ -1,51 +1,287 @@
 import base64
-import secrets
+import json
+import math
+import re
 import sqlite3
+from collections import Counter
+from email.utils import formatdate, parsedate_to_datetime
 from functools import wraps
+from itertools import islice
 
-from flask import Flask, jsonify, request
+import click
+from flask import Flask, Response, g, jsonify, request, url_for
 
-from src.jwtokens import criar_token_jwt, verifica_token_jwt
+from src.jwtokens import EXPIRES_IN_PADRAO, criar_token_jwt
+from src.jwtokens.banco import PoolConexoes, pool_conexoes
+from src.jwtokens.cache import CacheRespostas, CacheTokens
+from src.jwtokens.chaves import HS256
+from src.jwtokens.chaveiro import Chaveiro
+from src.jwtokens.limitador import LimitadorTaxa
+from src.jwtokens.revogacao import ListaRevogacao, lista_revogacao
+from src.jwtokens.sessoes import SessoesRefresh, criar_tabela as criar_tabela_sessoes
+from src.otp import FilaCheiaError, ServicoHash, login, servico_hash_padrao
 
 app = Flask(__name__)
 DATABASE = 'phone_book.db'
-SECRET_KEY = secrets.token_bytes(32)
-SECRET_KEY_BASE64 = base64.urlsafe_b64encode(SECRET_KEY).decode('utf-8')
+app.config.setdefault('DATABASE', DATABASE)
+# Banco de usuários do `src.otp` usado pelo `/login`; os usuários cadastrados nele são os
+# operadores da agenda e recebem o papel LOGIN_ROLE
+app.config.setdefault('AUTH_DATABASE', 'usuarios.db')
+app.config.setdefault('LOGIN_ROLE', 'admin')
+# Tamanho máximo do corpo das requisições (413 acima dele), também na versão ASGI
+app.config.setdefault('MAX_CONTENT_LENGTH', 64 * 1024 * 1024)
+ACTIONS = ('create', 'update', 'delete')
+MAX_PAGE_SIZE = 1000
+# Validade dos access tokens emitidos a partir de um refresh token, em segundos
+ACCESS_TOKEN_EXPIRES_IN = 300
+# Maior validade aceita nos access tokens, em segundos; a revogação de todos os tokens de um
+# usuário é mantida por esse tempo, e tokens mais longos são recusados
+app.config.setdefault('TOKEN_MAX_LIFETIME', max(ACCESS_TOKEN_EXPIRES_IN, EXPIRES_IN_PADRAO))
+STREAM_CHUNK_SIZE = 500
+# Instante atual em segundos desde 1970, com fração, em SQL
+NOW = "((julianday('now') - 2440587.5) * 86400.0)"
+SEARCH_DEFAULT_LIMIT = 50
+# Idade mínima, em segundos, de uma alteração para que a resposta tenha Last-Modified (ver
+# `validators()`)
+LAST_MODIFIED_MARGIN = 2
+# Itens gravados por transação nas operações em lote
+BULK_CHUNK_SIZE = 500
+# Tempo, em segundos, que as remoções permanecem no registro de alterações de `/changes`
+CHANGES_RETENTION = 7 * 24 * 60 * 60
+SEARCH_FIELDS = {'all': None, 'name': 'name', 'email': 'email', 'telephone': 'telephone_digits'}
+# Telefone só com os dígitos, sem os separadores usuais
+TELEPHONE_DIGITS = ("replace(replace(replace(replace(replace(replace(replace(telephone, "
+                    "' ', ''), '-', ''), '(', ''), ')', ''), '.', ''), '+', ''), '/', '')")
+# Chaves lidas de JWT_CHAVES_ARQUIVO ou JWT_CHAVES, compartilhadas entre os processos; sem
+# elas, uma chave aleatória válida apenas enquanto este processo estiver ativo
+key_ring = Chaveiro.de_ambiente()
+if key_ring is None:
+    key_ring = Chaveiro()
+    key_ring.gerar()
+# Um chaveiro sem chave ativa com a parte privada (ex.: exportado só com as chaves públicas)
+# apenas verifica tokens: a emissão, no /login e no /token/refresh, responde 503
+if getattr(key_ring.ativa[1], 'assinatura', None) is None:
+    app.logger.warning("Chaveiro sem chave ativa para assinar: novos tokens não serão emitidos")
+# Segredo da chave ativa na inicialização, se for HS256; tokens sem `kid` são verificados com
+# a chave ativa
+SECRET_KEY = key_ring.ativa[1].assinatura \
+    if key_ring.ativa[1] is not None and key_ring.ativa[1].algoritmo == HS256 else None
+SECRET_KEY_BASE64 = base64.urlsafe_b64encode(SECRET_KEY).decode('utf-8') if SECRET_KEY else None
+token_cache = CacheTokens()
+# Tentativas de login: rajadas curtas por endereço IP e poucas tentativas por conta a partir
+# de cada endereço, para que força bruta não consuma o tempo de CPU dos hashes de senha sem
+# que um endereço consiga bloquear o login do dono da conta a partir de outro
+login_ip_limiter = LimitadorTaxa(capacidade=20, taxa=1.0)
+login_account_limiter = LimitadorTaxa(capacidade=5, taxa=1 / 30)
+# Respostas de `/user/<email>` já serializadas, invalidadas pelas rotas de escrita; com vários
+# processos, `user_cache.backend` deve ser um backend compartilhado entre eles (memcached,
+# Redis...), para que a invalidação feita por um valha para todos
+user_cache = CacheRespostas(max_itens=4096, ttl=60)
+
+
+def get_pool() -> PoolConexoes:
+    return pool_conexoes(app.config['DATABASE'])
+
+
+def get_revocation_list() -> ListaRevogacao:
+    return lista_revogacao(app.config['DATABASE'], app.config['TOKEN_MAX_LIFETIME'])
+
+
+def get_auth_pool() -> PoolConexoes:
+    return pool_conexoes(app.config['AUTH_DATABASE'])
+
+
+def get_hash_service() -> ServicoHash:
+    return servico_hash_padrao()
+
+
+def get_sessions() -> SessoesRefresh:
+    return SessoesRefresh(get_pool())
+
+
+def get_db() -> sqlite3.Connection:
+    """
+    Conexão do pool associada ao contexto da aplicação, devolvida ao final da requisição
+    """
+    if 'db' not in g:
+        g.db = get_pool().obter()
+    return g.db
+
+
+@app.teardown_appcontext
+def release_db(exception=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool().devolver(conn)
 
 
 def init_db():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('DROP TABLE IF EXISTS users;')
-    cursor.execute('''
-        CREATE TABLE users (
-            email TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            telephone TEXT NOT NULL
-        );
-    ''')
-    conn.commit()
-    conn.close()
+    """
+    Cria as tabelas, descartando os dados se houver algum.
+
+    - `users_fts` é um índice FTS5 com o tokenizador trigram sobre `name`, `email` e os dígitos
+      do telefone, para buscas por substring e prefixo; o conteúdo fica só em `users`
+      (external content) e os gatilhos mantêm o índice sincronizado com inserções,
+      alterações e remoções
+    - `telephone_digits` é uma coluna gerada (virtual) com os dígitos do telefone, indexada
+      para buscas por prefixo do número
+    - `id` fixa o rowid usado pelo índice FTS, que um VACUUM poderia renumerar
+    - `users_meta.version` conta as alterações da tabela e cada linha guarda, em `revision`,
+      a versão da sua última alteração e, em `updated_at`, o instante; os gatilhos mantêm os
+      dois, e deles saem os ETags e o Last-Modified de `/users` e `/user/<email>`
+    - `users_changes` registra, pelos mesmos gatilhos, cada inserção, alteração e remoção,
+      com a versão da tabela como número de sequência (`seq`); é a origem de `/changes`.
+      A troca de email registra a remoção do antigo e a inserção do novo.
+      `users_meta.changes_floor` é o maior `seq` descartado pela compactação
+    """
+    with get_pool().conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DROP TABLE IF EXISTS users_fts;')
+        cursor.execute('DROP TABLE IF EXISTS users;')
+        cursor.execute('DROP TABLE IF EXISTS users_meta;')
+        cursor.execute('DROP TABLE IF EXISTS users_changes;')
+        cursor.execute(f'''
+            CREATE TABLE users (
+                id INTEGER PRIMARY KEY,
+                email TEXT NOT NULL UNIQUE,
+                name TEXT NOT NULL,
+                telephone TEXT NOT NULL,
+                telephone_digits TEXT GENERATED ALWAYS AS ({TELEPHONE_DIGITS}) VIRTUAL,
+                revision INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL DEFAULT ({NOW})
+            );
+        ''')
+        cursor.execute('''
+            CREATE TABLE users_meta (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                changes_floor INTEGER NOT NULL DEFAULT 0
+            );
+        ''')
+        cursor.execute(f'INSERT INTO users_meta (id, version, updated_at) VALUES (1, 0, {NOW});')
+        cursor.execute('''
+            CREATE TABLE users_changes (
+                seq INTEGER PRIMARY KEY,
+                op TEXT NOT NULL,
+                email TEXT NOT NULL,
+                name TEXT,
+                telephone TEXT,
+                changed_at REAL NOT NULL
+            );
+        ''')
+        cursor.execute('CREATE INDEX users_changes_email_index ON users_changes (email, seq);')
+        cursor.execute(f'''
+            CREATE TRIGGER users_version_insert AFTER INSERT ON users BEGIN
+                UPDATE users_meta SET version = version + 1, updated_at = {NOW} WHERE id = 1;
+                UPDATE users
+                SET revision = (SELECT version FROM users_meta WHERE id = 1),
+                    updated_at = {NOW}
+                WHERE id = new.id;
+                INSERT INTO users_changes (seq, op, email, name, telephone, changed_at)
+                SELECT version, 'insert', new.email, new.name, new.telephone, updated_at
+                FROM users_meta WHERE id = 1;
+            END;
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER users_version_update
+            AFTER UPDATE OF email, name, telephone ON users BEGIN
+                UPDATE users_meta SET version = version + 1, updated_at = {NOW}
+                WHERE id = 1 AND old.email <> new.email;
+                INSERT INTO users_changes (seq, op, email, changed_at)
+                SELECT version, 'delete', old.email, updated_at
+                FROM users_meta WHERE id = 1 AND old.email <> new.email;
+                UPDATE users_meta SET version = version + 1, updated_at = {NOW} WHERE id = 1;
+                UPDATE users
+                SET revision = (SELECT version FROM users_meta WHERE id = 1),
+                    updated_at = {NOW}
+                WHERE id = new.id;
+                INSERT INTO users_changes (seq, op, email, name, telephone, changed_at)
+                SELECT version, iif(old.email = new.email, 'update', 'insert'), new.email,
+                       new.name, new.telephone, updated_at
+                FROM users_meta WHERE id = 1;
+            END;
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER users_version_delete AFTER DELETE ON users BEGIN
+                UPDATE users_meta SET version = version + 1, updated_at = {NOW} WHERE id = 1;
+                INSERT INTO users_changes (seq, op, email, changed_at)
+                SELECT version, 'delete', old.email, updated_at FROM users_meta WHERE id = 1;
+            END;
+        ''')
+        cursor.execute('CREATE INDEX users_telephone_digits_index ON users (telephone_digits);')
+        cursor.execute('''
+            CREATE VIRTUAL TABLE users_fts USING fts5 (
+                name, email, telephone_digits,
+                content='users', content_rowid='id', tokenize='trigram'
+            );
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER users_fts_insert AFTER INSERT ON users BEGIN
+                INSERT INTO users_fts (rowid, name, email, telephone_digits)
+                VALUES (new.id, new.name, new.email, new.telephone_digits);
+            END;
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER users_fts_delete AFTER DELETE ON users BEGIN
+                INSERT INTO users_fts (users_fts, rowid, name, email, telephone_digits)
+                VALUES ('delete', old.id, old.name, old.email, old.telephone_digits);
+            END;
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER users_fts_update AFTER UPDATE OF email, name, telephone ON users BEGIN
+                INSERT INTO users_fts (users_fts, rowid, name, email, telephone_digits)
+                VALUES ('delete', old.id, old.name, old.email, old.telephone_digits);
+                INSERT INTO users_fts (rowid, name, email, telephone_digits)
+                VALUES (new.id, new.name, new.email, new.telephone_digits);
+            END;
+        ''')
+        conn.commit()
+        criar_tabela_sessoes(conn)
+    user_cache.limpar()
+
+
+def start_session(sub, role, actions):
+    """
+    Inicia uma sessão para um usuário já autenticado e retorna o refresh token.
+
+    - As ações permitidas e o papel são gravados na sessão e usados nos access tokens
+      emitidos por `/token/refresh`
+    """
+    return get_sessions().iniciar(sub, {'actions'   : [a.lower() for a in actions],
+                                        'extra_data': {'role': role}})
+
+
+def check_token(jwt_token, acao):
+    """
+    Verifica o token de uma requisição que exige a ação `acao` com o papel 'admin'.
+
+    - Retorna None se o token permite a ação, ou o corpo e o status da resposta de erro
+    """
+    if not jwt_token:
+        return {'error': 'Token is missing'}, 403
+    try:
+        data = token_cache.verificar(jwt_token, chaveiro=key_ring,
+                                     revogacao=get_revocation_list())
+        if not data.get('valid', False):
+            return data, 403
+        extra_data = data.get('extra_data')
+        if not extra_data:
+            return data, 403
+        if extra_data.get('role') != 'admin' or data.get('action') != acao:
+            return {'error': 'Insufficient permissions'}, 403
+    except Exception as e:
+        return {'error': str(e)}, 403
+    return None
 
 
 def token_required(acao):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            jwt_token = request.headers.get('Authorization')
-            if not jwt_token:
-                return jsonify({'error': 'Token is missing'}), 403
-            try:
-                data = verifica_token_jwt(jwt_token, SECRET_KEY)
-                if not data.get('valid', False):
-                    return jsonify(data), 403
-                extra_data = data.get('extra_data')
-                if not extra_data:
-                    return jsonify(data), 403
-                if extra_data.get('role') != 'admin' or data.get('action') != acao:
-                    return jsonify({'error': 'Insufficient permissions'}), 403
-            except Exception as e:
-                return jsonify({'error': str(e)}), 403
+            error = check_token(request.headers.get('Authorization'), acao)
+            if error is not None:
+                return jsonify(error[0]), error[1]
             return f(*args, **kwargs)
 
         return decorated_function
@@ -53,86 +289,794 @@ def token_required(acao):
     return decorator
 
 
+def parse_login(data):
+    """
+    Valida o corpo de um pedido de login.
+
+    - Retorna `(email, password, otp, actions)` e None, ou None e a mensagem de erro
+    """
+    email = data.get('email')
+    password = data.get('password')
+    otp = data.get('otp')
+    actions = data.get('actions', list(ACTIONS))
+    if not isinstance(email, str) or not isinstance(password, str) or \
+            (otp is not None and not isinstance(otp, str)):
+        return None, 'Missing data'
+    if not isinstance(actions, list) or not actions or \
+            any(not isinstance(a, str) or a.lower() not in ACTIONS for a in actions):
+        return None, 'Invalid actions'
+    return (email, password, otp, list(dict.fromkeys(a.lower() for a in actions))), None
+
+
+def login_account_key(remote_addr, account):
+    """
+    Chave do balde de tentativas de uma conta a partir de um endereço IP
+    """
+    return f"{remote_addr or ''} {account}"
+
+
+def limit_login(remote_addr, account):
+    """
+    Consome uma tentativa de login do endereço IP e da conta a partir desse endereço.
+
+    - Retorna None se a tentativa é permitida, ou os segundos até a próxima
+    """
+    allowed, retry_after = login_ip_limiter.consumir(remote_addr or '')
+    if not allowed:
+        return retry_after
+    allowed, retry_after = login_account_limiter.consumir(login_account_key(remote_addr, account))
+    if not allowed:
+        return retry_after
+    return None
+
+
+def can_sign():
+    """
+    Indica se há uma chave ativa, com a parte privada, para emitir tokens
+    """
+    key = key_ring.ativa[1]
+    return key is not None and key.assinatura is not None
+
+
+# Resposta das rotas que emitem tokens quando não há chave para assiná-los
+SIGNING_UNAVAILABLE = {'error': 'Token signing unavailable'}, 503
+
+
+def issue_login_tokens(remote_addr, account, actions):
+    """
+    Emite os access tokens e o refresh token de um usuário autenticado; retorna o corpo e o
+    status da resposta
+    """
+    if not can_sign():
+        return SIGNING_UNAVAILABLE
+    login_account_limiter.limpar(login_account_key(remote_addr, account))
+    role = app.config['LOGIN_ROLE']
+    tokens = {action: criar_token_jwt(sub=account,
+                                      chaveiro=key_ring,
+                                      action=action,
+                                      expires_in=ACCESS_TOKEN_EXPIRES_IN,
+                                      extra_data={'role': role})
+              for action in actions}
+    return {'tokens'       : tokens,
+            'expires_in'   : ACCESS_TOKEN_EXPIRES_IN,
+            'refresh_token': start_session(account, role, actions)}, 200
+
+
+def _too_many_attempts(retry_after):
+    response = jsonify({'error': 'Too many login attempts'})
+    response.headers['Retry-After'] = str(math.ceil(retry_after))
+    return response, 429
+
+
+@app.route('/login', methods=['POST'])
+def login_user():
+    """
+    Autentica o usuário com senha e código OTP (ou código de backup) e emite um access token
+    para cada ação pedida, além de um refresh token.
+
+    - As tentativas são limitadas por endereço IP e por conta a partir de cada endereço,
+      antes de qualquer hash
+    - Os hashes rodam no pool de processos do `ServicoHash`, fora da thread da requisição;
+      com a fila cheia, a requisição é recusada com 503
+    """
+    parsed, error = parse_login(request.get_json(silent=True) or {})
+    if error is not None:
+        return jsonify({'error': error}), 400
+    email, password, otp, actions = parsed
+    account = email.lower()
+    retry_after = limit_login(request.remote_addr, account)
+    if retry_after is not None:
+        return _too_many_attempts(retry_after)
+
+    try:
+        with get_auth_pool().conexao() as conn:
+            authenticated = login(conn, email, password, otp, servico=get_hash_service())
+    except FilaCheiaError:
+        response = jsonify({'error': 'Service busy'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    if not authenticated:
+        return jsonify({'error': 'Invalid credentials'}), 401
+    body, status = issue_login_tokens(request.remote_addr, account, actions)
+    return jsonify(body), status
+
+
+def refresh_session(data):
+    """
+    Troca um refresh token por um novo e por um access token para a ação pedida.
+
+    - Cada refresh token só pode ser usado uma vez; reusar um token já trocado encerra a
+      sessão inteira
+    - Retorna o corpo e o status da resposta
+    """
+    token = data.get('refresh_token')
+    action = data.get('action')
+    if not isinstance(token, str) or not isinstance(action, str):
+        return {'error': 'Missing data'}, 400
+    # Sem chave para o novo access token, o refresh token não é consumido
+    if not can_sign():
+        return SIGNING_UNAVAILABLE
+
+    sessions = get_sessions()
+    session = sessions.consultar(token)
+    if session is not None and action.lower() not in session['dados'].get('actions', []):
+        return {'error': 'Insufficient permissions'}, 403
+
+    session, reason = sessions.renovar(token)
+    if session is None:
+        return {'error': 'Invalid refresh token', 'reason': reason}, 401
+
+    access_token = criar_token_jwt(sub=session['sub'],
+                                   chaveiro=key_ring,
+                                   action=action,
+                                   expires_in=ACCESS_TOKEN_EXPIRES_IN,
+                                   extra_data=session['dados'].get('extra_data'))
+    return {'access_token' : access_token,
+            'expires_in'   : ACCESS_TOKEN_EXPIRES_IN,
+            'refresh_token': session['refresh_token']}, 200
+
+
+def end_session(data):
+    token = data.get('refresh_token')
+    if not isinstance(token, str):
+        return {'error': 'Missing data'}, 400
+    if not get_sessions().encerrar(token):
+        return {'error': 'Invalid refresh token'}, 401
+    return {'message': 'Session ended'}, 200
+
+
+@app.route('/token/refresh', methods=['POST'])
+def refresh_token():
+    body, status = refresh_session(request.get_json(silent=True) or {})
+    return jsonify(body), status
+
+
+@app.route('/token/revoke', methods=['POST'])
+def revoke_refresh_token():
+    body, status = end_session(request.get_json(silent=True) or {})
+    return jsonify(body), status
+
+
+def parse_list_args(args):
+    """
+    Valida os parâmetros de `/users`.
+
+    - Retorna `(after, limit, stream)` e None, ou None e a mensagem de erro
+    """
+    after = args.get('after')
+    limit = args.get('limit')
+    stream = args.get('stream')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            return None, 'Invalid limit'
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            return None, 'Invalid limit'
+    if stream is not None and stream not in ('ndjson', 'json'):
+        return None, 'Invalid stream format'
+    return (after, limit, stream), None
+
+
+def validators(etag, updated_at, now):
+    """
+    Cabeçalhos de validação de uma resposta: o ETag forte e o Last-Modified; `no-cache` faz
+    os caches revalidarem a cada uso, o que custa apenas um 304 se nada mudou.
+
+    - Last-Modified tem resolução de segundos, e duas escritas no mesmo segundo teriam a
+      mesma data. Ele é o segundo seguinte a `updated_at`, e só é enviado se a alteração
+      tiver ao menos `LAST_MODIFIED_MARGIN` segundos em `now` (o instante da leitura): uma
+      escrita posterior cai sempre em um segundo maior, então nunca recebe um 304
+    - Alterações mais recentes são validadas apenas pelo ETag
+    """
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if updated_at <= now - LAST_MODIFIED_MARGIN:
+        headers['Last-Modified'] = formatdate(math.floor(updated_at) + 1, usegmt=True)
+    return headers
+
+
+def not_modified(headers, if_none_match, if_modified_since):
+    """
+    Avalia as pré-condições de um GET condicional com os cabeçalhos de validação da versão
+    atual: se o cliente já a tem, a resposta é 304. If-None-Match tem precedência sobre
+    If-Modified-Since (RFC 9110), que só vale se houver Last-Modified
+    """
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or any(tag.removeprefix('W/') == headers['ETag'] for tag in tags)
+    if if_modified_since and 'Last-Modified' in headers:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return parsedate_to_datetime(headers['Last-Modified']).timestamp() <= since
+    return False
+
+
+def fetch_users(conn, after, limit, if_none_match=None, if_modified_since=None):
+    """
+    Usuários da tabela inteira (sem `after` e `limit`) ou de uma página, com os cabeçalhos
+    de validação.
+
+    - O ETag vem da versão da tabela, lida na mesma transação que os usuários, então
+      corresponde exatamente ao conteúdo
+    - Se o cliente já tem a versão atual, retorna None no lugar dos usuários, sem consultar
+      a tabela nem gerar o JSON
+    """
+    conn.execute('BEGIN')
+    try:
+        version, updated_at, now = conn.execute(f'SELECT version, updated_at, {NOW} '
+                                                'FROM users_meta WHERE id = 1').fetchone()
+        headers = validators(f'"v{version}"', updated_at, now)
+        # Ponto do registro de alterações em que está esta leitura, para continuar por
+        # `/changes?since=`
+        headers['X-Change-Seq'] = str(version)
+        if not_modified(headers, if_none_match, if_modified_since):
+            return None, headers
+        if after is None and limit is None:
+            cursor = conn.execute('SELECT email, name, telephone FROM users')
+        else:
+            cursor = conn.execute(*_users_page_query(after, limit or MAX_PAGE_SIZE))
+        return [{'email': user[0], 'name': user[1], 'telephone': user[2]}
+                for user in cursor.fetchall()], headers
+    finally:
+        conn.rollback()
+
+
 @app.route('/users', methods=['GET'])
 def list_users():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users')
-    users = cursor.fetchall()
-    conn.close()
-    return jsonify([{'email': user[0], 'name': user[1], 'telephone': user[2]} for user in users])
+    """
+    Lista os usuários.
 
+    - Sem parâmetros, retorna a tabela inteira em uma lista JSON
+    - `limit` e `after` ativam a paginação por chave (keyset) em `email`: retorna até `limit`
+      usuários com email maior que `after`; se houver mais, o cabeçalho `Link` (rel="next")
+      e `X-Next-After` indicam o cursor da próxima página
+    - `stream=ndjson` (um objeto por linha) ou `stream=json` (lista JSON) envia o resultado
+      diretamente do cursor, em blocos, com memória constante
+    - Fora do modo stream, aceita GET condicional (If-None-Match e If-Modified-Since)
+    """
+    parsed, error = parse_list_args(request.args)
+    if error is not None:
+        return jsonify({'error': error}), 400
+    after, limit, stream = parsed
 
-@app.route('/user/<email>', methods=['GET'])
-def get_user(email):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users WHERE email = ?', (email,))
+    if stream is not None:
+        mimetype = 'application/x-ndjson' if stream == 'ndjson' else 'application/json'
+        return Response(stream_users(stream, after, limit), mimetype=mimetype)
+
+    users, headers = fetch_users(get_db(), after, limit, request.headers.get('If-None-Match'),
+                                 request.headers.get('If-Modified-Since'))
+    if users is None:
+        return Response(status=304, headers=headers)
+    response = jsonify(users)
+    response.headers.update(headers)
+    if (after is not None or limit is not None) and len(users) == (limit or MAX_PAGE_SIZE):
+        next_after = users[-1]['email']
+        response.headers['X-Next-After'] = next_after
+        response.headers['Link'] = '<{}>; rel="next"'.format(
+            url_for('list_users', limit=limit or MAX_PAGE_SIZE, after=next_after))
+    return response
+
+
+def _users_page_query(after, limit):
+    if after is None:
+        return ('SELECT email, name, telephone FROM users ORDER BY email LIMIT ?',
+                (-1 if limit is None else limit,))
+    return ('SELECT email, name, telephone FROM users WHERE email > ? ORDER BY email LIMIT ?',
+            (after, -1 if limit is None else limit))
+
+
+def stream_users(stream, after, limit):
+    # O gerador usa uma conexão própria, pois roda depois do fim do contexto da requisição
+    with get_pool().conexao() as conn:
+        cursor = conn.execute(*_users_page_query(after, limit))
+        try:
+            separator = ''
+            if stream == 'json':
+                yield '['
+            while True:
+                rows = cursor.fetchmany(STREAM_CHUNK_SIZE)
+                if not rows:
+                    break
+                objects = [json.dumps({'email': row[0], 'name': row[1], 'telephone': row[2]},
+                                      ensure_ascii=False)
+                           for row in rows]
+                if stream == 'ndjson':
+                    yield '\n'.join(objects) + '\n'
+                else:
+                    yield separator + ','.join(objects)
+                    separator = ','
+            if stream == 'json':
+                yield ']'
+        finally:
+            cursor.close()
+
+
+def parse_changes_args(args):
+    """
+    Valida os parâmetros de `/changes`.
+
+    - Retorna `since` e None, ou None e a mensagem de erro
+    """
+    try:
+        since = int(args.get('since', 0))
+    except ValueError:
+        return None, 'Invalid since'
+    if since < 0:
+        return None, 'Invalid since'
+    return since, None
+
+
+def _change(row):
+    seq, op, email, name, telephone = row
+    if op == 'delete':
+        return {'seq': seq, 'op': op, 'email': email}
+    return {'seq': seq, 'op': op, 'email': email, 'name': name, 'telephone': telephone}
+
+
+def stream_changes(since):
+    """
+    Alterações com `seq` maior que `since`, em NDJSON, lidas em uma única transação.
+
+    - O primeiro valor gerado é o `seq` mais recente, ou None se a compactação já descartou
+      alterações posteriores a `since` (o cliente precisa recomeçar por `/users`); os
+      seguintes são os blocos do corpo
+    - Cada linha tem `seq`, `op` ('insert', 'update' ou 'delete') e `email`, e também `name`
+      e `telephone` fora das remoções. Depois da compactação, só a última alteração de cada
+      email é mantida: 'insert' e 'update' devem ser aplicados da mesma forma
+    """
+    with get_pool().conexao() as conn:
+        conn.execute('BEGIN')
+        try:
+            version, floor = conn.execute('SELECT version, changes_floor FROM users_meta '
+                                          'WHERE id = 1').fetchone()
+            if since < floor:
+                yield None
+                return
+            yield version
+            cursor = conn.execute('SELECT seq, op, email, name, telephone FROM users_changes '
+                                  'WHERE seq > ? ORDER BY seq', (since,))
+            while True:
+                rows = cursor.fetchmany(STREAM_CHUNK_SIZE)
+                if not rows:
+                    break
+                yield ''.join(json.dumps(_change(row), ensure_ascii=False) + '\n'
+                              for row in rows)
+        finally:
+            conn.rollback()
+
+
+def compact_changes(conn, retention=CHANGES_RETENTION):
+    """
+    Compacta o registro de alterações e retorna o número de registros descartados.
+
+    - De cada email, só a última alteração é mantida: quem sincroniza chega ao mesmo estado
+    - Remoções com mais de `retention` segundos são descartadas, e `changes_floor` passa a
+      ser o maior `seq` descartado; clientes com `since` anterior a ele recomeçam por
+      `/users`
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        removed = conn.execute('DELETE FROM users_changes '
+                               'WHERE EXISTS (SELECT 1 FROM users_changes AS later '
+                               '              WHERE later.email = users_changes.email '
+                               '                AND later.seq > users_changes.seq)').rowcount
+        floor = conn.execute(f"SELECT max(seq) FROM users_changes "
+                             f"WHERE op = 'delete' AND changed_at <= {NOW} - ?",
+                             (retention,)).fetchone()[0]
+        if floor is not None:
+            removed += conn.execute("DELETE FROM users_changes WHERE op = 'delete' AND seq <= ?",
+                                    (floor,)).rowcount
+            conn.execute('UPDATE users_meta SET changes_floor = max(changes_floor, ?) '
+                         'WHERE id = 1', (floor,))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return removed
+
+
+@app.route('/changes', methods=['GET'])
+def list_changes():
+    """
+    Alterações posteriores a `since` (default: 0), em NDJSON, para manter réplicas da agenda.
+
+    - `X-Change-Seq` é o `seq` mais recente no momento da leitura, o `since` da próxima
+      chamada; a primeira cópia vem de `/users`, que tem o mesmo cabeçalho
+    - Se a compactação já descartou alterações posteriores a `since`, a resposta é 410
+    """
+    since, error = parse_changes_args(request.args)
+    if error is not None:
+        return jsonify({'error': error}), 400
+    changes = stream_changes(since)
+    head = next(changes)
+    if head is None:
+        changes.close()
+        return jsonify({'error': 'Changes compacted, resync from /users'}), 410
+    return Response(changes, mimetype='application/x-ndjson', headers={'X-Change-Seq': str(head)})
+
+
+@app.cli.command('compact-changes')
+@click.option('--retention', type=float, default=CHANGES_RETENTION, show_default=True,
+              help="Segundos que as remoções permanecem no registro.")
+def compact_changes_command(retention):
+    """
+    Compacta o registro de alterações de `/changes`; para rodar periodicamente:
+    flask --app src.jwtokens.rest_server compact-changes
+    """
+    with get_pool().conexao() as conn:
+        click.echo(f"Registros descartados: {compact_changes(conn, retention)}")
+
+
+def parse_search_args(args):
+    """
+    Valida os parâmetros de `/search`.
+
+    - Retorna `(q, field, match, limit)` e None, ou None e a mensagem de erro
+    - Em `telephone`, apenas os dígitos de `q` são considerados
+    """
+    q = args.get('q')
+    field = args.get('field', 'all')
+    match = args.get('match', 'substring')
+    limit = args.get('limit', SEARCH_DEFAULT_LIMIT)
+    if not q:
+        return None, 'Missing query'
+    if field not in SEARCH_FIELDS:
+        return None, 'Invalid field'
+    if match not in ('substring', 'prefix'):
+        return None, 'Invalid match'
+    try:
+        limit = int(limit)
+    except ValueError:
+        return None, 'Invalid limit'
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return None, 'Invalid limit'
+    if field == 'telephone':
+        q = re.sub(r'\D', '', q)
+        if not q:
+            return None, 'Missing query'
+    # O índice trigram só encontra textos com pelo menos três caracteres; prefixos de
+    # telefone usam o índice de `telephone_digits`
+    if len(q) < 3 and not (field == 'telephone' and match == 'prefix'):
+        return None, 'Query too short'
+    return (q, field, match, limit), None
+
+
+def search_users(conn, q, field, match, limit):
+    """
+    Busca usuários por substring ou prefixo de `name`, `email` ou dos dígitos do telefone.
+
+    - Substrings são buscadas no índice trigram; prefixos também, filtrando o início do
+      campo entre os candidatos
+    - O filtro de prefixo é feito em Python com `casefold()`, que, como o índice, ignora
+      maiúsculas também fora do ASCII (o `lower()` do SQLite só converte A-Z)
+    - Prefixos de telefone usam o índice de `telephone_digits`, como um intervalo
+    - Os resultados seguem a ordem de inserção, o que permite parar no `limit` sem ordenar
+      todas as ocorrências
+    """
+    column = SEARCH_FIELDS[field]
+    if field == 'telephone' and match == 'prefix':
+        # Maior texto com o prefixo: o prefixo seguido do maior caractere
+        cursor = conn.execute('SELECT email, name, telephone FROM users '
+                              'WHERE telephone_digits >= ? AND telephone_digits < ? '
+                              'ORDER BY telephone_digits LIMIT ?', (q, q + '\uffff', limit))
+        return [{'email': user[0], 'name': user[1], 'telephone': user[2]}
+                for user in cursor.fetchall()]
+
+    # Frase FTS5: aspas duplas internas são escritas em dobro
+    phrase = '"' + q.replace('"', '""') + '"'
+    query = phrase if column is None else f'{column} : {phrase}'
+    cursor = conn.execute('SELECT u.email, u.name, u.telephone, u.telephone_digits '
+                          'FROM users_fts f JOIN users u ON u.id = f.rowid '
+                          'WHERE users_fts MATCH ? ORDER BY f.rowid', (query,))
+    # Posições de `name`, `email` e `telephone_digits` em cada linha
+    positions = [1, 0, 3] if column is None else [{'name': 1, 'email': 0}.get(column, 3)]
+    prefix = q.casefold()
+    users = []
+    while len(users) < limit:
+        rows = cursor.fetchmany(limit)
+        if not rows:
+            break
+        users += [{'email': user[0], 'name': user[1], 'telephone': user[2]}
+                  for user in rows
+                  if match == 'substring' or
+                  any(user[i].casefold().startswith(prefix) for i in positions)]
+    cursor.close()
+    return users[:limit]
+
+
+@app.route('/search', methods=['GET'])
+def search():
+    """
+    Busca usuários (ver `search_users()`): `q` é o texto buscado, `field` o campo ('all',
+    'name', 'email' ou 'telephone'), `match` o tipo ('substring' ou 'prefix') e `limit` o
+    número máximo de resultados
+    """
+    parsed, error = parse_search_args(request.args)
+    if error is not None:
+        return jsonify({'error': error}), 400
+    return jsonify(search_users(get_db(), *parsed))
+
+
+def fetch_user(conn, email, if_none_match=None, if_modified_since=None):
+    """
+    Um usuário, com os cabeçalhos de validação; o ETag vem da versão da tabela na última
+    alteração do usuário.
+
+    - Retorna o corpo, o status (304 sem corpo se o cliente já tem a versão atual) e os
+      cabeçalhos
+    """
+    cursor = conn.execute(f'SELECT email, name, telephone, revision, updated_at, {NOW} '
+                          'FROM users WHERE email = ?', (email,))
     user = cursor.fetchone()
-    conn.close()
-    if user:
-        return jsonify({'email': user[0], 'name': user[1], 'telephone': user[2]})
+    if not user:
+        return {'error': 'User not found'}, 404, {}
+    headers = validators(f'"r{user[3]}"', user[4], user[5])
+    if not_modified(headers, if_none_match, if_modified_since):
+        return None, 304, headers
+    return {'email': user[0], 'name': user[1], 'telephone': user[2]}, 200, headers
+
+
+def json_body(data):
+    """
+    Corpo JSON serializado como no `jsonify()`
+    """
+    return (json.dumps(data, separators=(',', ':'), sort_keys=True) + '\n').encode('utf-8')
+
+
+def read_user(email, if_none_match=None, if_modified_since=None):
+    """
+    `fetch_user()` através de `user_cache`: o banco só é consultado nas falhas, e os GETs
+    condicionais são avaliados com os cabeçalhos guardados.
+
+    - Retorna o corpo já serializado (None no 304), o status e os cabeçalhos
+    - Apenas respostas 200 são guardadas
+    """
+    cached = user_cache.obter(email)
+    if cached is None:
+        # A versão é lida antes do banco: se uma escrita invalidar o email durante a
+        # leitura, a resposta lida não é guardada
+        version = user_cache.versao(email)
+        with get_pool().conexao() as conn:
+            body, status, headers = fetch_user(conn, email)
+        body = json_body(body)
+        if status != 200:
+            return body, status, headers
+        user_cache.guardar(email, body, headers, version)
     else:
-        return jsonify({'error': 'User not found'}), 404
+        body, headers = cached
+    if not_modified(headers, if_none_match, if_modified_since):
+        return None, 304, headers
+    return body, 200, headers
 
 
-@app.route('/user/<email>', methods=['DELETE'])
-@token_required('delete')
-def delete_user(email):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM users WHERE email = ?', (email,))
+def delete_user_row(conn, email):
+    conn.execute('DELETE FROM users WHERE email = ?', (email,))
     conn.commit()
-    conn.close()
-    return jsonify({'message': 'User deleted'})
+    user_cache.invalidar(email)
+    return {'message': 'User deleted'}, 200
 
 
-@app.route('/new', methods=['POST'])
-@token_required('create')
-def create_user():
-    data = request.get_json()
+def create_user_row(conn, data):
     email = data.get('email')
     name = data.get('name')
     telephone = data.get('telephone')
     if not email or not name or not telephone:
-        return jsonify({'error': 'Missing data'}), 400
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
+        return {'error': 'Missing data'}, 400
     try:
-        cursor.execute('INSERT INTO users (email, name, telephone) VALUES (?, ?, ?)',
-                       (email, name, telephone))
+        conn.execute('INSERT INTO users (email, name, telephone) VALUES (?, ?, ?)',
+                     (email, name, telephone))
         conn.commit()
     except sqlite3.IntegrityError:
-        return jsonify({'error': 'User already exists'}), 400
-    conn.close()
-    return jsonify({'message': 'User created'})
+        conn.rollback()
+        return {'error': 'User already exists'}, 400
+    user_cache.invalidar(email)
+    return {'message': 'User created'}, 200
 
 
-@app.route('/user/<email>', methods=['PUT'])
-@token_required('update')
-def update_user(email):
-    data = request.get_json()
+def update_user_row(conn, email, data):
     name = data.get('name')
     telephone = data.get('telephone')
     if not name or not telephone:
-        return jsonify({'error': 'Missing data'}), 400
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('UPDATE users SET name = ?, telephone = ? WHERE email = ?',
-                   (name, telephone, email))
+        return {'error': 'Missing data'}, 400
+    conn.execute('UPDATE users SET name = ?, telephone = ? WHERE email = ?',
+                 (name, telephone, email))
     conn.commit()
-    conn.close()
-    return jsonify({'message': 'User updated'})
+    user_cache.invalidar(email)
+    return {'message': 'User updated'}, 200
+
+
+def ndjson_items(lines):
+    """
+    Objetos de um corpo NDJSON, lidos linha a linha; linhas inválidas viram None
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+# Campos obrigatórios e comando de cada operação em lote
+_BULK_FIELDS = {'create': ('email', 'name', 'telephone'),
+                'update': ('email', 'name', 'telephone'),
+                'delete': ('email',)}
+_BULK_SQL = {'create': 'INSERT INTO users (email, name, telephone) VALUES (?, ?, ?)',
+             'update': 'UPDATE users SET name = ?, telephone = ? WHERE email = ?',
+             'delete': 'DELETE FROM users WHERE email = ?'}
+
+
+def bulk_apply(conn, action, items):
+    """
+    Aplica uma operação em lote ('create', 'update' ou 'delete') e retorna o resultado de
+    cada item, na ordem recebida.
+
+    - Os itens são lidos de forma preguiçosa e gravados em transações de `BULK_CHUNK_SIZE`
+      itens, com um `executemany()` por transação
+    - Um item com problema não interrompe o lote: seu resultado é 'invalid' (campos
+      ausentes), 'duplicate' (email já existente) ou 'not_found'; os demais são 'created',
+      'updated' ou 'deleted'
+    """
+    results = []
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, BULK_CHUNK_SIZE))
+        if not chunk:
+            return results
+        results += _bulk_chunk(conn, action, chunk, len(results))
+
+
+def _bulk_chunk(conn, action, chunk, start):
+    fields = _BULK_FIELDS[action]
+    statuses = ['invalid'] * len(chunk)
+    # Campos obrigatórios: textos não vazios
+    valid = [(i, item) for i, item in enumerate(chunk)
+             if isinstance(item, dict) and
+             all(isinstance(item.get(field), str) and item[field] for field in fields)]
+    emails = list({item['email'] for _, item in valid})
+
+    # BEGIN IMMEDIATE reserva a escrita antes da consulta, então nenhum outro processo altera
+    # as linhas consultadas até o commit
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        existing = set()
+        if emails:
+            placeholders = ', '.join('?' * len(emails))
+            existing = {row[0] for row in conn.execute(
+                f'SELECT email FROM users WHERE email IN ({placeholders})', emails)}
+        rows = _bulk_rows(action, valid, existing, statuses)
+        conn.executemany(_BULK_SQL[action], rows)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    for i, item in valid:
+        if statuses[i] in ('created', 'updated', 'deleted'):
+            user_cache.invalidar(item['email'])
+    return [{'index' : start + i,
+             'email' : item.get('email') if isinstance(item, dict) else None,
+             'status': status}
+            for i, (item, status) in enumerate(zip(chunk, statuses))]
+
+
+def _bulk_rows(action, valid, existing, statuses):
+    """
+    Classifica os itens válidos de um bloco, preenchendo `statuses`, e retorna os parâmetros
+    do comando para os que serão gravados; `existing` são os emails já cadastrados
+    """
+    rows = []
+    for i, item in valid:
+        email = item['email']
+        if action == 'create':
+            if email in existing:
+                statuses[i] = 'duplicate'
+                continue
+            existing.add(email)
+            statuses[i] = 'created'
+            rows.append((email, item['name'], item['telephone']))
+        elif email not in existing:
+            statuses[i] = 'not_found'
+        elif action == 'update':
+            statuses[i] = 'updated'
+            rows.append((item['name'], item['telephone'], email))
+        else:
+            existing.discard(email)
+            statuses[i] = 'deleted'
+            rows.append((email,))
+    return rows
+
+
+def bulk_response(results):
+    return {'results': results, 'summary': dict(Counter(r['status'] for r in results))}
+
+
+def _bulk(action):
+    """
+    Operação em lote com o corpo da requisição: uma lista JSON ou NDJSON (um objeto por
+    linha, lido conforme chega)
+    """
+    if request.mimetype == 'application/x-ndjson':
+        items = ndjson_items(request.stream)
+    else:
+        items = request.get_json()
+        if not isinstance(items, list):
+            return jsonify({'error': 'Expected a JSON array or NDJSON'}), 400
+    return jsonify(bulk_response(bulk_apply(get_db(), action, items)))
+
+
+@app.route('/users/bulk', methods=['POST'])
+@token_required('create')
+def create_users():
+    return _bulk('create')
+
+
+@app.route('/users/bulk', methods=['PUT'])
+@token_required('update')
+def update_users():
+    return _bulk('update')
+
+
+@app.route('/users/bulk', methods=['DELETE'])
+@token_required('delete')
+def delete_users():
+    return _bulk('delete')
+
+
+@app.route('/user/<email>', methods=['GET'])
+def get_user(email):
+    body, status, headers = read_user(email, request.headers.get('If-None-Match'),
+                                      request.headers.get('If-Modified-Since'))
+    if status == 304:
+        return Response(status=304, headers=headers)
+    return Response(body, status, headers, mimetype='application/json')
+
+
+@app.route('/user/<email>', methods=['DELETE'])
+@token_required('delete')
+def delete_user(email):
+    body, status = delete_user_row(get_db(), email)
+    return jsonify(body), status
+
+
+@app.route('/new', methods=['POST'])
+@token_required('create')
+def create_user():
+    body, status = create_user_row(get_db(), request.get_json())
+    return jsonify(body), status
+
+
+@app.route('/user/<email>', methods=['PUT'])
+@token_required('update')
+def update_user(email):
+    body, status = update_user_row(get_db(), email, request.get_json())
+    return jsonify(body), status
 
 
 if __name__ == '__main__':
     init_db()
-    print(f"SECRET KEY: {SECRET_KEY} (base64 {SECRET_KEY_BASE64})")
-    for action in ['create', 'update', 'delete']:
-        token = criar_token_jwt(sub='user@domain.tld',
-                                sign_key=SECRET_KEY,
-                                action=action,
-                                expires_in=600,
-                                extra_data={'role': 'admin'})
-        print(f"Token de {action}: {token}")
+    # Os tokens são emitidos pelo /login, para os operadores de AUTH_DATABASE
+    print(f"Chave de assinatura ativa: kid {key_ring.ativa[0]}")
     app.run(debug=False)
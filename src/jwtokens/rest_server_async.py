@@ -0,0 +1,291 @@
+import asyncio
+import json
+import math
+from contextlib import asynccontextmanager
+from functools import wraps
+from urllib.parse import urlencode
+
+import anyio
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.requests import ClientDisconnect
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+
+from src.jwtokens.banco import BancoAsync
+from src.jwtokens.rest_server import (MAX_PAGE_SIZE, app as flask_app, bulk_apply, bulk_response,
+                                      check_token, create_user_row, delete_user_row, end_session,
+                                      fetch_users, get_auth_pool, get_hash_service, get_pool,
+                                      init_db, issue_login_tokens, json_body, limit_login,
+                                      ndjson_items, parse_changes_args, parse_list_args,
+                                      parse_login, parse_search_args, read_user,
+                                      refresh_session, search_users, stream_changes,
+                                      stream_users, update_user_row)
+from src.otp import FilaCheiaError, login_async
+
+# Versão ASGI de `rest_server`, sobre o Starlette, com as mesmas rotas, respostas e
+# configuração (`app.config` do Flask, chaveiro, caches e limitadores são os de
+# `rest_server`). O loop de eventos atende milhares de conexões ociosas sem uma thread por
+# conexão; os acessos ao SQLite rodam no pool de threads de `db`.
+# Para servir: uvicorn src.jwtokens.rest_server_async:app
+db = BancoAsync(max_threads=4)
+
+
+def json_response(data, status_code=200, headers=None):
+    """
+    Resposta JSON, serializada como no `jsonify()` do Flask
+    """
+    return Response(json_body(data), status_code, headers, media_type='application/json')
+
+
+async def read_body(request):
+    """
+    Corpo da requisição, recusado com 413 acima do `MAX_CONTENT_LENGTH` do Flask
+    """
+    limit = flask_app.config['MAX_CONTENT_LENGTH']
+    length = request.headers.get('Content-Length', '')
+    if limit is not None and length.isdigit() and int(length) > limit:
+        raise HTTPException(413, 'Request Entity Too Large')
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if limit is not None and size > limit:
+            raise HTTPException(413, 'Request Entity Too Large')
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+async def read_json(request, silent=False):
+    """
+    Corpo JSON da requisição, como o `request.get_json()` do Flask: 415 se o `Content-Type`
+    não for JSON e 400 se o corpo for inválido, ou None nos dois casos se `silent`
+    """
+    mimetype = request.headers.get('Content-Type', '').split(';')[0].strip().lower()
+    if mimetype != 'application/json' and not (mimetype.startswith('application/') and
+                                               mimetype.endswith('+json')):
+        if silent:
+            return None
+        raise HTTPException(415, 'Unsupported Media Type')
+    body = await read_body(request)
+    try:
+        return json.loads(body)
+    except ValueError:
+        if silent:
+            return None
+        raise HTTPException(400, 'Invalid JSON')
+
+
+def token_required(acao):
+    def decorator(f):
+        @wraps(f)
+        async def decorated_function(request):
+            # A verificação pode consultar a lista de revogação no banco
+            error = await db.chamar(check_token, request.headers.get('Authorization'), acao)
+            if error is not None:
+                return json_response(*error)
+            return await f(request)
+
+        return decorated_function
+
+    return decorator
+
+
+def _too_many_attempts(retry_after):
+    return json_response({'error': 'Too many login attempts'}, 429,
+                         {'Retry-After': str(math.ceil(retry_after))})
+
+
+async def login_user(request):
+    parsed, error = parse_login(await read_json(request, silent=True) or {})
+    if error is not None:
+        return json_response({'error': error}, 400)
+    email, password, otp, actions = parsed
+    account = email.lower()
+    remote_addr = request.client.host if request.client else None
+    retry_after = limit_login(remote_addr, account)
+    if retry_after is not None:
+        return _too_many_attempts(retry_after)
+
+    # Os hashes rodam no pool de processos do `ServicoHash`; as consultas ao banco de
+    # usuários, curtas, rodam no loop, como `login_async()` exige
+    try:
+        with get_auth_pool().conexao() as conn:
+            authenticated = await login_async(conn, email, password, otp,
+                                              servico=get_hash_service())
+    except FilaCheiaError:
+        return json_response({'error': 'Service busy'}, 503, {'Retry-After': '1'})
+    if not authenticated:
+        return json_response({'error': 'Invalid credentials'}, 401)
+    return json_response(*await db.chamar(issue_login_tokens, remote_addr, account, actions))
+
+
+async def refresh_token(request):
+    data = await read_json(request, silent=True) or {}
+    return json_response(*await db.chamar(refresh_session, data))
+
+
+async def revoke_refresh_token(request):
+    data = await read_json(request, silent=True) or {}
+    return json_response(*await db.chamar(end_session, data))
+
+
+async def _stream(chunks):
+    """
+    Envia os blocos de um gerador síncrono que lê o banco, avançando-o no pool de threads.
+
+    - Se o cliente desconectar, o Starlette cancela o envio; o passo em andamento termina
+      antes de o gerador ser fechado, pois um gerador não pode ser fechado enquanto executa
+    """
+    step = None
+    try:
+        while True:
+            step = asyncio.ensure_future(db.chamar(next, chunks, None))
+            chunk = await asyncio.shield(step)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        with anyio.CancelScope(shield=True):
+            if step is not None:
+                await asyncio.wait([step])
+            await db.chamar(chunks.close)
+
+
+async def list_users(request):
+    parsed, error = parse_list_args(request.query_params)
+    if error is not None:
+        return json_response({'error': error}, 400)
+    after, limit, stream = parsed
+
+    if stream is not None:
+        mimetype = 'application/x-ndjson' if stream == 'ndjson' else 'application/json'
+        return StreamingResponse(_stream(stream_users(stream, after, limit)), media_type=mimetype)
+
+    users, headers = await db.executar(get_pool(), fetch_users, after, limit,
+                                       request.headers.get('If-None-Match'),
+                                       request.headers.get('If-Modified-Since'))
+    if users is None:
+        return Response(status_code=304, headers=headers)
+    if (after is not None or limit is not None) and len(users) == (limit or MAX_PAGE_SIZE):
+        next_after = users[-1]['email']
+        headers['X-Next-After'] = next_after
+        headers['Link'] = '<{}/users?{}>; rel="next"'.format(
+            request.scope.get('root_path', ''),
+            urlencode({'limit': limit or MAX_PAGE_SIZE, 'after': next_after}))
+    return json_response(users, headers=headers)
+
+
+async def list_changes(request):
+    since, error = parse_changes_args(request.query_params)
+    if error is not None:
+        return json_response({'error': error}, 400)
+    changes = stream_changes(since)
+    head = await db.chamar(next, changes)
+    if head is None:
+        await db.chamar(changes.close)
+        return json_response({'error': 'Changes compacted, resync from /users'}, 410)
+    return StreamingResponse(_stream(changes), media_type='application/x-ndjson',
+                             headers={'X-Change-Seq': str(head)})
+
+
+async def search(request):
+    parsed, error = parse_search_args(request.query_params)
+    if error is not None:
+        return json_response({'error': error}, 400)
+    return json_response(await db.executar(get_pool(), search_users, *parsed))
+
+
+async def _bulk(request, action):
+    mimetype = request.headers.get('Content-Type', '').split(';')[0].strip().lower()
+    if mimetype == 'application/x-ndjson':
+        items = ndjson_items((await read_body(request)).splitlines())
+    else:
+        items = await read_json(request)
+        if not isinstance(items, list):
+            return json_response({'error': 'Expected a JSON array or NDJSON'}, 400)
+    return json_response(bulk_response(await db.executar(get_pool(), bulk_apply, action, items)))
+
+
+@token_required('create')
+async def create_users(request):
+    return await _bulk(request, 'create')
+
+
+@token_required('update')
+async def update_users(request):
+    return await _bulk(request, 'update')
+
+
+@token_required('delete')
+async def delete_users(request):
+    return await _bulk(request, 'delete')
+
+
+async def get_user(request):
+    body, status, headers = await db.chamar(read_user, request.path_params['email'],
+                                            request.headers.get('If-None-Match'),
+                                            request.headers.get('If-Modified-Since'))
+    if status == 304:
+        return Response(status_code=304, headers=headers)
+    return Response(body, status, headers, media_type='application/json')
+
+
+@token_required('delete')
+async def delete_user(request):
+    return json_response(*await db.executar(get_pool(), delete_user_row,
+                                            request.path_params['email']))
+
+
+@token_required('create')
+async def create_user(request):
+    data = await read_json(request)
+    return json_response(*await db.executar(get_pool(), create_user_row, data))
+
+
+@token_required('update')
+async def update_user(request):
+    data = await read_json(request)
+    return json_response(*await db.executar(get_pool(), update_user_row,
+                                            request.path_params['email'], data))
+
+
+async def http_error(request, exc):
+    return json_response({'error': exc.detail}, exc.status_code, exc.headers)
+
+
+async def client_disconnected(request, exc):
+    # O cliente desconectou antes de enviar o corpo: a resposta não será lida
+    return Response(status_code=400)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    db.encerrar()
+
+
+app = Starlette(routes=[Route('/login', login_user, methods=['POST']),
+                        Route('/token/refresh', refresh_token, methods=['POST']),
+                        Route('/token/revoke', revoke_refresh_token, methods=['POST']),
+                        Route('/users', list_users),
+                        Route('/changes', list_changes),
+                        Route('/search', search),
+                        Route('/users/bulk', create_users, methods=['POST']),
+                        Route('/users/bulk', update_users, methods=['PUT']),
+                        Route('/users/bulk', delete_users, methods=['DELETE']),
+                        Route('/user/{email}', get_user),
+                        Route('/user/{email}', delete_user, methods=['DELETE']),
+                        Route('/user/{email}', update_user, methods=['PUT']),
+                        Route('/new', create_user, methods=['POST'])],
+                exception_handlers={HTTPException   : http_error,
+                                    ClientDisconnect: client_disconnected},
+                lifespan=lifespan)
+
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("É necessário um servidor ASGI, por exemplo: pip install uvicorn")
+    init_db()
+    uvicorn.run(app)
@@ -0,0 +1,194 @@
+import heapq
+import threading
+from time import monotonic, time
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.jwtokens.banco import conectar
+
+# Validade máxima padrão dos tokens verificados com a lista, em segundos: a revogação de
+# todos os tokens de um usuário é mantida por esse tempo
+DURACAO_MAXIMA = 24 * 60 * 60
+
+
+class ListaRevogacao:
+    """
+    Lista de tokens revogados antes de expirar, mantida em memória e gravada em SQLite.
+
+    - Um token é revogado pelo seu `jti`, ou todos os tokens de um usuário (`sub`) emitidos
+      até um instante (logout em todos os dispositivos), com uma única entrada
+    - A verificação consulta apenas dicionários em memória, em tempo constante
+    - As entradas são descartadas quando o token revogado expiraria de qualquer forma: uma
+      fila de prioridade por `exp` remove as vencidas sem percorrer a lista inteira
+    - Outros processos que usam o mesmo banco recebem as novas revogações em até
+      `intervalo` segundos; neste processo, a revogação vale imediatamente
+    - A revogação dos tokens de um usuário é mantida por `duracao_maxima`, que deve ser a
+      maior validade (`exp - iat`) dos tokens verificados; tokens com validade maior
+      sobreviveriam à revogação e por isso são tratados como revogados
+
+    Args:
+        caminho (str): Caminho do banco de dados SQLite (default: ':memory:').
+        duracao_maxima (int): Validade máxima dos tokens, em segundos (default: 24 horas).
+        intervalo (float): Intervalo mínimo, em segundos, entre leituras das revogações
+                           feitas por outros processos (default: 1).
+    """
+
+    def __init__(self,
+                 caminho: str = ':memory:',
+                 duracao_maxima: int = DURACAO_MAXIMA,
+                 intervalo: float = 1.0):
+        self.caminho = caminho
+        self.duracao_maxima = duracao_maxima
+        self.intervalo = intervalo
+        self._jtis: Dict[str, float] = {}
+        self._subs: Dict[str, Tuple[float, float]] = {}  # sub -> (emitidos até, exp)
+        self._expiracoes: List[Tuple[float, str, str]] = []  # (exp, tipo, valor)
+        self._ultimo = 0
+        self._proxima_sincronizacao = 0.0
+        self._lock = threading.Lock()
+        self._conn = conectar(caminho)
+        with self._conn:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS revogacoes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    tipo TEXT NOT NULL,
+                    valor TEXT NOT NULL,
+                    emitidos_ate REAL,
+                    exp REAL NOT NULL
+                );
+            ''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS revogacoes_exp_index '
+                               'ON revogacoes (exp);')
+        self.sincronizar()
+
+    def __len__(self) -> int:
+        return len(self._jtis) + len(self._subs)
+
+    def revogar(self, jti: str, exp: float) -> None:
+        """
+        Revoga um token.
+
+        Args:
+            jti (str): O identificador do token.
+            exp (float): O instante em que o token expira.
+        """
+        self._gravar('jti', jti, None, exp)
+
+    def revogar_sub(self, sub: str, emitidos_ate: Optional[float] = None) -> None:
+        """
+        Revoga todos os tokens de um usuário emitidos antes de um instante.
+
+        - O instante é guardado com fração de segundo e comparado com o `iat` dos tokens,
+          que `criar_token_jwt()` emite com milissegundos: um novo login logo após a
+          revogação, no mesmo segundo, não é alcançado. Tokens com `iat` inteiro emitidos
+          no segundo da revogação são revogados
+
+        Args:
+            sub (str): O usuário.
+            emitidos_ate (Optional[float]): O instante (default: agora).
+        """
+        emitidos_ate = time() if emitidos_ate is None else emitidos_ate
+        self._gravar('sub', str(sub), emitidos_ate, emitidos_ate + self.duracao_maxima)
+
+    def _gravar(self, tipo: str, valor: str, emitidos_ate: Optional[float], exp: float) -> None:
+        if exp <= time():
+            return
+        with self._lock:
+            with self._conn:
+                self._conn.execute('INSERT INTO revogacoes (tipo, valor, emitidos_ate, exp) '
+                                   'VALUES (?, ?, ?, ?)', (tipo, valor, emitidos_ate, exp))
+        self.sincronizar()
+
+    def revogado(self, payload: Dict[str, Any]) -> bool:
+        """
+        Verifica se um token foi revogado.
+
+        Args:
+            payload (Dict[str, Any]): O payload decodificado do token.
+
+        Returns:
+            bool: True se o `jti` do token foi revogado, se o token foi emitido antes da
+                  revogação dos tokens do seu `sub` ou se a sua validade é maior que
+                  `duracao_maxima`.
+        """
+        if monotonic() >= self._proxima_sincronizacao:
+            self.sincronizar()
+
+        iat, exp = payload.get('iat'), payload.get('exp')
+        if isinstance(iat, (int, float)) and isinstance(exp, (int, float)) and \
+                exp - iat > self.duracao_maxima:
+            return True
+
+        jti = payload.get('jti')
+        if jti is not None and jti in self._jtis:
+            return True
+
+        sub = self._subs.get(payload.get('sub'))
+        if sub is not None:
+            return not isinstance(iat, (int, float)) or iat < sub[0]
+        return False
+
+    def sincronizar(self) -> None:
+        """
+        Lê as revogações gravadas por outros processos e descarta as vencidas.
+        """
+        with self._lock:
+            agora = time()
+            self._proxima_sincronizacao = monotonic() + self.intervalo
+            cursor = self._conn.execute('SELECT seq, tipo, valor, emitidos_ate, exp '
+                                        'FROM revogacoes '
+                                        'WHERE seq > ? AND exp > ? '
+                                        'ORDER BY seq', (self._ultimo, agora))
+            for seq, tipo, valor, emitidos_ate, exp in cursor:
+                self._ultimo = seq
+                if tipo == 'jti':
+                    self._jtis[valor] = max(exp, self._jtis.get(valor, exp))
+                else:
+                    atual = self._subs.get(valor, (emitidos_ate, exp))
+                    self._subs[valor] = (max(emitidos_ate, atual[0]), max(exp, atual[1]))
+                heapq.heappush(self._expiracoes, (exp, tipo, valor))
+
+            if self._expiracoes and self._expiracoes[0][0] <= agora:
+                self._compactar(agora)
+
+    def _compactar(self, agora: float) -> None:
+        while self._expiracoes and self._expiracoes[0][0] <= agora:
+            _, tipo, valor = heapq.heappop(self._expiracoes)
+            if tipo == 'jti':
+                if self._jtis.get(valor, agora) <= agora:
+                    self._jtis.pop(valor, None)
+            elif valor in self._subs and self._subs[valor][1] <= agora:
+                del self._subs[valor]
+        with self._conn:
+            self._conn.execute('DELETE FROM revogacoes WHERE exp <= ?', (agora,))
+
+    def fechar(self) -> None:
+        """
+        Fecha a conexão com o banco de dados.
+        """
+        with self._lock:
+            self._conn.close()
+
+
+_listas: Dict[str, ListaRevogacao] = {}
+_listas_lock = threading.Lock()
+
+
+def lista_revogacao(caminho: str, duracao_maxima: int = DURACAO_MAXIMA) -> ListaRevogacao:
+    """
+    Retorna a lista de revogação gravada no banco de dados, criando-a na primeira chamada.
+
+    Args:
+        caminho (str): Caminho do arquivo do banco de dados.
+        duracao_maxima (int): Validade máxima dos tokens, em segundos, usada ao criar a lista
+                              (default: 24 horas).
+
+    Returns:
+        ListaRevogacao: A lista compartilhada para esse caminho.
+    """
+    lista = _listas.get(caminho)
+    if lista is None:
+        with _listas_lock:
+            lista = _listas.get(caminho)
+            if lista is None:
+                lista = _listas[caminho] = ListaRevogacao(caminho, duracao_maxima)
+    return lista
@@ -0,0 +1,43 @@
+import argparse
+from pathlib import Path
+
+from src.jwtokens.chaves import ALGORITMOS, HS256
+from src.jwtokens.chaveiro import VARIAVEL_ARQUIVO, Chaveiro
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Gerencia o arquivo de chaves dos tokens JWT. "
+                                                 "Rotação sem interrupção: 'gerar --publicar', "
+                                                 "'ativar KID' e, depois que os tokens antigos "
+                                                 "expirarem, 'aposentar KID'")
+    parser.add_argument('arquivo', type=Path, help="arquivo JSON com as chaves")
+    comandos = parser.add_subparsers(dest='comando', required=True)
+    gerar = comandos.add_parser('gerar', help="gera uma nova chave")
+    gerar.add_argument('--kid', help="identificador da chave (default: aleatório)")
+    gerar.add_argument('--publicar', action='store_true',
+                       help="apenas publica a chave, sem passar a assinar com ela")
+    gerar.add_argument('--algoritmo', choices=ALGORITMOS, default=HS256,
+                       help="algoritmo da chave (default: HS256)")
+    comandos.add_parser('ativar', help="passa a assinar com a chave").add_argument('kid')
+    comandos.add_parser('aposentar', help="remove a chave").add_argument('kid')
+    comandos.add_parser('listar', help="lista as chaves")
+    comandos.add_parser('exportar', help="grava as chaves públicas, para os serviços que "
+                                         "apenas verificam tokens").add_argument('destino',
+                                                                                 type=Path)
+    args = parser.parse_args()
+
+    chaveiro = Chaveiro.de_arquivo(args.arquivo) if args.arquivo.exists() else Chaveiro()
+    if args.comando == 'gerar':
+        print(f"Chave gerada: {chaveiro.gerar(args.kid, not args.publicar, args.algoritmo)}")
+    elif args.comando == 'ativar':
+        chaveiro.ativar(args.kid)
+    elif args.comando == 'aposentar':
+        chaveiro.aposentar(args.kid)
+    elif args.comando == 'exportar':
+        chaveiro.publico().salvar(args.destino)
+    if args.comando not in ('listar', 'exportar'):
+        chaveiro.salvar(args.arquivo)
+
+    ativa, _ = chaveiro.ativa
+    for kid in chaveiro.kids:
+        print(f"{'*' if kid == ativa else ' '} {kid} ({chaveiro.chave(kid).algoritmo})")
+    print(f"Para usar nesta implantação: export {VARIAVEL_ARQUIVO}={args.arquivo.resolve()}")
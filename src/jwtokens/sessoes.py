@@ -0,0 +1,236 @@
+import hashlib
+import json
+import secrets
+import sqlite3
+from time import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.jwtokens.banco import PoolConexoes
+
+# Tempo, em segundos, que uma sessão sem uso permanece válida (renovado a cada uso)
+VALIDADE = 14 * 24 * 60 * 60
+# Duração máxima de uma sessão, em segundos, desde o login
+VALIDADE_MAXIMA = 30 * 24 * 60 * 60
+
+
+def _hash_token(token: str) -> str:
+    # O token é aleatório, com 256 bits, então um hash rápido é suficiente
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def criar_tabela(conn: sqlite3.Connection) -> None:
+    """
+    Cria a tabela dos refresh tokens, se ainda não existir.
+
+    Args:
+        conn (sqlite3.Connection): Conexão com o banco de dados SQLite.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS refresh_tokens (
+            token_hash TEXT PRIMARY KEY,
+            familia TEXT NOT NULL,
+            sub TEXT NOT NULL,
+            dados TEXT NOT NULL,
+            inicio REAL NOT NULL,
+            expira REAL NOT NULL,
+            usado INTEGER NOT NULL DEFAULT 0
+        );
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS refresh_tokens_familia_index '
+                 'ON refresh_tokens (familia);')
+    conn.execute('CREATE INDEX IF NOT EXISTS refresh_tokens_sub_index '
+                 'ON refresh_tokens (sub);')
+    conn.execute('CREATE INDEX IF NOT EXISTS refresh_tokens_expira_index '
+                 'ON refresh_tokens (expira);')
+    conn.commit()
+
+
+class SessoesRefresh:
+    """
+    Sessões de login mantidas por refresh tokens rotativos e de uso único.
+
+    - O login (verificação da senha) cria uma sessão e o primeiro refresh token; cada
+      renovação troca o refresh token por um novo e por um access token de curta duração
+    - Apenas o SHA-256 dos refresh tokens é gravado
+    - A sessão expira após `validade` segundos sem uso (janela deslizante) ou
+      `validade_maxima` segundos após o login
+    - Todos os refresh tokens de uma sessão formam uma família: a reutilização de um token
+      já trocado indica que ele vazou, e a família inteira é encerrada
+
+    Args:
+        pool (PoolConexoes): Pool de conexões do banco de dados.
+        validade (float): Validade de um refresh token sem uso, em segundos (default: 14
+                          dias).
+        validade_maxima (float): Duração máxima da sessão, em segundos (default: 30 dias).
+    """
+
+    def __init__(self,
+                 pool: PoolConexoes,
+                 validade: float = VALIDADE,
+                 validade_maxima: float = VALIDADE_MAXIMA):
+        self.pool = pool
+        self.validade = validade
+        self.validade_maxima = validade_maxima
+
+    def iniciar(self, sub: str, dados: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Inicia uma sessão, após a autenticação do usuário.
+
+        Args:
+            sub (str): O usuário.
+            dados (Optional[Dict[str, Any]]): Dados da sessão, repassados a cada renovação
+                                              (ex.: papel e ações permitidas).
+
+        Returns:
+            str: O refresh token.
+        """
+        agora = time()
+        token = secrets.token_urlsafe(32)
+        with self.pool.conexao() as conn:
+            with conn:
+                conn.execute('INSERT INTO refresh_tokens '
+                             '(token_hash, familia, sub, dados, inicio, expira) '
+                             'VALUES (?, ?, ?, ?, ?, ?)',
+                             (_hash_token(token), secrets.token_hex(16), str(sub),
+                              json.dumps(dados or {}), agora,
+                              min(agora + self.validade, agora + self.validade_maxima)))
+        return token
+
+    def consultar(self, token: str) -> Optional[Dict[str, Any]]:
+        """
+        Consulta a sessão de um refresh token, sem trocá-lo.
+
+        Args:
+            token (str): O refresh token.
+
+        Returns:
+            Optional[Dict[str, Any]]: `sub` e `dados` da sessão, ou None se o token não
+                                      puder ser usado.
+        """
+        if not isinstance(token, str) or not token:
+            return None
+        with self.pool.conexao() as conn:
+            linha = conn.execute('SELECT sub, dados FROM refresh_tokens '
+                                 'WHERE token_hash = ? AND usado = 0 AND expira > ?',
+                                 (_hash_token(token), time())).fetchone()
+        return {'sub': linha[0], 'dados': json.loads(linha[1])} if linha else None
+
+    def renovar(self, token: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Troca um refresh token por um novo.
+
+        Args:
+            token (str): O refresh token.
+
+        Returns:
+            Tuple[Optional[Dict[str, Any]], Optional[str]]: A sessão (`refresh_token`, `sub`,
+                                                            `dados`) e None ou, se o token
+                                                            não puder ser usado, None e o
+                                                            motivo: 'invalid', 'expired' ou
+                                                            'reused'.
+        """
+        if not isinstance(token, str) or not token:
+            return None, 'invalid'
+        agora = time()
+        token_hash = _hash_token(token)
+        with self.pool.conexao() as conn:
+            with conn:
+                linha = conn.execute('SELECT familia, sub, dados, inicio, expira, usado '
+                                     'FROM refresh_tokens '
+                                     'WHERE token_hash = ?', (token_hash,)).fetchone()
+                if linha is None:
+                    return None, 'invalid'
+                familia, sub, dados, inicio, expira, usado = linha
+                if usado:
+                    self._encerrar_familia(conn, familia)
+                    return None, 'reused'
+                if expira <= agora:
+                    self._encerrar_familia(conn, familia)
+                    return None, 'expired'
+
+                # Marca o token como usado; se outra requisição o usou antes, é reutilização
+                cursor = conn.execute('UPDATE refresh_tokens SET usado = 1 '
+                                      'WHERE token_hash = ? AND usado = 0', (token_hash,))
+                if cursor.rowcount != 1:
+                    self._encerrar_familia(conn, familia)
+                    return None, 'reused'
+
+                novo = secrets.token_urlsafe(32)
+                conn.execute('INSERT INTO refresh_tokens '
+                             '(token_hash, familia, sub, dados, inicio, expira) '
+                             'VALUES (?, ?, ?, ?, ?, ?)',
+                             (_hash_token(novo), familia, sub, dados, inicio,
+                              min(agora + self.validade, inicio + self.validade_maxima)))
+        return {'refresh_token': novo, 'sub': sub, 'dados': json.loads(dados)}, None
+
+    @staticmethod
+    def _encerrar_familia(conn: sqlite3.Connection, familia: str) -> None:
+        conn.execute('DELETE FROM refresh_tokens WHERE familia = ?', (familia,))
+
+    def encerrar(self, token: str) -> bool:
+        """
+        Encerra a sessão de um refresh token (logout).
+
+        Args:
+            token (str): Um refresh token da sessão.
+
+        Returns:
+            bool: True se a sessão existia.
+        """
+        with self.pool.conexao() as conn:
+            with conn:
+                linha = conn.execute('SELECT familia FROM refresh_tokens WHERE token_hash = ?',
+                                     (_hash_token(token),)).fetchone()
+                if linha is None:
+                    return False
+                self._encerrar_familia(conn, linha[0])
+        return True
+
+    def encerrar_sub(self, sub: str) -> int:
+        """
+        Encerra todas as sessões de um usuário (logout em todos os dispositivos).
+
+        Args:
+            sub (str): O usuário.
+
+        Returns:
+            int: Número de refresh tokens removidos.
+        """
+        with self.pool.conexao() as conn:
+            with conn:
+                return conn.execute('DELETE FROM refresh_tokens WHERE sub = ?',
+                                    (str(sub),)).rowcount
+
+    def compactar(self) -> int:
+        """
+        Remove os refresh tokens expirados e os já trocados cuja sessão expirou.
+
+        Returns:
+            int: Número de refresh tokens removidos.
+        """
+        with self.pool.conexao() as conn:
+            with conn:
+                # Tokens já usados continuam gravados enquanto a família estiver ativa, para
+                # detectar a reutilização; saem junto com o último token da família
+                return conn.execute('DELETE FROM refresh_tokens '
+                                    'WHERE familia IN (SELECT familia '
+                                    '                  FROM refresh_tokens '
+                                    '                  GROUP BY familia '
+                                    '                  HAVING MAX(expira) <= ?)',
+                                    (time(),)).rowcount
+
+    def sessoes(self, sub: str) -> List[Dict[str, Any]]:
+        """
+        Lista as sessões ativas de um usuário.
+
+        Args:
+            sub (str): O usuário.
+
+        Returns:
+            List[Dict[str, Any]]: `inicio` e `expira` de cada sessão.
+        """
+        with self.pool.conexao() as conn:
+            cursor = conn.execute('SELECT inicio, expira FROM refresh_tokens '
+                                  'WHERE sub = ? AND usado = 0 AND expira > ? '
+                                  'ORDER BY inicio', (str(sub), time()))
+            return [{'inicio': inicio, 'expira': expira} for inicio, expira in cursor]
@@ -1,10 +1,26 @@
+import asyncio
 import secrets
 import sqlite3
-from typing import List, Optional, Tuple
+from concurrent.futures import Future
+from typing import Any, Generator, List, Optional, Tuple, Union
 
 import pyotp
 from werkzeug.security import check_password_hash, generate_password_hash
 
+from src.otp.codigos import definir_chave_codigos, lookup_codigo
+from src.otp.hashing import (ConfiguracaoHash, calibrar_hash, configuracao_hash,
+                             definir_configuracao_hash)
+from src.otp.importacao import importar_usuarios, ler_csv, ler_jsonl
+from src.otp.servico import FilaCheiaError, ServicoHash, servico_hash_padrao
+from src.senhas.vazadas import FiltroSenhasVazadas
+
+__all__ = [
+    'ConfiguracaoHash', 'FilaCheiaError', 'ServicoHash', 'calibrar_hash', 'configuracao_hash',
+    'criar_banco', 'criar_usuario', 'criar_usuario_async', 'definir_chave_codigos',
+    'definir_configuracao_hash', 'gerar_codigos_reserva', 'importar_usuarios', 'ler_csv',
+    'ler_jsonl', 'login', 'login_async', 'migrar_banco', 'servico_hash_padrao',
+]
+
 
 def criar_banco(filename: str = 'usuarios.db') -> sqlite3.Connection:
     """
@@ -37,45 +53,145 @@ def criar_banco(filename: str = 'usuarios.db') -> sqlite3.Connection:
                                     CONSTRAINT backupkeys_usuarios_id_fk
                                     REFERENCES usuarios(id) ON DELETE CASCADE,
                         backup_code TEXT NOT NULL,
-                        used        BOOLEAN NOT NULL DEFAULT 0
+                        used        BOOLEAN NOT NULL DEFAULT 0,
+                        lookup      TEXT
                     );""")
     cursor.execute("CREATE INDEX backupkeys_user_id_index ON backupkeys(user_id);")
+    cursor.execute("CREATE INDEX backupkeys_lookup_index ON backupkeys(user_id, lookup);")
     conn.commit()
     return conn
 
 
-def criar_usuario(conn: sqlite3.Connection,
-                  email: str = None,
-                  senha: str = None,
-                  use_otp: bool = False) -> \
-                                Optional[Tuple[Optional[str], Optional[str], Optional[List[str]]]]:
+def migrar_banco(conn: sqlite3.Connection) -> List[str]:
     """
-        Cria um novo usuário na base de dados.
+        Atualiza um banco criado por versões anteriores de `criar_banco()`, preservando os dados
 
-        - O email é armazenado em letras minúsculas para garantir consistência.
-        - A senha é armazenada como um hash usando `generate_password_hash()`.
-        - Gera um segredo OTP usando `pyotp.random_base32()`.
-        - Gera 5 códigos de backup de 6 caracteres cada, armazenando-os na tabela `backupkeys`
-          em formato hash.
-        - Retorna o segredo OTP e os códigos de backup em texto plano para o usuário.
+        - Adiciona a coluna `lookup` (HMAC do código) e o índice `(user_id, lookup)` à tabela
+          `backupkeys`
+        - Os códigos já existentes não podem ter o HMAC calculado, pois só o hash lento é
+          armazenado; eles são invalidados (`used = 1`), e os usuários afetados devem gerar
+          novos códigos com `gerar_codigos_reserva()`
 
         Arguments:
             conn (sqlite3.Connection): Conexão com o banco de dados SQLite.
-            email (str): Email do usuário.
-            senha (str): Senha em texto plano.
-            use_otp (bool): O usuário vai utilizar 2FA (default: False)
 
         Returns:
-            None se o usuário já existir; Tuple[str, str, List[str]] contendo segredo OTP, URI
-            para configuração do autenticador e lista de códigos de backup em texto plano se
-            usuário tiver configurado 2FA.
+            List[str]: Os emails dos usuários que tiveram códigos invalidados.
     """
+    colunas = [coluna[1] for coluna in conn.execute("PRAGMA table_info(backupkeys);")]
+    if 'lookup' not in colunas:
+        conn.execute("ALTER TABLE backupkeys ADD COLUMN lookup TEXT;")
+    conn.execute("CREATE INDEX IF NOT EXISTS backupkeys_lookup_index "
+                 "ON backupkeys(user_id, lookup);")
+    cursor = conn.execute("SELECT DISTINCT u.email "
+                          "FROM backupkeys b JOIN usuarios u ON u.id = b.user_id "
+                          "WHERE b.lookup IS NULL AND b.used = 0 "
+                          "ORDER BY u.email")
+    afetados = [email for email, in cursor]
+    conn.execute("UPDATE backupkeys "
+                 "SET used = 1 "
+                 "WHERE lookup IS NULL AND used = 0")
+    conn.commit()
+    return afetados
+
+
+# As regras de criação de usuário e de login são escritas como geradores ("etapas") que
+# produzem pedidos de hash (ou listas de pedidos, executáveis em paralelo) e recebem os
+# resultados. Assim a mesma lógica roda de forma síncrona, na thread chamadora, ou de forma
+# assíncrona, com os hashes executados pelo `ServicoHash`
+_GERAR = 'gerar'
+_VERIFICAR = 'verificar'
+
+_ALFABETO_CODIGOS = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+
+
+def _novos_codigos(quantidade: int) -> List[str]:
+    return ["".join(secrets.choice(_ALFABETO_CODIGOS) for _ in range(6))
+            for _ in range(quantidade)]
+
+
+def _executar_pedido(pedido: Tuple[str, str, str]) -> Union[str, bool]:
+    if pedido[0] == _GERAR:
+        return generate_password_hash(pedido[1], method=pedido[2])
+    return check_password_hash(pedido[1], pedido[2])
+
+
+def _submeter_pedido(servico: ServicoHash, pedido: Tuple[str, str, str]) -> Future:
+    if pedido[0] == _GERAR:
+        return servico.gerar(pedido[1], pedido[2])
+    return servico.verificar(pedido[1], pedido[2])
+
+
+def _executar(etapas: Generator) -> Any:
+    try:
+        pedido = next(etapas)
+        while True:
+            if isinstance(pedido, list):
+                resultado = [_executar_pedido(p) for p in pedido]
+            else:
+                resultado = _executar_pedido(pedido)
+            pedido = etapas.send(resultado)
+    except StopIteration as fim:
+        return fim.value
+
+
+def _executar_servico(etapas: Generator, servico: ServicoHash) -> Any:
+    try:
+        pedido = next(etapas)
+        while True:
+            if isinstance(pedido, list):
+                futuros = []
+                try:
+                    for p in pedido:
+                        futuros.append(_submeter_pedido(servico, p))
+                except FilaCheiaError:
+                    for futuro in futuros:
+                        futuro.cancel()
+                    raise
+                resultado = [futuro.result() for futuro in futuros]
+            else:
+                resultado = _submeter_pedido(servico, pedido).result()
+            pedido = etapas.send(resultado)
+    except StopIteration as fim:
+        return fim.value
+
+
+async def _executar_async(etapas: Generator, servico: ServicoHash) -> Any:
+    try:
+        pedido = next(etapas)
+        while True:
+            if isinstance(pedido, list):
+                futuros = []
+                try:
+                    for p in pedido:
+                        futuros.append(_submeter_pedido(servico, p))
+                except FilaCheiaError:
+                    for futuro in futuros:
+                        futuro.cancel()
+                    raise
+                resultado = list(await asyncio.gather(*(asyncio.wrap_future(f)
+                                                        for f in futuros)))
+            else:
+                resultado = await asyncio.wrap_future(_submeter_pedido(servico, pedido))
+            pedido = etapas.send(resultado)
+    except StopIteration as fim:
+        return fim.value
+
+
+def _criar_usuario_etapas(conn: sqlite3.Connection,
+                          email: Optional[str],
+                          senha: Optional[str],
+                          use_otp: bool,
+                          vazadas: Optional[FiltroSenhasVazadas]) -> Generator:
     if email is None or senha is None:
         return None
 
     if email.strip() == "" or senha.strip() == "":
         return None
 
+    if vazadas is not None and senha in vazadas:
+        return None
+
     cursor = conn.cursor()
 
     cursor.execute("SELECT id "
@@ -84,49 +200,112 @@ def criar_usuario(conn: sqlite3.Connection,
     if cursor.fetchone():
         return None
 
-    senha_hash = generate_password_hash(senha)
+    # Hash the password and the backup codes together
+    metodo = configuracao_hash().texto
+    backup_codes = _novos_codigos(5) if use_otp else []
+    hashes = yield [(_GERAR, senha, metodo)] + [(_GERAR, code, metodo) for code in backup_codes]
+    senha_hash, hashed_codes = hashes[0], hashes[1:]
+
     otp_secret = pyotp.random_base32() if use_otp else ""
 
-    cursor.execute("INSERT INTO usuarios "
-                   "(email, senha_hash, otp_secret, use_otp) "
-                   "VALUES (?, ?, ?, ?)", (email.lower(), senha_hash, otp_secret, use_otp))
+    try:
+        cursor.execute("INSERT INTO usuarios "
+                       "(email, senha_hash, otp_secret, use_otp) "
+                       "VALUES (?, ?, ?, ?)", (email.lower(), senha_hash, otp_secret, use_otp))
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        return None  # Created concurrently while hashing
+    user_id = cursor.lastrowid
+
+    cursor.executemany("INSERT INTO backupkeys "
+                       "(user_id, backup_code, used, lookup) "
+                       "VALUES (?, ?, False, ?)",
+                       [(user_id, hashed_code, lookup_codigo(user_id, code))
+                        for code, hashed_code in zip(backup_codes, hashed_codes)])
 
     conn.commit()
 
     if not use_otp:
         return None, None, None
 
-    backup_codes = gerar_codigos_reserva(conn, email, senha, 5)
     otp_uri = pyotp.totp.TOTP(otp_secret).provisioning_uri(name=email.lower(),
                                                            issuer_name="Minha aplicação")
 
     return otp_secret, otp_uri, backup_codes
 
 
-def login(conn: sqlite3.Connection,
-          email: str,
-          senha: str,
-          otp: str = None) -> bool:
+def criar_usuario(conn: sqlite3.Connection,
+                  email: str = None,
+                  senha: str = None,
+                  use_otp: bool = False,
+                  vazadas: Optional[FiltroSenhasVazadas] = None) -> \
+                                Optional[Tuple[Optional[str], Optional[str], Optional[List[str]]]]:
     """
-    Verifica as credenciais do usuário para autenticação.
+        Cria um novo usuário na base de dados.
 
-    - O email é convertido para letras minúsculas antes da busca no banco de dados.
-    - A senha é validada usando `check_password_hash()`.
-    - O código OTP é validado usando `totp.verify()`.
-    - Caso o OTP falhe, verifica se o código fornecido corresponde a um código de backup não
-      utilizado.
-    - Se um código de backup for usado, ele é marcado como "usado" (`used = True`).
+        - O email é armazenado em letras minúsculas para garantir consistência.
+        - Se um filtro de senhas vazadas for informado, senhas presentes nele são recusadas.
+        - A senha é armazenada como um hash usando a configuração de `configuracao_hash()`.
+        - Gera um segredo OTP usando `pyotp.random_base32()`.
+        - Gera 5 códigos de backup de 6 caracteres cada, armazenando-os na tabela `backupkeys`
+          em formato hash.
+        - Retorna o segredo OTP e os códigos de backup em texto plano para o usuário.
 
-    Args:
-        conn (sqlite3.Connection): Conexão com o banco de dados SQLite.
-        email (str): Email do usuário.
-        senha (str): Senha em texto plano.
-        otp (str): Código OTP ou código de backup.
+        Arguments:
+            conn (sqlite3.Connection): Conexão com o banco de dados SQLite.
+            email (str): Email do usuário.
+            senha (str): Senha em texto plano.
+            use_otp (bool): O usuário vai utilizar 2FA (default: False)
+            vazadas (Optional[FiltroSenhasVazadas]): Filtro de senhas vazadas a ser consultado
+                                                     (default: None)
 
-    Returns:
-         bool: `True` se a autenticação for bem-sucedida, `False` caso contrário.
+        Returns:
+            None se o usuário já existir ou se a senha constar no filtro de senhas vazadas;
+            Tuple[str, str, List[str]] contendo segredo OTP, URI para configuração do
+            autenticador e lista de códigos de backup em texto plano se usuário tiver
+            configurado 2FA.
+    """
+    return _executar(_criar_usuario_etapas(conn, email, senha, use_otp, vazadas))
+
+
+async def criar_usuario_async(conn: sqlite3.Connection,
+                              email: str = None,
+                              senha: str = None,
+                              use_otp: bool = False,
+                              vazadas: Optional[FiltroSenhasVazadas] = None,
+                              servico: Optional[ServicoHash] = None) -> \
+                                Optional[Tuple[Optional[str], Optional[str], Optional[List[str]]]]:
     """
+        Versão assíncrona de `criar_usuario()`.
 
+        - Os hashes da senha e dos códigos de backup são calculados em paralelo no pool de
+          processos do `ServicoHash`, sem bloquear o loop de eventos
+        - O acesso ao banco continua na thread do loop, que deve ser a dona da conexão
+
+        Arguments:
+            conn (sqlite3.Connection): Conexão com o banco de dados SQLite.
+            email (str): Email do usuário.
+            senha (str): Senha em texto plano.
+            use_otp (bool): O usuário vai utilizar 2FA (default: False)
+            vazadas (Optional[FiltroSenhasVazadas]): Filtro de senhas vazadas a ser consultado
+                                                     (default: None)
+            servico (Optional[ServicoHash]): Serviço de hash a ser usado (default: o serviço
+                                             de `servico_hash_padrao()`)
+
+        Returns:
+            O mesmo que `criar_usuario()`.
+
+        Raises:
+            FilaCheiaError: Se a fila do serviço de hash estiver cheia.
+    """
+    return await _executar_async(_criar_usuario_etapas(conn, email, senha, use_otp, vazadas),
+                                 servico or servico_hash_padrao())
+
+
+def _login_etapas(conn: sqlite3.Connection,
+                  email: str,
+                  senha: str,
+                  otp: Optional[str]) -> Generator:
     cur = conn.cursor()
 
     # Retrieve user data
@@ -141,9 +320,18 @@ def login(conn: sqlite3.Connection,
     user_id, senha_hash, otp_secret, use_otp = user
 
     # Check password
-    if not check_password_hash(senha_hash, senha):
+    if not (yield (_VERIFICAR, senha_hash, senha)):
         return False
 
+    # Rehash with the current parameters
+    configuracao = configuracao_hash()
+    if configuracao.desatualizado(senha_hash):
+        novo_hash = yield (_GERAR, senha, configuracao.texto)
+        cur.execute("UPDATE usuarios "
+                    "SET senha_hash = ? "
+                    "WHERE id = ?", (novo_hash, user_id))
+        conn.commit()
+
     # There is no OTP to check
     if not use_otp:
         return True
@@ -153,26 +341,97 @@ def login(conn: sqlite3.Connection,
     if totp.verify(otp):
         return True
 
-    # If OTP fails, check backup codes
+    # If OTP fails, find the candidate backup code by its HMAC
+    if otp is None:
+        return False
     cur.execute("SELECT id, backup_code "
                 "FROM backupkeys "
-                "WHERE user_id = ? AND used = 0",
-                (user_id,))
-    backup_codes = cur.fetchall()
+                "WHERE user_id = ? AND lookup = ? AND used = 0 "
+                "LIMIT 1",
+                (user_id, lookup_codigo(user_id, otp)))
+    candidate = cur.fetchone()
+    if not candidate:  # No unused backup code matches
+        return False
 
-    if not backup_codes:  # Explicit check if no unused backup codes are available
+    backup_id, hashed_code = candidate
+    if not (yield (_VERIFICAR, hashed_code, otp)):
         return False
 
-    for backup_id, hashed_code in backup_codes:
-        if check_password_hash(hashed_code, otp):
-            # Remove the used backup code
-            cur.execute("UPDATE backupkeys "
-                        "SET used = 1 "
-                        "WHERE id = ?", (backup_id,))
-            conn.commit()
-            return True
+    # Remove the used backup code
+    cur.execute("UPDATE backupkeys "
+                "SET used = 1 "
+                "WHERE id = ?", (backup_id,))
+    conn.commit()
+    return True
+
+
+def login(conn: sqlite3.Connection,
+          email: str,
+          senha: str,
+          otp: str = None,
+          servico: Optional[ServicoHash] = None) -> bool:
+    """
+    Verifica as credenciais do usuário para autenticação.
 
-    return False  # If all checks fail
+    - O email é convertido para letras minúsculas antes da busca no banco de dados.
+    - A senha é validada usando `check_password_hash()`.
+    - Se a senha estiver correta e o hash armazenado usar parâmetros diferentes dos de
+      `configuracao_hash()`, o hash é refeito com os parâmetros atuais.
+    - O código OTP é validado usando `totp.verify()`.
+    - Caso o OTP falhe, verifica se o código fornecido corresponde a um código de backup não
+      utilizado. O código candidato é localizado pelo seu HMAC (ver `lookup_codigo()`), de
+      modo que no máximo um hash lento é verificado.
+    - Se um código de backup for usado, ele é marcado como "usado" (`used = True`).
+    - Se `servico` for informado, os hashes rodam no pool de processos do serviço e a
+      thread chamadora apenas aguarda os resultados.
+
+    Args:
+        conn (sqlite3.Connection): Conexão com o banco de dados SQLite.
+        email (str): Email do usuário.
+        senha (str): Senha em texto plano.
+        otp (str): Código OTP ou código de backup.
+        servico (Optional[ServicoHash]): Serviço de hash a ser usado (default: nenhum, os
+                                         hashes rodam na thread chamadora)
+
+    Returns:
+         bool: `True` se a autenticação for bem-sucedida, `False` caso contrário.
+
+    Raises:
+        FilaCheiaError: Se a fila do serviço de hash estiver cheia.
+    """
+    if servico is not None:
+        return _executar_servico(_login_etapas(conn, email, senha, otp), servico)
+    return _executar(_login_etapas(conn, email, senha, otp))
+
+
+async def login_async(conn: sqlite3.Connection,
+                      email: str,
+                      senha: str,
+                      otp: str = None,
+                      servico: Optional[ServicoHash] = None) -> bool:
+    """
+    Versão assíncrona de `login()`.
+
+    - As verificações de hash rodam no pool de processos do `ServicoHash`, sem bloquear o
+      loop de eventos nem disputar o GIL com outras requisições
+    - O acesso ao banco continua na thread do loop, que deve ser a dona da conexão
+
+    Args:
+        conn (sqlite3.Connection): Conexão com o banco de dados SQLite.
+        email (str): Email do usuário.
+        senha (str): Senha em texto plano.
+        otp (str): Código OTP ou código de backup.
+        servico (Optional[ServicoHash]): Serviço de hash a ser usado (default: o serviço de
+                                         `servico_hash_padrao()`)
+
+    Returns:
+         bool: `True` se a autenticação for bem-sucedida, `False` caso contrário.
+
+    Raises:
+        FilaCheiaError: Se a fila do serviço de hash estiver cheia.
+    """
+    return await _executar_async(_login_etapas(conn, email, senha, otp),
+                                 servico or servico_hash_padrao())
 
 
 def gerar_codigos_reserva(conn: sqlite3.Connection,
@@ -221,15 +480,14 @@ def gerar_codigos_reserva(conn: sqlite3.Connection,
         return None
 
     # Generate new backup codes
-    new_codes = ["".join(secrets.choice('ABCDEFGHJKLMNPQRSTUVWXYZ23456789') for _ in range(6))
-                 for _ in range(quantidade)]
-
-    for code in new_codes:
-        hashed_code = generate_password_hash(code)
-        cur.execute("INSERT INTO backupkeys "
-                    "(user_id, backup_code, used) "
-                    "VALUES (?, ?, False)",
-                    (user_id, hashed_code))
+    new_codes = _novos_codigos(quantidade)
+
+    configuracao = configuracao_hash()
+    cur.executemany("INSERT INTO backupkeys "
+                    "(user_id, backup_code, used, lookup) "
+                    "VALUES (?, ?, False, ?)",
+                    [(user_id, configuracao.gerar(code), lookup_codigo(user_id, code))
+                     for code in new_codes])
 
     conn.commit()
     return new_codes  # Return plaintext codes to the user
@@ -0,0 +1,21 @@
+import argparse
+
+from src.otp.hashing import VARIAVEL_AMBIENTE, calibrar_hash, medir_hash_ms
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Calibra os parâmetros do hash de senhas "
+                                                 "para esta máquina")
+    parser.add_argument('--alvo', type=float, default=50,
+                        help="tempo de verificação desejado em ms (default: 50)")
+    parser.add_argument('--metodo', choices=['scrypt', 'pbkdf2'], default='scrypt',
+                        help="método de hash (default: scrypt)")
+    parser.add_argument('--memoria', type=int, default=256,
+                        help="memória máxima por hash scrypt em MiB (default: 256)")
+    args = parser.parse_args()
+
+    configuracao = calibrar_hash(alvo_ms=args.alvo,
+                                 metodo=args.metodo,
+                                 max_memoria=args.memoria * 1024 * 1024)
+    print(f"Método calibrado: {configuracao.texto} "
+          f"(verificação em {medir_hash_ms(configuracao):.1f} ms)")
+    print(f"Para usar nesta implantação: export {VARIAVEL_AMBIENTE}={configuracao.texto}")
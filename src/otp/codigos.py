@@ -0,0 +1,71 @@
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import warnings
+from typing import Optional
+
+# Variável de ambiente com a chave do HMAC dos códigos de backup, compartilhada entre os
+# processos da implantação e guardada fora do banco de dados
+# (ex.: python -c "import secrets; print(secrets.token_urlsafe(32))")
+VARIAVEL_AMBIENTE = 'OTP_CHAVE_CODIGOS'
+
+_chave: Optional[bytes] = None
+_chave_lock = threading.Lock()
+
+
+def chave_codigos() -> bytes:
+    """
+    Retorna a chave do HMAC dos códigos de backup.
+
+    - Na primeira chamada, usa a variável de ambiente `OTP_CHAVE_CODIGOS`; sem ela, uma chave
+      aleatória válida apenas enquanto este processo estiver ativo, e os códigos criados com
+      ela deixam de ser encontrados após reiniciar
+
+    Returns:
+        bytes: A chave em uso.
+    """
+    global _chave
+    if _chave is None:
+        with _chave_lock:
+            if _chave is None:
+                texto = os.environ.get(VARIAVEL_AMBIENTE)
+                if not texto:
+                    warnings.warn(f"{VARIAVEL_AMBIENTE} não definida: os códigos de backup "
+                                  "valem apenas enquanto este processo estiver ativo",
+                                  RuntimeWarning, stacklevel=2)
+                _chave = texto.encode('utf-8') if texto else secrets.token_bytes(32)
+    return _chave
+
+
+def definir_chave_codigos(chave: Optional[bytes]) -> None:
+    """
+    Define a chave do HMAC dos códigos de backup.
+
+    Args:
+        chave (Optional[bytes]): A nova chave; se None, volta a usar a variável de ambiente.
+    """
+    global _chave
+    with _chave_lock:
+        _chave = chave
+
+
+def lookup_codigo(user_id: int, code: str) -> str:
+    """
+    HMAC do código de backup de um usuário, com uma chave que não fica no banco de dados.
+
+    - Permite localizar o único registro candidato pelo índice, sem verificar o hash lento
+      de todos os códigos
+    - Quem tiver só uma cópia do banco não consegue calcular o HMAC dos códigos possíveis
+      para contornar o hash lento
+
+    Args:
+        user_id (int): O id do usuário.
+        code (str): O código de backup.
+
+    Returns:
+        str: O HMAC em hexadecimal.
+    """
+    mensagem = f"{user_id}:{code}".encode('utf-8')
+    return hmac.new(chave_codigos(), mensagem, hashlib.sha256).hexdigest()
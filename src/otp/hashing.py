@@ -0,0 +1,227 @@
+import os
+import threading
+from time import perf_counter
+from typing import Optional
+
+from werkzeug.security import (DEFAULT_PBKDF2_ITERATIONS, check_password_hash,
+                               generate_password_hash)
+
+# Variável de ambiente com o método de hash da implantação, no formato do werkzeug
+# (ex.: 'scrypt:32768:8:1' ou 'pbkdf2:sha256:1000000')
+VARIAVEL_AMBIENTE = 'OTP_HASH_METODO'
+
+
+class ConfiguracaoHash:
+    """
+    Parâmetros usados para gerar e verificar hashes de senhas.
+
+    - 'scrypt': custo de CPU/memória `n` (potência de 2), tamanho de bloco `r` e
+      paralelismo `p`; usa aproximadamente 128 * n * r bytes de memória por hash
+    - 'pbkdf2': algoritmo de hash `algoritmo` e número de `iteracoes`
+
+    Args:
+        metodo (str): 'scrypt' ou 'pbkdf2' (default: 'scrypt').
+        n (int): Custo do scrypt (default: 32768).
+        r (int): Tamanho de bloco do scrypt (default: 8).
+        p (int): Paralelismo do scrypt (default: 1).
+        algoritmo (str): Hash usado pelo pbkdf2 (default: 'sha256').
+        iteracoes (int): Iterações do pbkdf2 (default: o padrão do werkzeug instalado, para
+                         que `desatualizado()` reconheça os hashes gerados por ele).
+    """
+
+    def __init__(self,
+                 metodo: str = 'scrypt',
+                 n: int = 2 ** 15,
+                 r: int = 8,
+                 p: int = 1,
+                 algoritmo: str = 'sha256',
+                 iteracoes: int = DEFAULT_PBKDF2_ITERATIONS):
+        if metodo not in ('scrypt', 'pbkdf2'):
+            raise ValueError(f"Método de hash desconhecido: {metodo}")
+        if metodo == 'scrypt' and (n < 2 or n & (n - 1)):
+            raise ValueError("O custo do scrypt deve ser uma potência de 2")
+
+        self.metodo = metodo
+        self.n = n
+        self.r = r
+        self.p = p
+        self.algoritmo = algoritmo
+        self.iteracoes = iteracoes
+
+    @classmethod
+    def de_texto(cls, texto: str) -> 'ConfiguracaoHash':
+        """
+        Cria a configuração a partir de um método no formato do werkzeug.
+
+        Args:
+            texto (str): O método (ex.: 'scrypt:32768:8:1' ou 'pbkdf2:sha256:1000000').
+
+        Returns:
+            ConfiguracaoHash: A configuração correspondente.
+        """
+        metodo, *args = texto.strip().split(':')
+        if metodo == 'scrypt':
+            n, r, p = (int(a) for a in (args + ['32768', '8', '1'][len(args):]))
+            return cls('scrypt', n=n, r=r, p=p)
+        if metodo == 'pbkdf2':
+            algoritmo = args[0] if args else 'sha256'
+            iteracoes = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+            return cls('pbkdf2', algoritmo=algoritmo, iteracoes=iteracoes)
+        raise ValueError(f"Método de hash desconhecido: {texto}")
+
+    @property
+    def texto(self) -> str:
+        """
+        O método no formato aceito por `generate_password_hash()`
+        """
+        if self.metodo == 'scrypt':
+            return f"scrypt:{self.n}:{self.r}:{self.p}"
+        return f"pbkdf2:{self.algoritmo}:{self.iteracoes}"
+
+    def __repr__(self) -> str:
+        return f"ConfiguracaoHash.de_texto({self.texto!r})"
+
+    def __eq__(self, outra: object) -> bool:
+        return isinstance(outra, ConfiguracaoHash) and self.texto == outra.texto
+
+    def __hash__(self) -> int:
+        return hash(self.texto)
+
+    def gerar(self, senha: str) -> str:
+        """
+        Gera o hash de uma senha com os parâmetros desta configuração.
+
+        Args:
+            senha (str): Senha em texto plano.
+
+        Returns:
+            str: O hash no formato do werkzeug.
+        """
+        return generate_password_hash(senha, method=self.texto)
+
+    @staticmethod
+    def verificar(senha_hash: str, senha: str) -> bool:
+        """
+        Verifica uma senha contra um hash, quaisquer que sejam os parâmetros do hash.
+
+        Args:
+            senha_hash (str): O hash armazenado.
+            senha (str): Senha em texto plano.
+
+        Returns:
+            bool: True se a senha corresponder ao hash.
+        """
+        return check_password_hash(senha_hash, senha)
+
+    def desatualizado(self, senha_hash: str) -> bool:
+        """
+        Verifica se um hash armazenado foi gerado com parâmetros diferentes dos atuais.
+
+        Args:
+            senha_hash (str): O hash armazenado.
+
+        Returns:
+            bool: True se o hash deve ser refeito com esta configuração.
+        """
+        return senha_hash.split('$', 1)[0] != self.texto
+
+
+_configuracao: Optional[ConfiguracaoHash] = None
+_configuracao_lock = threading.Lock()
+
+
+def configuracao_hash() -> ConfiguracaoHash:
+    """
+    Retorna a configuração de hash em uso.
+
+    - Na primeira chamada, usa o método da variável de ambiente `OTP_HASH_METODO`, se
+      existir, ou os parâmetros padrão do werkzeug
+
+    Returns:
+        ConfiguracaoHash: A configuração em uso.
+    """
+    global _configuracao
+    if _configuracao is None:
+        with _configuracao_lock:
+            if _configuracao is None:
+                texto = os.environ.get(VARIAVEL_AMBIENTE)
+                _configuracao = ConfiguracaoHash.de_texto(texto) if texto else ConfiguracaoHash()
+    return _configuracao
+
+
+def definir_configuracao_hash(configuracao: Optional[ConfiguracaoHash]) -> None:
+    """
+    Define a configuração de hash usada por `criar_usuario()`, `login()` e
+    `gerar_codigos_reserva()`.
+
+    Args:
+        configuracao (Optional[ConfiguracaoHash]): A nova configuração; se None, volta a usar
+                                                   a variável de ambiente ou o padrão.
+    """
+    global _configuracao
+    with _configuracao_lock:
+        _configuracao = configuracao
+
+
+def medir_hash_ms(configuracao: ConfiguracaoHash, repeticoes: int = 3) -> float:
+    """
+    Mede, nesta máquina, o menor tempo de verificação de um hash com a configuração dada.
+
+    Args:
+        configuracao (ConfiguracaoHash): A configuração a ser medida.
+        repeticoes (int): Número de medições (default: 3).
+
+    Returns:
+        float: O tempo em milissegundos.
+    """
+    senha_hash = configuracao.gerar('calibracao')
+    melhor = float('inf')
+    for _ in range(repeticoes):
+        inicio = perf_counter()
+        configuracao.verificar(senha_hash, 'calibracao')
+        melhor = min(melhor, perf_counter() - inicio)
+    return melhor * 1000
+
+
+def calibrar_hash(alvo_ms: float = 50,
+                  metodo: str = 'scrypt',
+                  r: int = 8,
+                  p: int = 1,
+                  algoritmo: str = 'sha256',
+                  max_memoria: int = 256 * 1024 * 1024) -> ConfiguracaoHash:
+    """
+    Mede o custo do hash nesta máquina e escolhe parâmetros para atingir a latência desejada.
+
+    - 'scrypt': dobra o custo `n` enquanto a verificação levar menos que o alvo, respeitando
+      o limite de memória por hash
+    - 'pbkdf2': mede um número base de iterações e o escala linearmente até o alvo
+
+    Args:
+        alvo_ms (float): Tempo de verificação desejado, em milissegundos (default: 50).
+        metodo (str): 'scrypt' ou 'pbkdf2' (default: 'scrypt').
+        r (int): Tamanho de bloco do scrypt (default: 8).
+        p (int): Paralelismo do scrypt (default: 1).
+        algoritmo (str): Hash usado pelo pbkdf2 (default: 'sha256').
+        max_memoria (int): Memória máxima por hash scrypt, em bytes (default: 256 MiB).
+
+    Returns:
+        ConfiguracaoHash: A configuração calibrada.
+    """
+    if metodo == 'pbkdf2':
+        base = ConfiguracaoHash('pbkdf2', algoritmo=algoritmo, iteracoes=10000)
+        tempo = max(medir_hash_ms(base), 1e-3)
+        iteracoes = max(int(base.iteracoes * alvo_ms / tempo) // 1000 * 1000, 1000)
+        return ConfiguracaoHash('pbkdf2', algoritmo=algoritmo, iteracoes=iteracoes)
+
+    configuracao = ConfiguracaoHash('scrypt', n=2 ** 10, r=r, p=p)
+    while True:
+        proxima = ConfiguracaoHash('scrypt', n=configuracao.n * 2, r=r, p=p)
+        if 128 * proxima.n * r > max_memoria:
+            return configuracao
+        tempo = medir_hash_ms(configuracao)
+        if tempo >= alvo_ms:
+            return configuracao
+        # Escolhe a potência de 2 mais próxima do alvo, já que o custo cresce linearmente com n
+        if tempo * 2 > alvo_ms and alvo_ms - tempo < tempo * 2 - alvo_ms:
+            return configuracao
+        configuracao = proxima
@@ -0,0 +1,174 @@
+import csv
+import json
+import sqlite3
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from src.otp.hashing import configuracao_hash
+from src.otp.servico import ServicoHash
+
+# Prefixos dos métodos de hash do werkzeug aceitos em senhas já cifradas
+_METODOS_HASH = ('scrypt:', 'pbkdf2:')
+
+
+def ler_csv(arquivo: Path) -> Iterator[Dict[str, str]]:
+    """
+    Lê, em streaming, os registros de usuários de um arquivo CSV com cabeçalho.
+
+    Args:
+        arquivo (Path): Arquivo CSV com as colunas `email` e `senha` ou `senha_hash`, e
+                        opcionalmente `otp_secret`.
+
+    Returns:
+        Iterator[Dict[str, str]]: Um dicionário por linha.
+    """
+    with open(arquivo, 'r', newline='', encoding='utf-8') as entrada:
+        yield from csv.DictReader(entrada)
+
+
+def ler_jsonl(arquivo: Path) -> Iterator[Dict[str, Any]]:
+    """
+    Lê, em streaming, os registros de usuários de um arquivo JSONL (um objeto por linha).
+
+    Args:
+        arquivo (Path): Arquivo JSONL com as chaves `email` e `senha` ou `senha_hash`, e
+                        opcionalmente `otp_secret`.
+
+    Returns:
+        Iterator[Dict[str, Any]]: Um dicionário por linha não vazia.
+    """
+    with open(arquivo, 'r', encoding='utf-8') as entrada:
+        for linha in entrada:
+            if linha.strip():
+                yield json.loads(linha)
+
+
+def _hash_valido(senha_hash: str) -> bool:
+    return senha_hash.startswith(_METODOS_HASH) and senha_hash.count('$') == 2
+
+
+def _campos_texto(registro: Any) -> Optional[Tuple[str, str, str, str]]:
+    """
+    `email`, `senha`, `senha_hash` e `otp_secret` do registro ('' se ausentes), ou None se o
+    registro não for um objeto ou algum desses campos não for texto
+    """
+    if not isinstance(registro, dict):
+        return None
+    campos = tuple(registro.get(campo) or '' for campo in
+                   ('email', 'senha', 'senha_hash', 'otp_secret'))
+    if not all(isinstance(campo, str) for campo in campos):
+        return None
+    return campos
+
+
+def importar_usuarios(conn: sqlite3.Connection,
+                      registros: Iterable[Dict[str, Any]],
+                      tamanho_lote: int = 1000,
+                      max_processos: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Importa usuários em massa, por exemplo na migração de um sistema legado.
+
+    - Os registros são consumidos em streaming, em lotes de `tamanho_lote`
+    - Emails duplicados (já existentes no banco ou repetidos na entrada) são reportados e
+      ignorados, sem abortar o lote
+    - Senhas em texto plano são cifradas em paralelo por um `ServicoHash`; registros com
+      `senha_hash` no formato do werkzeug são gravados sem recalcular o hash
+    - Cada lote é gravado com `executemany` em uma única transação
+
+    Args:
+        conn (sqlite3.Connection): Conexão com o banco de dados SQLite.
+        registros (Iterable[Dict[str, Any]]): Registros com `email` e `senha` ou `senha_hash`,
+                                              e opcionalmente `otp_secret` (ver `ler_csv()` e
+                                              `ler_jsonl()`).
+        tamanho_lote (int): Número de registros por transação (default: 1000).
+        max_processos (Optional[int]): Processos usados para cifrar as senhas
+                                       (default: número de CPUs).
+
+    Returns:
+        Dict[str, Any]: `importados` (número de usuários criados), `duplicados` (emails
+                        ignorados) e `invalidos` (posições, a partir de 0, dos registros
+                        sem email ou senha válidos).
+    """
+    resultado: Dict[str, Any] = {'importados': 0, 'duplicados': [], 'invalidos': []}
+    metodo = configuracao_hash().texto
+    iterador = iter(registros)
+    posicao = 0
+
+    with ServicoHash(max_processos=max_processos, max_fila=tamanho_lote) as servico:
+        while True:
+            lote = list(islice(iterador, tamanho_lote))
+            if not lote:
+                break
+
+            # Normaliza e valida os registros do lote
+            validos: List[Dict[str, Any]] = []
+            for registro in lote:
+                campos = _campos_texto(registro)
+                if campos is None:
+                    resultado['invalidos'].append(posicao)
+                    posicao += 1
+                    continue
+                email, senha, senha_hash, otp_secret = campos
+                email = email.strip().lower()
+                if not email or not (senha.strip() or _hash_valido(senha_hash)):
+                    resultado['invalidos'].append(posicao)
+                else:
+                    validos.append({'email'     : email,
+                                    'senha'     : senha,
+                                    'senha_hash': senha_hash if not senha.strip() else '',
+                                    'otp_secret': otp_secret})
+                posicao += 1
+
+            # Descarta emails já cadastrados ou repetidos na entrada
+            emails = list({r['email'] for r in validos})
+            existentes = set()
+            for i in range(0, len(emails), 500):
+                parte = emails[i:i + 500]
+                cursor = conn.execute("SELECT email "
+                                      "FROM usuarios "
+                                      f"WHERE email IN ({','.join('?' * len(parte))})", parte)
+                existentes.update(email for email, in cursor)
+            novos = []
+            for r in validos:
+                if r['email'] in existentes:
+                    resultado['duplicados'].append(r['email'])
+                else:
+                    existentes.add(r['email'])
+                    novos.append(r)
+
+            # Cifra em paralelo apenas as senhas em texto plano
+            futuros = [servico.gerar(r['senha'], metodo) if not r['senha_hash'] else None
+                       for r in novos]
+            linhas = [(r['email'],
+                       futuro.result() if futuro is not None else r['senha_hash'],
+                       r['otp_secret'],
+                       bool(r['otp_secret']))
+                      for r, futuro in zip(novos, futuros)]
+
+            resultado['importados'] += _gravar_lote(conn, linhas, resultado['duplicados'])
+
+    return resultado
+
+
+def _gravar_lote(conn: sqlite3.Connection, linhas: List[tuple], duplicados: List[str]) -> int:
+    sql = ("INSERT INTO usuarios "
+           "(email, senha_hash, otp_secret, use_otp) "
+           "VALUES (?, ?, ?, ?)")
+    try:
+        with conn:
+            conn.executemany(sql, linhas)
+        return len(linhas)
+    except sqlite3.IntegrityError:
+        pass
+
+    # Algum email foi cadastrado por outra conexão durante o lote: grava linha a linha
+    gravados = 0
+    with conn:
+        for linha in linhas:
+            try:
+                conn.execute(sql, linha)
+                gravados += 1
+            except sqlite3.IntegrityError:
+                duplicados.append(linha[0])
+    return gravados
@@ -0,0 +1,129 @@
+import os
+import threading
+from concurrent.futures import Future, InvalidStateError, ProcessPoolExecutor
+from typing import Optional
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class FilaCheiaError(RuntimeError):
+    """
+    O serviço de hash atingiu o limite de pedidos pendentes
+    """
+
+
+class ServicoHash:
+    """
+    Executa hashes de senhas em um pool de processos limitado, fora da thread chamadora.
+
+    - Cada pedido ocupa uma vaga da fila até terminar; com a fila cheia, novos pedidos são
+      recusados imediatamente com `FilaCheiaError` (backpressure), em vez de se acumularem
+    - A vaga é liberada antes de o resultado chegar ao futuro devolvido: quem espera o
+      resultado pode submeter um novo pedido em seguida sem encontrar a fila cheia
+    - Como cada hash roda em outro processo, N núcleos executam N hashes em paralelo, sem
+      disputar o GIL
+
+    Args:
+        max_processos (Optional[int]): Número de processos do pool (default: número de CPUs).
+        max_fila (Optional[int]): Número máximo de pedidos pendentes, em execução ou
+                                  aguardando (default: 4 pedidos por processo).
+    """
+
+    def __init__(self, max_processos: Optional[int] = None, max_fila: Optional[int] = None):
+        self.max_processos = max_processos or os.cpu_count() or 1
+        self.max_fila = max_fila or 4 * self.max_processos
+        self._executor = ProcessPoolExecutor(max_workers=self.max_processos)
+        self._vagas = threading.BoundedSemaphore(self.max_fila)
+
+    def __enter__(self) -> 'ServicoHash':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.encerrar()
+
+    def _submeter(self, funcao, *args) -> Future:
+        if not self._vagas.acquire(blocking=False):
+            raise FilaCheiaError(f"Fila do serviço de hash cheia ({self.max_fila} pedidos)")
+        try:
+            interno = self._executor.submit(funcao, *args)
+        except BaseException:
+            self._vagas.release()
+            raise
+
+        futuro: Future = Future()
+        futuro.add_done_callback(lambda f: interno.cancel() if f.cancelled() else None)
+
+        def concluir(_: Future) -> None:
+            self._vagas.release()
+            try:
+                if interno.cancelled():
+                    futuro.cancel()
+                elif interno.exception() is not None:
+                    futuro.set_exception(interno.exception())
+                else:
+                    futuro.set_result(interno.result())
+            except InvalidStateError:
+                pass  # O futuro devolvido já foi cancelado por quem o recebeu
+
+        interno.add_done_callback(concluir)
+        return futuro
+
+    def gerar(self, senha: str, metodo: str) -> Future:
+        """
+        Agenda a geração do hash de uma senha.
+
+        Args:
+            senha (str): Senha em texto plano.
+            metodo (str): Método no formato do werkzeug (ver `ConfiguracaoHash.texto`).
+
+        Returns:
+            Future: Futuro com o hash gerado (str).
+
+        Raises:
+            FilaCheiaError: Se a fila estiver cheia.
+        """
+        return self._submeter(generate_password_hash, senha, metodo)
+
+    def verificar(self, senha_hash: str, senha: str) -> Future:
+        """
+        Agenda a verificação de uma senha contra um hash.
+
+        Args:
+            senha_hash (str): O hash armazenado.
+            senha (str): Senha em texto plano.
+
+        Returns:
+            Future: Futuro com o resultado da verificação (bool).
+
+        Raises:
+            FilaCheiaError: Se a fila estiver cheia.
+        """
+        return self._submeter(check_password_hash, senha_hash, senha)
+
+    def encerrar(self, esperar: bool = True) -> None:
+        """
+        Encerra o pool de processos.
+
+        Args:
+            esperar (bool): Aguarda os pedidos pendentes terminarem (default: True).
+        """
+        self._executor.shutdown(wait=esperar, cancel_futures=not esperar)
+
+
+_servico_padrao: Optional[ServicoHash] = None
+_servico_padrao_lock = threading.Lock()
+
+
+def servico_hash_padrao() -> ServicoHash:
+    """
+    Retorna o serviço de hash compartilhado do processo, criando-o na primeira chamada.
+
+    Returns:
+        ServicoHash: O serviço com os parâmetros padrão.
+    """
+    global _servico_padrao
+    if _servico_padrao is None:
+        with _servico_padrao_lock:
+            if _servico_padrao is None:
+                _servico_padrao = ServicoHash()
+    return _servico_padrao
@@ -1,8 +1,54 @@
-import re
+import os
 import secrets
 import string
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional, Tuple, Union
+
+from src.senhas.entropia import (PONTUACAO_MAXIMA_VAZADA, entropia_senha_aleatoria,
+                                 entropia_senha_frase, estimar_entropia, pontuacao_entropia,
+                                 pontuar_senha)
+from src.senhas.lista_palavras import (ListaPalavras, carregar_lista_palavras,
+                                       invalidar_lista_palavras)
+from src.senhas.politica import PoliticaSenha
+from src.senhas.vazadas import FiltroSenhasVazadas, construir_filtro_senhas
+
+__all__ = [
+    'FiltroSenhasVazadas', 'ListaPalavras', 'PONTUACAO_MAXIMA_VAZADA', 'PoliticaSenha',
+    'carregar_lista_palavras', 'construir_filtro_senhas', 'entropia_senha_aleatoria',
+    'entropia_senha_frase', 'estimar_entropia', 'gerar_senha_aleatoria', 'gerar_senha_frase',
+    'gerar_senhas_em_lote', 'invalidar_lista_palavras', 'pontuacao_entropia', 'pontuar_senha',
+    'validar_complexidade_senha',
+]
+
+_rng = secrets.SystemRandom()
+
+
+@lru_cache(maxsize=None)
+def _categorias_ativas(maiusculas: bool,
+                       minusculas: bool,
+                       digitos: bool,
+                       simbolos: bool,
+                       remove_confusos: bool) -> Tuple[str, ...]:
+    """
+    Retorna os alfabetos das categorias selecionadas, calculados uma única vez por combinação
+    """
+    categorias = (
+        (maiusculas, 'ABCDEFGHJKLMNPQRSTUVWXYZ' if remove_confusos else string.ascii_uppercase),
+        (minusculas, 'abcdefghjkmnopqrstuvwxyz' if remove_confusos else string.ascii_lowercase),
+        (digitos, '23456789' if remove_confusos else string.digits),
+        (simbolos, string.punctuation),
+    )
+    return tuple(chars for ativa, chars in categorias if ativa)
+
+
+@lru_cache(maxsize=64)
+def _politica(tamanho: int,
+              maiusculas: bool,
+              minusculas: bool,
+              digitos: bool,
+              simbolos: bool) -> PoliticaSenha:
+    return PoliticaSenha(tamanho, maiusculas, minusculas, digitos, simbolos)
 
 
 def gerar_senha_aleatoria(tamanho: int = 10,
@@ -10,7 +56,9 @@ def gerar_senha_aleatoria(tamanho: int = 10,
                           minusculas: bool = True,
                           digitos: bool = True,
                           simbolos: bool = True,
-                          remove_confusos: bool = True) -> Optional[str]:
+                          remove_confusos: bool = True,
+                          retornar_entropia: bool = False
+                          ) -> Optional[Union[str, Tuple[str, float]]]:
     """
     Gera uma senha aleatória que pode conter letras maiúsculas, minúsculas, dígitos e símbolos
 
@@ -25,45 +73,143 @@ def gerar_senha_aleatoria(tamanho: int = 10,
         digitos (bool): Utiliza digitos decimais (default: True).
         simbolos (bool): Utiliza símbolos diversos (default: True).
         remove_confusos (bool): Remove caracteres Iil1O0 (default: True).
+        retornar_entropia (bool): Se True, retorna também a entropia da senha, calculada a
+                                  partir dos parâmetros de geração (default: False).
     Returns:
-        str: A senha gerada aleatoriamente.
+        str: A senha gerada aleatoriamente, ou a tupla (senha, entropia em bits) se
+             `retornar_entropia` for True.
 
     """
-    categorias = {
-        'maiusculas': 'ABCDEFGHJKLMNPQRSTUVWXYZ' if remove_confusos else string.ascii_uppercase,
-        'minusculas': 'abcdefghjkmnopqrstuvwxyz' if remove_confusos else string.ascii_lowercase,
-        'digitos'   : '23456789' if remove_confusos else string.digits,
-        'simbolos'  : string.punctuation
-    }
-
-    categorias_ativas = {k: v for k, v in categorias.items() if locals()[k]}
+    categorias_ativas = _categorias_ativas(maiusculas, minusculas, digitos, simbolos,
+                                           remove_confusos)
 
     if not categorias_ativas or tamanho < len(categorias_ativas):
         return None
 
-    rng = secrets.SystemRandom()
-
     # Seleciona pelo menos 1 caractere de cada categoria escolhida
-    senha = [secrets.choice(chars) for chars in categorias_ativas.values()]
+    senha = [secrets.choice(chars) for chars in categorias_ativas]
 
     # Completa a senha com caracteres aleatórios das categorias escolhidas
-    todos_caracteres = ''.join(categorias_ativas.values())
-    senha += rng.choices(todos_caracteres, k=tamanho - len(senha))
+    todos_caracteres = ''.join(categorias_ativas)
+    senha += _rng.choices(todos_caracteres, k=tamanho - len(senha))
 
     # Shuffle to randomize order
-    rng.shuffle(senha)
+    _rng.shuffle(senha)
 
+    if retornar_entropia:
+        return ''.join(senha), entropia_senha_aleatoria(tamanho, categorias_ativas)
     return ''.join(senha)
 
 
+class _Sorteador:
+    """
+    Converte bytes aleatórios em valores uniformes de uma sequência, sem viés
+
+    - Cada byte `b` menor que o maior múltiplo do tamanho da sequência é mapeado para
+      `valores[b % len(valores)]`; os demais são rejeitados. Isso é feito em lote com
+      `bytes.translate()`, sobre blocos grandes lidos de `os.urandom()`
+    """
+
+    def __init__(self, valores: bytes, tamanho_bloco: int):
+        tamanho = len(valores)
+        aceitos = 256 - 256 % tamanho
+        self._tabela = bytes(valores[b % tamanho] if b < aceitos else 0 for b in range(256))
+        self._rejeitados = bytes(range(aceitos, 256))
+        self._tamanho_bloco = tamanho_bloco
+
+    def sortear(self, quantidade: int) -> bytes:
+        partes = []
+        faltam = quantidade
+        while faltam > 0:
+            bloco = os.urandom(max(self._tamanho_bloco, faltam + faltam // 2))
+            parte = bloco.translate(self._tabela, self._rejeitados)[:faltam]
+            partes.append(parte)
+            faltam -= len(parte)
+        return b''.join(partes)
+
+
+def gerar_senhas_em_lote(n: int,
+                         tamanho: int = 10,
+                         maiusculas: bool = True,
+                         minusculas: bool = True,
+                         digitos: bool = True,
+                         simbolos: bool = True,
+                         remove_confusos: bool = True) -> Optional[Iterator[str]]:
+    """
+    Gera `n` senhas aleatórias com a mesma política de `gerar_senha_aleatoria()`
+
+    - Os alfabetos são calculados uma única vez para todo o lote
+    - A aleatoriedade vem de um único buffer grande de `os.urandom()`, convertido em
+      caracteres por amostragem com rejeição (sem viés de módulo)
+    - Cada senha contém pelo menos um caractere de cada categoria selecionada, inserido em
+      posição aleatória
+
+    Args:
+        n (int): Quantidade de senhas a serem geradas.
+        tamanho (int): O tamanho de cada senha (default: 10).
+        maiusculas (bool): Utiliza letras maiúsculas (default: True).
+        minusculas (bool): Utiliza letras minúsculas (default: True).
+        digitos (bool): Utiliza digitos decimais (default: True).
+        simbolos (bool): Utiliza símbolos diversos (default: True).
+        remove_confusos (bool): Remove caracteres Iil1O0 (default: True).
+
+    Returns:
+        Optional[Iterator[str]]: Gerador que produz as senhas, ou None se a política for
+                                 impossível de atender.
+    """
+    categorias_ativas = _categorias_ativas(maiusculas, minusculas, digitos, simbolos,
+                                           remove_confusos)
+
+    if n < 0 or not categorias_ativas or tamanho < len(categorias_ativas):
+        return None
+
+    return _gerar_lote(n, tamanho, categorias_ativas)
+
+
+def _gerar_lote(n: int, tamanho: int, categorias_ativas: Tuple[str, ...]) -> Iterator[str]:
+    complemento = tamanho - len(categorias_ativas)
+    por_vez = min(n, 1024)
+
+    todos = _Sorteador(''.join(categorias_ativas).encode('ascii'), 2 * por_vez * complemento)
+    obrigatorios = [_Sorteador(chars.encode('ascii'), 2 * por_vez)
+                    for chars in categorias_ativas]
+    # Inserir cada caractere obrigatório em uma posição uniforme equivale a embaralhar a
+    # senha, já que os demais caracteres são independentes e identicamente distribuídos
+    posicoes = [_Sorteador(bytes(range(complemento + j + 1)), 2 * por_vez)
+                if complemento + j + 1 <= 256 else None
+                for j in range(len(categorias_ativas))]
+
+    gerados = 0
+    while gerados < n:
+        quantidade = min(por_vez, n - gerados)
+        preenchimento = todos.sortear(quantidade * complemento).decode('ascii')
+        caracteres = [sorteador.sortear(quantidade).decode('ascii')
+                      for sorteador in obrigatorios]
+        indices = [sorteador.sortear(quantidade) if sorteador is not None else
+                   [secrets.randbelow(complemento + j + 1) for _ in range(quantidade)]
+                   for j, sorteador in enumerate(posicoes)]
+
+        for i in range(quantidade):
+            senha = list(preenchimento[i * complemento:(i + 1) * complemento])
+            for chars, pos in zip(caracteres, indices):
+                senha.insert(pos[i], chars[i])
+            yield ''.join(senha)
+        gerados += quantidade
+
+
 def gerar_senha_frase(num_palavras: int = 4,
                       palavras_completas: bool = True,
                       separador: str = '-',
                       maiuscula: bool = False,
-                      arquivo: Path = Path("palavras.lst")) -> Optional[str]:
+                      arquivo: Path = Path("palavras.lst"),
+                      lista: Optional[ListaPalavras] = None,
+                      retornar_entropia: bool = False) -> Optional[Union[str, Tuple[str, float]]]:
     """
     Gera uma senha forte selecionando um conjunto de palavras aleatórias de uma lista.
 
+    - A lista de palavras é obtida do cache (ver `carregar_lista_palavras()`), sendo o
+      arquivo relido apenas quando for alterado
+
     Args:
         num_palavras (int): Número de palavras (mínimo 1) a serem incluídas na senha (default: 4).
         palavras_completas (bool): Se True, usa palavras inteiras; se False, usa apenas os primeiros
@@ -71,28 +217,32 @@ def gerar_senha_frase(num_palavras: int = 4,
         separador (str): Caractere usado para separar as palavras na senha (default: '-').
         maiuscula (bool): Se True, alguma palavras será convertida para maiúsculas (default: False).
         arquivo (Path): Caminho do arquivo de palavras a ser usado (default: 'palavras.lst').
+        lista (Optional[ListaPalavras]): Lista de palavras pré-carregada; se informada, o
+                                         `arquivo` é ignorado (default: None).
+        retornar_entropia (bool): Se True, retorna também a entropia da senha, calculada a
+                                  partir da lista e dos parâmetros de geração (default: False).
 
     Returns:
         str: A senha gerada como uma string, separada pelo caractere especificado, ou None se
-             `num_palavras` for menor que 1 ou se o `arquivo` não existir
+             `num_palavras` for menor que 1 ou se o `arquivo` não existir. Se
+             `retornar_entropia` for True, a tupla (senha, entropia em bits)
     """
     if num_palavras < 1:
         return None
 
-    if not arquivo.is_file():
-        return None
-
-    lista = []
-    with open(arquivo, 'r') as arquivo:
-        for palavra in arquivo:
-            lista.append(palavra.strip() if palavras_completas else palavra.strip()[:4])
+    if lista is None:
+        lista = carregar_lista_palavras(arquivo)
+        if lista is None:
+            return None
 
-    rng = secrets.SystemRandom()
-    palavras = rng.choices(lista, k=num_palavras)
+    palavras = _rng.choices(lista.palavras(palavras_completas), k=num_palavras)
     if maiuscula:
         p = secrets.randbelow(num_palavras)
         palavras[p] = palavras[p].upper()
 
+    if retornar_entropia:
+        return separador.join(palavras), entropia_senha_frase(lista, num_palavras,
+                                                              palavras_completas, maiuscula)
     return separador.join(palavras)
 
 
@@ -101,12 +251,15 @@ def validar_complexidade_senha(senha: str = None,
                                maiusculas: bool = True,
                                minusculas: bool = True,
                                digitos: bool = True,
-                               simbolos: bool = True) -> bool:
+                               simbolos: bool = True,
+                               vazadas: Optional[FiltroSenhasVazadas] = None) -> bool:
     """
     Valida a complexidade de uma senha de acordo com critérios especificados.
 
     A função verifica se a senha atende a requisitos mínimos de comprimento e presença
     de diferentes tipos de caracteres (maiúsculas, minúsculas, dígitos e símbolos).
+    As políticas são compiladas uma única vez por combinação de critérios (ver
+    `PoliticaSenha`).
 
     Args:
         senha (str): A senha a ser validada.
@@ -115,19 +268,12 @@ def validar_complexidade_senha(senha: str = None,
         minusculas (bool): Se True, exige ao menos uma letra minúscula (default: True).
         digitos (bool): Se True, exige ao menos um número (default: True).
         simbolos (bool): Se True, exige ao menos um caractere não alfanumérico (default: True).
+        vazadas (Optional[FiltroSenhasVazadas]): Se informado, rejeita senhas presentes no
+                                                 filtro de senhas vazadas (default: None).
 
     Returns:
         bool: True se a senha atender a todos os critérios especificados, False caso contrário.
     """
-    valida = True
-    valida = valida and (len(senha) >= tamanho)
-    if maiusculas:
-        valida = valida and (re.search(r'[A-Z]', senha) is not None)
-    if minusculas:
-        valida = valida and (re.search(r'[a-z]', senha) is not None)
-    if digitos:
-        valida = valida and (re.search(r'\d', senha) is not None)
-    if simbolos:
-        valida = valida and (re.search(r'\W', senha) is not None)
-
-    return valida
+    if not _politica(tamanho, maiusculas, minusculas, digitos, simbolos).valida(senha):
+        return False
+    return vazadas is None or senha not in vazadas
@@ -0,0 +1,275 @@
+import math
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from src.senhas.lista_palavras import ListaPalavras, carregar_lista_palavras
+from src.senhas.politica import DIGITO, MAIUSCULA, MINUSCULA, SIMBOLO, _classificar
+from src.senhas.vazadas import FiltroSenhasVazadas
+
+LISTA_PADRAO = Path(__file__).parent / "palavras.lst"
+# Palavras-base de senhas comuns, sempre consultadas além do dicionário informado
+LISTA_COMUNS = Path(__file__).parent / "senhas_comuns.lst"
+
+# Tamanho do conjunto de caracteres atribuído a cada classe; caracteres fora do ASCII
+# contribuem com um conjunto arbitrário de 100 símbolos
+_TAMANHO_CLASSE = {MAIUSCULA: 26, MINUSCULA: 26, DIGITO: 10, SIMBOLO: 33, 0: 100}
+
+# Classe de cada caractere ASCII pré-calculada; as demais são calculadas sob demanda
+_CLASSE_ASCII = {chr(i): _classificar(chr(i)) for i in range(128)}
+
+# Posição (linha, coluna) de cada tecla em um teclado QWERTY, com e sem shift
+_LINHAS_TECLADO = (("`1234567890-=", "~!@#$%^&*()_+"),
+                   ("qwertyuiop[]\\", "QWERTYUIOP{}|"),
+                   ("asdfghjkl;'", 'ASDFGHJKL:"'),
+                   ("zxcvbnm,./", "ZXCVBNM<>?"))
+_TECLADO: Dict[str, Tuple[int, int]] = {c: (linha, coluna)
+                                        for linha, teclas in enumerate(_LINHAS_TECLADO)
+                                        for variante in teclas
+                                        for coluna, c in enumerate(variante)}
+_NUM_TECLAS = len(_TECLADO) // 2
+
+# Substituições "l33t" desfeitas antes da busca no dicionário
+_LEET = str.maketrans({'@': 'a', '4': 'a', '3': 'e', '1': 'i', '!': 'i', '0': 'o', '$': 's',
+                       '5': 's', '7': 't', '+': 't'})
+
+# Limiares (em bits) entre as pontuações 0 (muito fraca) e 4 (muito forte)
+_LIMIARES = (28, 36, 60, 128)
+
+# Pontuação máxima de uma senha presente no filtro de senhas vazadas
+PONTUACAO_MAXIMA_VAZADA = 0
+
+_TAMANHO_MINIMO_PADRAO = 3
+
+
+@lru_cache(maxsize=8)
+def _dicionario(lista: ListaPalavras) -> Tuple[FrozenSet[str], Dict[str, Tuple[int, ...]], float]:
+    """
+    Conjunto de palavras (em minúsculas), índice dos comprimentos existentes (em ordem
+    decrescente) por prefixo mínimo e o custo em bits de uma palavra
+    """
+    palavras = frozenset(p.lower() for p in lista.completas if len(p) >= _TAMANHO_MINIMO_PADRAO)
+    prefixos: Dict[str, set] = {}
+    for p in palavras:
+        prefixos.setdefault(p[:_TAMANHO_MINIMO_PADRAO], set()).add(len(p))
+    indice = {prefixo: tuple(sorted(tamanhos, reverse=True))
+              for prefixo, tamanhos in prefixos.items()}
+    return palavras, indice, math.log2(max(len(palavras), 2))
+
+
+def _classe(c: str) -> int:
+    classe = _CLASSE_ASCII.get(c)
+    return _classificar(c) if classe is None else classe
+
+
+def _comprimento_repeticao(senha: str, i: int) -> int:
+    fim = i + 1
+    while fim < len(senha) and senha[fim] == senha[i]:
+        fim += 1
+    return fim - i
+
+
+def _comprimento_sequencia(senha: str, i: int) -> int:
+    if i + 1 >= len(senha):
+        return 1
+    passo = ord(senha[i + 1]) - ord(senha[i])
+    if passo not in (1, -1):
+        return 1
+    fim = i + 1
+    while fim < len(senha) and ord(senha[fim]) - ord(senha[fim - 1]) == passo:
+        fim += 1
+    return fim - i
+
+
+def _comprimento_teclado(senha: str, i: int) -> int:
+    fim = i + 1
+    while fim < len(senha):
+        anterior = _TECLADO.get(senha[fim - 1])
+        atual = _TECLADO.get(senha[fim])
+        if anterior is None or atual is None or anterior[0] != atual[0] or \
+                abs(anterior[1] - atual[1]) != 1:
+            break
+        fim += 1
+    return fim - i
+
+
+def _comprimento_palavra(normalizada: str,
+                         i: int,
+                         palavras: FrozenSet[str],
+                         indice: Dict[str, Tuple[int, ...]]) -> int:
+    for tamanho in indice.get(normalizada[i:i + _TAMANHO_MINIMO_PADRAO], ()):
+        if normalizada[i:i + tamanho] in palavras:
+            return tamanho
+    return 0
+
+
+def _variacoes_palavra(senha: str, minusculas: str, normalizada: str) -> float:
+    """
+    Bits extras de uma palavra do dicionário: 1 se tiver maiúsculas e 1 por substituição
+    "l33t"
+    """
+    maiusculas = 0.0 if senha == minusculas else 1.0
+    return maiusculas + sum(1 for a, b in zip(minusculas, normalizada) if a != b)
+
+
+def _candidatos_palavra(senha: str,
+                        minusculas: str,
+                        normalizada: str,
+                        i: int,
+                        dicionarios: List[Tuple[FrozenSet[str], Dict[str, Tuple[int, ...]], float]]
+                        ) -> List[Tuple[int, float]]:
+    candidatos = []
+    for palavras, indice, bits_palavra in dicionarios:
+        tamanho = _comprimento_palavra(normalizada, i, palavras, indice)
+        if tamanho:
+            fim = i + tamanho
+            variacao = _variacoes_palavra(senha[i:fim], minusculas[i:fim], normalizada[i:fim])
+            candidatos.append((tamanho, bits_palavra + variacao))
+    return candidatos
+
+
+def estimar_entropia(senha: str, lista: Optional[ListaPalavras] = None) -> float:
+    """
+    Estima a entropia (em bits) necessária para adivinhar uma senha.
+
+    - O custo base de cada caractere é log2 do tamanho do conjunto formado pelas classes
+      presentes na senha (maiúsculas, minúsculas, dígitos, símbolos e outros)
+    - A senha é percorrida da esquerda para a direita e, em cada posição, o padrão mais
+      longo encontrado (palavra do dicionário ou de senhas comuns, repetição, sequência ou
+      caminho no teclado) é cobrado como um todo, se for mais barato que os caracteres
+      isolados
+    - As palavras são buscadas sem diferenciar maiúsculas e com as substituições "l33t"
+      desfeitas ('P@ssw0rd' é 'password'); cada variação custa um bit a mais
+    - Tabelas de classes, posições do teclado e o dicionário são pré-calculados
+
+    Args:
+        senha (str): A senha a ser avaliada.
+        lista (Optional[ListaPalavras]): Dicionário de palavras (default: 'palavras.lst' do
+                                         pacote).
+
+    Returns:
+        float: Estimativa da entropia em bits.
+    """
+    if not senha:
+        return 0.0
+
+    if lista is None:
+        lista = carregar_lista_palavras(LISTA_PADRAO)
+    dicionarios = [_dicionario(d) for d in (lista, carregar_lista_palavras(LISTA_COMUNS))
+                   if d is not None]
+
+    classes = {_classe(c) for c in set(senha)}
+    bits_caractere = math.log2(sum(_TAMANHO_CLASSE[classe] for classe in classes))
+    bits_teclado = math.log2(_NUM_TECLAS)
+
+    minusculas = senha.lower()
+    normalizada = minusculas.translate(_LEET)
+    total = 0.0
+    i = 0
+    while i < len(senha):
+        candidatos = _candidatos_palavra(senha, minusculas, normalizada, i, dicionarios)
+
+        tamanho = _comprimento_repeticao(senha, i)
+        if tamanho >= _TAMANHO_MINIMO_PADRAO:
+            candidatos.append((tamanho, bits_caractere + math.log2(tamanho)))
+
+        tamanho = _comprimento_sequencia(senha, i)
+        if tamanho >= _TAMANHO_MINIMO_PADRAO:
+            candidatos.append((tamanho, bits_caractere + math.log2(tamanho) + 1))
+
+        tamanho = _comprimento_teclado(senha, i)
+        if tamanho >= _TAMANHO_MINIMO_PADRAO:
+            candidatos.append((tamanho, bits_teclado + math.log2(tamanho) + 1))
+
+        # Escolhe o padrão que cobre mais caracteres, desde que seja mais barato que cobrá-los
+        # individualmente
+        tamanho, custo = 1, bits_caractere
+        for candidato, bits in candidatos:
+            if bits < candidato * bits_caractere and candidato > tamanho:
+                tamanho, custo = candidato, bits
+
+        total += custo
+        i += tamanho
+
+    return total
+
+
+def pontuar_senha(senha: str,
+                  lista: Optional[ListaPalavras] = None,
+                  vazadas: Optional[FiltroSenhasVazadas] = None) -> int:
+    """
+    Classifica a força de uma senha de 0 (muito fraca) a 4 (muito forte).
+
+    Args:
+        senha (str): A senha a ser avaliada.
+        lista (Optional[ListaPalavras]): Dicionário de palavras (default: 'palavras.lst' do
+                                         pacote).
+        vazadas (Optional[FiltroSenhasVazadas]): Filtro de senhas vazadas; uma senha presente
+                                                 nele recebe no máximo
+                                                 `PONTUACAO_MAXIMA_VAZADA` (default: None).
+
+    Returns:
+        int: A pontuação, calculada a partir de `estimar_entropia()`.
+    """
+    pontuacao = pontuacao_entropia(estimar_entropia(senha, lista))
+    if vazadas is not None and senha in vazadas:
+        return min(pontuacao, PONTUACAO_MAXIMA_VAZADA)
+    return pontuacao
+
+
+def pontuacao_entropia(bits: float) -> int:
+    """
+    Converte uma entropia em bits na pontuação de 0 (muito fraca) a 4 (muito forte).
+
+    Args:
+        bits (float): A entropia em bits.
+
+    Returns:
+        int: A pontuação.
+    """
+    return sum(1 for limiar in _LIMIARES if bits >= limiar)
+
+
+@lru_cache(maxsize=256)
+def entropia_senha_aleatoria(tamanho: int, categorias: Tuple[str, ...]) -> float:
+    """
+    Entropia de uma senha sorteada com um caractere obrigatório por categoria.
+
+    - Conta, por inclusão-exclusão, quantas senhas do tamanho dado contêm ao menos um
+      caractere de cada categoria
+
+    Args:
+        tamanho (int): O tamanho da senha.
+        categorias (Tuple[str, ...]): Os alfabetos das categorias utilizadas.
+
+    Returns:
+        float: A entropia em bits.
+    """
+    total = 0
+    for mascara in range(1 << len(categorias)):
+        excluidos = sum(len(c) for j, c in enumerate(categorias) if mascara & (1 << j))
+        sinal = -1 if bin(mascara).count('1') % 2 else 1
+        total += sinal * (sum(len(c) for c in categorias) - excluidos) ** tamanho
+    return math.log2(total) if total > 0 else 0.0
+
+
+def entropia_senha_frase(lista: ListaPalavras,
+                         num_palavras: int,
+                         palavras_completas: bool = True,
+                         maiuscula: bool = False) -> float:
+    """
+    Entropia de uma senha formada por palavras sorteadas de uma lista.
+
+    Args:
+        lista (ListaPalavras): A lista de onde as palavras são sorteadas.
+        num_palavras (int): Número de palavras.
+        palavras_completas (bool): Se as palavras são usadas inteiras (default: True).
+        maiuscula (bool): Se uma das palavras é convertida para maiúsculas (default: False).
+
+    Returns:
+        float: A entropia em bits.
+    """
+    bits = num_palavras * lista.entropia(palavras_completas)
+    if maiuscula and num_palavras > 1:
+        bits += math.log2(num_palavras)
+    return bits
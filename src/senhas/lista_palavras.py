@@ -0,0 +1,132 @@
+import math
+import os
+import stat
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+TAMANHO_TRUNCADO = 4
+
+
+class ListaPalavras:
+    """
+    Lista de palavras carregada uma única vez e mantida em memória.
+
+    - Guarda as palavras completas e as truncadas nos primeiros 4 caracteres como tuplas
+    - Registra o `mtime` do arquivo no momento da carga, permitindo detectar alterações
+    - Pré-calcula a entropia (em bits) de uma palavra sorteada de cada forma
+
+    Args:
+        arquivo (Path): Caminho do arquivo de palavras, uma palavra por linha.
+    """
+
+    __slots__ = ('caminho', 'mtime', 'completas', 'truncadas', '_entropias')
+
+    def __init__(self, arquivo: Path):
+        self.caminho: Path = Path(arquivo).resolve()
+        self.mtime: int = self.caminho.stat().st_mtime_ns
+
+        with open(self.caminho, 'r') as entrada:
+            palavras = [linha.strip() for linha in entrada]
+
+        self.completas: Tuple[str, ...] = tuple(p for p in palavras if p)
+        self.truncadas: Tuple[str, ...] = tuple(p[:TAMANHO_TRUNCADO] for p in self.completas)
+        self._entropias = (_entropia(self.truncadas), _entropia(self.completas))
+
+    def __len__(self) -> int:
+        return len(self.completas)
+
+    def palavras(self, completas: bool = True) -> Tuple[str, ...]:
+        """
+        Retorna a tupla de palavras completas ou truncadas.
+
+        Args:
+            completas (bool): Se True, retorna as palavras inteiras; se False, apenas os
+                              primeiros 4 caracteres de cada palavra (default: True).
+
+        Returns:
+            Tuple[str, ...]: As palavras da lista.
+        """
+        return self.completas if completas else self.truncadas
+
+    def entropia(self, completas: bool = True) -> float:
+        """
+        Retorna a entropia (em bits) de uma palavra sorteada uniformemente da lista.
+
+        - Palavras repetidas (comuns na forma truncada) reduzem a entropia
+
+        Args:
+            completas (bool): Se True, considera as palavras inteiras; se False, as
+                              truncadas (default: True).
+
+        Returns:
+            float: A entropia em bits.
+        """
+        return self._entropias[completas]
+
+    def desatualizada(self) -> bool:
+        """
+        Verifica se o arquivo foi alterado (ou removido) desde a carga.
+
+        Returns:
+            bool: True se o `mtime` atual do arquivo for diferente do registrado na carga.
+        """
+        try:
+            return self.caminho.stat().st_mtime_ns != self.mtime
+        except OSError:
+            return True
+
+
+def _entropia(palavras: Tuple[str, ...]) -> float:
+    total = len(palavras)
+    if total == 0:
+        return 0.0
+    return math.log2(total) - sum(n * math.log2(n) for n in Counter(palavras).values()) / total
+
+
+_cache: Dict[str, ListaPalavras] = {}
+_cache_lock = threading.Lock()
+
+
+def carregar_lista_palavras(arquivo: Path = Path("palavras.lst")) -> Optional[ListaPalavras]:
+    """
+    Obtém a lista de palavras do cache, carregando o arquivo apenas quando necessário.
+
+    - A lista é mantida em cache por caminho absoluto e recarregada automaticamente se o
+      `mtime` do arquivo mudar; uma consulta ao cache custa um único `stat()`
+
+    Args:
+        arquivo (Path): Caminho do arquivo de palavras (default: 'palavras.lst').
+
+    Returns:
+        Optional[ListaPalavras]: A lista carregada, ou None se o `arquivo` não existir.
+    """
+    try:
+        info = os.stat(arquivo)
+    except OSError:
+        return None
+    if not stat.S_ISREG(info.st_mode):
+        return None
+
+    chave = os.path.abspath(arquivo)
+    with _cache_lock:
+        lista = _cache.get(chave)
+        if lista is None or lista.mtime != info.st_mtime_ns:
+            lista = ListaPalavras(Path(chave))
+            _cache[chave] = lista
+    return lista
+
+
+def invalidar_lista_palavras(arquivo: Optional[Path] = None) -> None:
+    """
+    Descarta listas de palavras do cache, forçando a releitura na próxima carga.
+
+    Args:
+        arquivo (Optional[Path]): Arquivo a ser descartado; se None, esvazia todo o cache.
+    """
+    with _cache_lock:
+        if arquivo is None:
+            _cache.clear()
+        else:
+            _cache.pop(os.path.abspath(arquivo), None)
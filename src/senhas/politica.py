@@ -0,0 +1,179 @@
+import re
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from src.senhas.vazadas import FiltroSenhasVazadas
+
+MAIUSCULA = 1
+MINUSCULA = 2
+DIGITO = 4
+SIMBOLO = 8
+
+# Nome da regra reportada para cada classe de caracteres exigida
+_REGRAS_CLASSES = (
+    (MAIUSCULA, 'maiusculas'),
+    (MINUSCULA, 'minusculas'),
+    (DIGITO, 'digitos'),
+    (SIMBOLO, 'simbolos'),
+)
+
+
+def _classificar(c: str) -> int:
+    """
+    Classifica um caractere com a mesma semântica de `[A-Z]`, `[a-z]`, `\\d` e `\\W`
+    """
+    if 'A' <= c <= 'Z':
+        return MAIUSCULA
+    if 'a' <= c <= 'z':
+        return MINUSCULA
+    if c.isdecimal():
+        return DIGITO
+    if not (c.isalnum() or c == '_'):
+        return SIMBOLO
+    return 0
+
+
+# Conjuntos pré-calculados dos caracteres ASCII de cada classe; os demais caracteres são
+# classificados sob demanda
+_CONJUNTOS = {classe: frozenset(chr(i) for i in range(128) if _classificar(chr(i)) == classe)
+              for classe, _ in _REGRAS_CLASSES}
+
+
+class PoliticaSenha:
+    """
+    Política de complexidade de senhas compilada uma única vez.
+
+    - O comprimento mínimo é verificado antes de qualquer varredura
+    - As classes de caracteres são verificadas em uma única passada sobre a senha, que
+      monta o conjunto de caracteres distintos; as classes exigidas são então testadas contra
+      conjuntos pré-calculados, parando na primeira ausente em `valida()`
+    - Regras extras opcionais: máximo de repetições consecutivas de um mesmo caractere,
+      substrings proibidas (sem diferenciar maiúsculas e minúsculas) e senhas vazadas
+
+    Args:
+        tamanho (int): Comprimento mínimo exigido para a senha (default: 8).
+        maiusculas (bool): Se True, exige ao menos uma letra maiúscula (default: True).
+        minusculas (bool): Se True, exige ao menos uma letra minúscula (default: True).
+        digitos (bool): Se True, exige ao menos um número (default: True).
+        simbolos (bool): Se True, exige ao menos um caractere não alfanumérico (default: True).
+        max_repeticoes (Optional[int]): Número máximo de vezes que um mesmo caractere pode
+                                        aparecer consecutivamente (default: None, sem limite).
+        substrings_proibidas (Iterable[str]): Trechos que não podem aparecer na senha
+                                              (default: nenhum).
+        vazadas (Optional[FiltroSenhasVazadas]): Filtro de senhas vazadas a ser consultado
+                                                 (default: None).
+    """
+
+    def __init__(self,
+                 tamanho: int = 8,
+                 maiusculas: bool = True,
+                 minusculas: bool = True,
+                 digitos: bool = True,
+                 simbolos: bool = True,
+                 max_repeticoes: Optional[int] = None,
+                 substrings_proibidas: Iterable[str] = (),
+                 vazadas: Optional[FiltroSenhasVazadas] = None):
+        self.tamanho = tamanho
+        self.exigidas = ((MAIUSCULA if maiusculas else 0) |
+                         (MINUSCULA if minusculas else 0) |
+                         (DIGITO if digitos else 0) |
+                         (SIMBOLO if simbolos else 0))
+        self.max_repeticoes = max_repeticoes
+        self._conjuntos = tuple((classe, _CONJUNTOS[classe]) for classe, _ in _REGRAS_CLASSES
+                                if self.exigidas & classe)
+
+        self._repeticao = None
+        if max_repeticoes is not None:
+            self._repeticao = re.compile(r'(.)\1{%d}' % max_repeticoes, re.DOTALL)
+
+        proibidas = sorted({s.lower() for s in substrings_proibidas if s}, key=len, reverse=True)
+        self._proibidas = None
+        if proibidas:
+            self._proibidas = re.compile('|'.join(re.escape(s) for s in proibidas))
+
+        self.vazadas = vazadas
+
+    def _faltando(self, senha: str, parar_na_primeira: bool = False) -> int:
+        """
+        Retorna as classes exigidas que não aparecem na senha, em uma passada sobre a senha
+        """
+        caracteres = set(senha)
+        ascii = senha.isascii()
+        faltando = 0
+        for classe, conjunto in self._conjuntos:
+            if conjunto.isdisjoint(caracteres):
+                faltando |= classe
+                if parar_na_primeira and ascii:
+                    return faltando
+        # Dígitos e símbolos também podem vir de caracteres fora do ASCII
+        if faltando & (DIGITO | SIMBOLO) and not ascii:
+            for c in caracteres:
+                if c > '\x7f':
+                    faltando &= ~_classificar(c)
+        return faltando
+
+    def valida(self, senha: str) -> bool:
+        """
+        Verifica se a senha atende à política, encerrando na primeira regra violada.
+
+        Args:
+            senha (str): A senha a ser validada.
+
+        Returns:
+            bool: True se a senha atender a todas as regras, False caso contrário.
+        """
+        if len(senha) < self.tamanho:
+            return False
+        if self._conjuntos and self._faltando(senha, parar_na_primeira=True):
+            return False
+        if self._repeticao is not None and self._repeticao.search(senha):
+            return False
+        if self._proibidas is not None and self._proibidas.search(senha.lower()):
+            return False
+        if self.vazadas is not None and senha in self.vazadas:
+            return False
+        return True
+
+    def verificar(self, senha: str) -> List[str]:
+        """
+        Verifica a senha e informa quais regras da política foram violadas.
+
+        Args:
+            senha (str): A senha a ser verificada.
+
+        Returns:
+            List[str]: Nomes das regras violadas ('tamanho', 'maiusculas', 'minusculas',
+                       'digitos', 'simbolos', 'repeticoes', 'proibidas', 'vazada'); vazia
+                       se a senha for válida.
+        """
+        falhas = []
+        if len(senha) < self.tamanho:
+            falhas.append('tamanho')
+        if self._conjuntos:
+            faltando = self._faltando(senha)
+            falhas.extend(nome for classe, nome in _REGRAS_CLASSES if faltando & classe)
+        if self._repeticao is not None and self._repeticao.search(senha):
+            falhas.append('repeticoes')
+        if self._proibidas is not None and self._proibidas.search(senha.lower()):
+            falhas.append('proibidas')
+        if self.vazadas is not None and senha in self.vazadas:
+            falhas.append('vazada')
+        return falhas
+
+    def validar_lote(self, senhas: Iterable[str]) -> Iterator[Tuple[str, List[str]]]:
+        """
+        Audita um conjunto de senhas de forma preguiçosa, sem carregar todas em memória.
+
+        - Senhas válidas são confirmadas pelo caminho rápido de `valida()`; apenas as
+          inválidas passam por `verificar()` para identificar as regras violadas
+
+        Args:
+            senhas (Iterable[str]): As senhas a serem verificadas.
+
+        Returns:
+            Iterator[Tuple[str, List[str]]]: Pares (senha, regras violadas), na mesma ordem da
+                                             entrada.
+        """
+        valida = self.valida
+        verificar = self.verificar
+        for senha in senhas:
+            yield senha, ([] if valida(senha) else verificar(senha))
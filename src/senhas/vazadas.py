@@ -0,0 +1,166 @@
+import hashlib
+import math
+import mmap
+import re
+import struct
+from pathlib import Path
+from typing import Iterator, Optional
+
+# Cabeçalho do arquivo: assinatura, versão, número de bits (m), número de funções hash (k)
+# e número de elementos inseridos (n)
+_ASSINATURA = b'SDBLOOM1'
+_CABECALHO = struct.Struct('<8sIQIQ')
+_VERSAO = 1
+
+_SHA1_HEX = re.compile(rb'^[0-9A-Fa-f]{40}$')
+
+
+def _indices(digest: bytes, num_bits: int, num_hashes: int) -> Iterator[int]:
+    """
+    Deriva os `num_hashes` índices de bit a partir de um SHA-1 (hashing duplo de
+    Kirsch-Mitzenmacher)
+    """
+    h1 = int.from_bytes(digest[0:8], 'little')
+    h2 = int.from_bytes(digest[8:16], 'little') | 1
+    for i in range(num_hashes):
+        yield (h1 + i * h2) % num_bits
+
+
+def _digest_linha(linha: bytes, formato: str) -> Optional[bytes]:
+    linha = linha.rstrip(b'\r\n')
+    if formato == 'sha1':
+        # Aceita o formato "HASH" ou "HASH:contagem" das listas públicas de senhas vazadas
+        valor = linha.split(b':', 1)[0].strip()
+        if not _SHA1_HEX.match(valor):
+            return None
+        return bytes.fromhex(valor.decode('ascii'))
+    if not linha:
+        return None
+    return hashlib.sha1(linha).digest()
+
+
+def construir_filtro_senhas(origem: Path,
+                            destino: Path,
+                            formato: str = 'texto',
+                            taxa_falsos_positivos: float = 0.001,
+                            num_elementos: Optional[int] = None) -> int:
+    """
+    Constrói um filtro de Bloom em disco a partir de uma lista de senhas vazadas.
+
+    - A origem é lida em streaming, linha a linha, nas duas passadas (contagem e inserção)
+    - O tamanho do filtro e o número de funções hash são calculados a partir do número de
+      elementos e da taxa de falsos positivos desejada
+
+    Args:
+        origem (Path): Arquivo com uma senha UTF-8 por linha ('texto') ou um SHA-1
+                       hexadecimal por linha, opcionalmente seguido de ':contagem' ('sha1').
+        destino (Path): Arquivo do filtro a ser gerado.
+        formato (str): 'texto' ou 'sha1' (default: 'texto').
+        taxa_falsos_positivos (float): Probabilidade de falso positivo desejada
+                                       (default: 0.001).
+        num_elementos (Optional[int]): Número de elementos, se conhecido, evitando a passada
+                                       de contagem (default: None).
+
+    Returns:
+        int: Número de elementos inseridos no filtro.
+    """
+    if formato not in ('texto', 'sha1'):
+        raise ValueError(f"Formato desconhecido: {formato}")
+
+    def digests() -> Iterator[bytes]:
+        with open(origem, 'rb') as entrada:
+            for linha in entrada:
+                digest = _digest_linha(linha, formato)
+                if digest is not None:
+                    yield digest
+
+    if num_elementos is None:
+        num_elementos = sum(1 for _ in digests())
+
+    n = max(num_elementos, 1)
+    num_bits = max(int(math.ceil(-n * math.log(taxa_falsos_positivos) / (math.log(2) ** 2))), 64)
+    num_bits = (num_bits + 7) // 8 * 8
+    num_hashes = max(int(round(num_bits / n * math.log(2))), 1)
+
+    bits = bytearray(num_bits // 8)
+    inseridos = 0
+    for digest in digests():
+        for indice in _indices(digest, num_bits, num_hashes):
+            bits[indice >> 3] |= 1 << (indice & 7)
+        inseridos += 1
+
+    with open(destino, 'wb') as saida:
+        saida.write(_CABECALHO.pack(_ASSINATURA, _VERSAO, num_bits, num_hashes, inseridos))
+        saida.write(bits)
+
+    return inseridos
+
+
+class FiltroSenhasVazadas:
+    """
+    Consulta um filtro de Bloom de senhas vazadas gerado por `construir_filtro_senhas()`.
+
+    - O arquivo é mapeado em memória com `mmap`; apenas as páginas tocadas pelas consultas
+      são lidas do disco
+    - Cada consulta calcula um SHA-1 e testa `k` bits, com custo independente do tamanho da
+      lista original. Falsos positivos são possíveis, falsos negativos não
+
+    Args:
+        arquivo (Path): Arquivo do filtro.
+    """
+
+    def __init__(self, arquivo: Path):
+        self.arquivo = Path(arquivo)
+        with open(self.arquivo, 'rb') as entrada:
+            self._mmap = mmap.mmap(entrada.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._mmap) < _CABECALHO.size:
+            self._mmap.close()
+            raise ValueError(f"Arquivo de filtro inválido: {arquivo}")
+        assinatura, versao, self.num_bits, self.num_hashes, self.num_elementos = \
+            _CABECALHO.unpack_from(self._mmap, 0)
+        if (assinatura != _ASSINATURA or versao != _VERSAO or
+                len(self._mmap) < _CABECALHO.size + self.num_bits // 8):
+            self._mmap.close()
+            raise ValueError(f"Arquivo de filtro inválido: {arquivo}")
+
+    def __enter__(self) -> 'FiltroSenhasVazadas':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.fechar()
+
+    def __contains__(self, senha: str) -> bool:
+        return self.contem_sha1(hashlib.sha1(senha.encode('utf-8')).digest())
+
+    def contem_sha1(self, digest: bytes) -> bool:
+        """
+        Verifica se o SHA-1 (20 bytes) de uma senha está no filtro.
+
+        Args:
+            digest (bytes): O SHA-1 da senha.
+
+        Returns:
+            bool: True se a senha provavelmente está na lista, False se certamente não está.
+        """
+        dados = self._mmap
+        base = _CABECALHO.size
+        for indice in _indices(digest, self.num_bits, self.num_hashes):
+            if not dados[base + (indice >> 3)] & (1 << (indice & 7)):
+                return False
+        return True
+
+    def contem(self, senha: str) -> bool:
+        """
+        Verifica se uma senha está no filtro.
+
+        Args:
+            senha (str): A senha em texto plano.
+
+        Returns:
+            bool: True se a senha provavelmente está na lista, False se certamente não está.
+        """
+        return senha in self
+
+    def fechar(self) -> None:
+        self._mmap.close()
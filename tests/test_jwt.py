@@ -1,9 +1,23 @@
+import hashlib
+import hmac
+import json
+import random
 from time import sleep, time
 
 import jwt
 import pytest
+from jwt.utils import base64url_encode
 
-from src.jwtokens import criar_token_jwt, verifica_token_jwt
+from src.jwtokens import criar_token_jwt, verifica_token_jwt, verifica_tokens_lote
+from src.jwtokens.banco import PoolConexoes
+from src.jwtokens.benchmark import comparar_algoritmos
+from src.jwtokens.cache import BackendMemoria, CacheRespostas, CacheTokens
+from src.jwtokens.chaves import EDDSA, ES256, HS256, ChaveAssinatura, carregar_chave_pem
+from src.jwtokens.chaveiro import VARIAVEL_ARQUIVO, VARIAVEL_CHAVES, Chaveiro
+from src.jwtokens.limitador import LimitadorTaxa
+from src.jwtokens.rapido import CodecHS256, codec_rapido_ativo, definir_codec_rapido
+from src.jwtokens.revogacao import ListaRevogacao
+from src.jwtokens.sessoes import SessoesRefresh, criar_tabela
 
 
 # Test fixtures
@@ -54,7 +68,7 @@ def test_criar_token_jwt_expiration(sign_key):
 
     # Token should be valid initially
     decoded = jwt.decode(token, sign_key, algorithms=['HS256'])
-    assert decoded['exp'] - decoded['iat'] == expires_in
+    assert decoded['exp'] - int(decoded['iat']) == expires_in
 
     # Wait for token to expire
     sleep(expires_in + 1)
@@ -136,3 +150,760 @@ def test_verifica_token_jwt_action_case_sensitive(sign_key):
     claims = verifica_token_jwt(token, sign_key)
     assert claims['valid'] is True
     assert claims['action'] == action.lower()
+
+
+# Tests for CacheTokens
+class TestCacheTokens:
+    def test_hit_returns_same_claims(self, sign_key):
+        cache = CacheTokens()
+        token = criar_token_jwt(sub='user', sign_key=sign_key, action='login',
+                                extra_data={'role': 'admin'})
+        primeiro = cache.verificar(token, sign_key)
+        segundo = cache.verificar(token, sign_key)
+        assert primeiro == segundo == verifica_token_jwt(token, sign_key)
+        assert (cache.acertos, cache.falhas) == (1, 1)
+        assert cache.estatisticas()['taxa_acertos'] == 0.5
+
+    def test_age_recomputed_on_hit(self, sign_key):
+        cache = CacheTokens()
+        token = criar_token_jwt(sub='user', sign_key=sign_key, issued_at=int(time()) - 10)
+        cache.verificar(token, sign_key)
+        assert cache.verificar(token, sign_key)['age'] >= 10
+
+    def test_invalid_tokens_not_cached(self, sign_key):
+        cache = CacheTokens()
+        token = criar_token_jwt(sub='user', sign_key=b'other_key')
+        assert cache.verificar(token, sign_key)['reason'] == 'invalid_signature'
+        assert len(cache) == 0
+        assert cache.verificar('invalid.token.here', sign_key)['reason'] == 'invalid'
+
+    def test_evicted_on_expiry(self, sign_key):
+        cache = CacheTokens()
+        token = criar_token_jwt(sub='user', sign_key=sign_key, expires_in=1)
+        assert cache.verificar(token, sign_key)['valid']
+        sleep(1.1)
+        claims = cache.verificar(token, sign_key)
+        assert not claims['valid']
+        assert claims['reason'] == 'expired'
+        assert len(cache) == 0
+
+    def test_key_rotation_takes_effect(self, sign_key):
+        cache = CacheTokens()
+        token = criar_token_jwt(sub='user', sign_key=sign_key)
+        assert cache.verificar(token, sign_key)['valid']
+        claims = cache.verificar(token, b'rotated_key')
+        assert claims['reason'] == 'invalid_signature'
+        assert cache.acertos == 0
+
+    def test_invalidar(self, sign_key):
+        cache = CacheTokens()
+        token = criar_token_jwt(sub='user', sign_key=sign_key)
+        cache.verificar(token, sign_key)
+        assert cache.invalidar(token)
+        assert not cache.invalidar(token)
+        cache.verificar(token, sign_key)
+        assert cache.falhas == 2
+
+    def test_lru_bound(self, sign_key):
+        cache = CacheTokens(max_itens=2)
+        tokens = [criar_token_jwt(sub=f'user{i}', sign_key=sign_key) for i in range(3)]
+        for token in tokens:
+            cache.verificar(token, sign_key)
+        assert len(cache) == 2
+        cache.verificar(tokens[0], sign_key)
+        assert cache.acertos == 0
+        cache.verificar(tokens[2], sign_key)
+        assert cache.acertos == 1
+
+    def test_missing_key(self):
+        cache = CacheTokens()
+        assert cache.verificar('a.b.c', None) == {'valid': False, 'reason': 'missing_key'}
+
+
+# Tests for Chaveiro
+class TestCacheRespostas:
+    def test_hit_and_miss(self):
+        cache = CacheRespostas()
+        assert cache.obter('a') is None
+        assert cache.guardar('a', b'{}', {'ETag': '"r1"'}, cache.versao('a'))
+        assert cache.obter('a') == (b'{}', {'ETag': '"r1"'})
+        assert cache.estatisticas() == {'acertos': 1, 'falhas': 1, 'itens': 1,
+                                        'taxa_acertos': 0.5}
+
+    def test_max_items(self):
+        cache = CacheRespostas(max_itens=2)
+        for chave in 'abc':
+            cache.guardar(chave, b'{}', {}, cache.versao(chave))
+        assert len(cache) == 2
+        assert cache.obter('a') is None
+        assert cache.obter('c') is not None
+
+    def test_ttl(self):
+        cache = CacheRespostas(ttl=0.1)
+        cache.guardar('a', b'{}', {}, cache.versao('a'))
+        sleep(0.15)
+        assert cache.obter('a') is None
+        assert len(cache) == 0
+
+    def test_invalidate(self):
+        cache = CacheRespostas()
+        cache.guardar('a', b'{}', {}, cache.versao('a'))
+        cache.invalidar('a')
+        assert cache.obter('a') is None
+
+    def test_stale_read_not_stored(self):
+        cache = CacheRespostas()
+        # Leitura do banco iniciada antes de uma escrita que invalidou a chave
+        versao = cache.versao('a')
+        cache.invalidar('a')
+        assert not cache.guardar('a', b'antigo', {}, versao)
+        assert cache.obter('a') is None
+
+    def test_other_keys_do_not_discard_reads(self):
+        cache = CacheRespostas(faixas=1024)
+        versoes = {chave: cache.versao(chave) for chave in ('a', 'b')}
+        # Escritas em outras chaves (de outras faixas) não descartam as leituras em curso
+        outras = [f'outra{i}' for i in range(100)
+                  if cache._faixa(f'outra{i}') not in (cache._faixa('a'), cache._faixa('b'))]
+        for chave in outras:
+            cache.invalidar(chave)
+        assert cache.guardar('a', b'{}', {}, versoes['a'])
+        cache.invalidar('b')
+        assert not cache.guardar('b', b'{}', {}, versoes['b'])
+
+    def test_clear(self):
+        cache = CacheRespostas()
+        cache.guardar('a', b'{}', {}, cache.versao('a'))
+        cache.obter('a')
+        cache.limpar()
+        assert cache.estatisticas() == {'acertos': 0, 'falhas': 0, 'itens': 0,
+                                        'taxa_acertos': None}
+
+    def test_shared_backend(self):
+        backend = BackendMemoria()
+        processo1 = CacheRespostas(backend=backend)
+        processo2 = CacheRespostas(backend=backend)
+        assert processo1.guardar('a', b'{"v":1}', {'ETag': '"r1"'},
+                                 processo1.versao('a'))
+        assert processo2.obter('a') == (b'{"v":1}', {'ETag': '"r1"'})
+
+        # A invalidação em um processo vale para o outro, e impede que uma leitura antiga,
+        # iniciada antes dela em outro processo, seja guardada
+        versao = processo2.versao('a')
+        processo1.invalidar('a')
+        assert processo2.obter('a') is None
+        assert not processo2.guardar('a', b'{"v":1}', {}, versao)
+        assert processo2.obter('a') is None
+
+    def test_shared_backend_clear(self):
+        backend = BackendMemoria()
+        backend.set('outro:chave', b'1', None)
+        cache = CacheRespostas(backend=backend)
+        cache.guardar('a', b'{}', {}, cache.versao('a'))
+        outro = CacheRespostas(backend=backend)
+        cache.limpar()
+        # Apenas as respostas deste prefixo são descartadas, para todos os processos
+        assert outro.obter('a') is None
+        assert backend.get('outro:chave') == b'1'
+        assert outro.guardar('a', b'{}', {}, outro.versao('a'))
+        assert cache.obter('a') == (b'{}', {})
+
+    def test_shared_backend_tombstone_expires(self):
+        backend = BackendMemoria()
+        cache = CacheRespostas(backend=backend, ttl_invalidacao=0.1)
+        cache.invalidar('a')
+        assert not cache.guardar('a', b'{}', {}, cache.versao('a'))
+        sleep(0.15)
+        assert cache.guardar('a', b'{}', {}, cache.versao('a'))
+        assert cache.obter('a') == (b'{}', {})
+
+
+class TestChaveiro:
+    def test_sign_with_active_kid(self):
+        chaveiro = Chaveiro()
+        kid = chaveiro.gerar()
+        token = criar_token_jwt(sub='user', chaveiro=chaveiro)
+        assert jwt.get_unverified_header(token)['kid'] == kid
+        assert verifica_token_jwt(token, chaveiro=chaveiro)['valid']
+        assert verifica_token_jwt(token, chaveiro.ativa[1].assinatura)['valid']
+
+    def test_token_without_kid_uses_active_key(self):
+        chaveiro = Chaveiro()
+        chaveiro.gerar()
+        token = criar_token_jwt(sub='user', sign_key=chaveiro.ativa[1].assinatura)
+        assert verifica_token_jwt(token, chaveiro=chaveiro)['valid']
+
+    def test_rotation(self):
+        chaveiro = Chaveiro()
+        antiga = chaveiro.gerar()
+        token_antigo = criar_token_jwt(sub='user', chaveiro=chaveiro)
+        nova = chaveiro.gerar(ativar=False)
+        assert chaveiro.ativa[0] == antiga
+        chaveiro.ativar(nova)
+        token_novo = criar_token_jwt(sub='user', chaveiro=chaveiro)
+        assert jwt.get_unverified_header(token_novo)['kid'] == nova
+        assert verifica_token_jwt(token_antigo, chaveiro=chaveiro)['valid']
+        assert verifica_token_jwt(token_novo, chaveiro=chaveiro)['valid']
+
+        chaveiro.aposentar(antiga)
+        claims = verifica_token_jwt(token_antigo, chaveiro=chaveiro)
+        assert claims == {'valid': False, 'reason': 'unknown_key'}
+        assert verifica_token_jwt(token_novo, chaveiro=chaveiro)['valid']
+
+    def test_cannot_retire_active_key(self):
+        chaveiro = Chaveiro()
+        kid = chaveiro.gerar()
+        with pytest.raises(ValueError):
+            chaveiro.aposentar(kid)
+        with pytest.raises(KeyError):
+            chaveiro.ativar('inexistente')
+
+    def test_key_from_other_ring_rejected(self):
+        chaveiro = Chaveiro()
+        chaveiro.gerar(kid='k1')
+        outro = Chaveiro()
+        outro.gerar(kid='k1')
+        token = criar_token_jwt(sub='user', chaveiro=outro)
+        assert verifica_token_jwt(token, chaveiro=chaveiro)['reason'] == 'invalid_signature'
+
+    def test_invalid_token(self):
+        chaveiro = Chaveiro()
+        chaveiro.gerar()
+        assert verifica_token_jwt('invalid.token.here', chaveiro=chaveiro)['reason'] == 'invalid'
+
+    def test_file_round_trip_and_reload(self, tmp_path):
+        arquivo = tmp_path / 'chaves.json'
+        chaveiro = Chaveiro()
+        chaveiro.gerar(kid='k1')
+        chaveiro.salvar(arquivo)
+
+        carregado = Chaveiro.de_arquivo(arquivo, intervalo=0)
+        assert carregado.ativa == chaveiro.ativa
+        token = criar_token_jwt(sub='user', chaveiro=carregado)
+
+        # Outro processo publica e ativa uma nova chave
+        chaveiro.gerar(kid='k2')
+        chaveiro.salvar(arquivo)
+        assert carregado.ativa == chaveiro.ativa
+        assert verifica_token_jwt(token, chaveiro=carregado)['valid']
+
+    def test_from_environment(self, monkeypatch, tmp_path):
+        chaveiro = Chaveiro()
+        chaveiro.gerar(kid='k1')
+        monkeypatch.delenv(VARIAVEL_ARQUIVO, raising=False)
+        monkeypatch.setenv(VARIAVEL_CHAVES, chaveiro.texto)
+        assert Chaveiro.de_ambiente().ativa == chaveiro.ativa
+
+        arquivo = tmp_path / 'chaves.json'
+        chaveiro.gerar(kid='k2')
+        chaveiro.salvar(arquivo)
+        monkeypatch.setenv(VARIAVEL_ARQUIVO, str(arquivo))
+        assert Chaveiro.de_ambiente().ativa == chaveiro.ativa
+
+        monkeypatch.delenv(VARIAVEL_ARQUIVO)
+        monkeypatch.delenv(VARIAVEL_CHAVES)
+        assert Chaveiro.de_ambiente() is None
+
+    def test_cache_respects_rotation(self):
+        chaveiro = Chaveiro()
+        antiga = chaveiro.gerar()
+        token = criar_token_jwt(sub='user', chaveiro=chaveiro)
+        cache = CacheTokens()
+        assert cache.verificar(token, chaveiro=chaveiro)['valid']
+        assert cache.verificar(token, chaveiro=chaveiro)['valid']
+        assert cache.acertos == 1
+
+        chaveiro.ativar(chaveiro.gerar())
+        assert cache.verificar(token, chaveiro=chaveiro)['valid']
+        chaveiro.aposentar(antiga)
+        assert cache.verificar(token, chaveiro=chaveiro)['reason'] == 'unknown_key'
+
+
+# Tests for asymmetric algorithms
+class TestAlgoritmosAssimetricos:
+    @pytest.mark.parametrize('algoritmo', [EDDSA, ES256])
+    def test_sign_and_verify(self, algoritmo):
+        chave = ChaveAssinatura.gerar(algoritmo)
+        token = criar_token_jwt(sub='user', sign_key=chave.assinatura, algorithm=algoritmo)
+        assert jwt.get_unverified_header(token)['alg'] == algoritmo
+        assert verifica_token_jwt(token, chave.verificacao, algorithm=algoritmo)['valid']
+
+    @pytest.mark.parametrize('algoritmo', [EDDSA, ES256])
+    def test_verify_with_pem(self, algoritmo):
+        chave = ChaveAssinatura.gerar(algoritmo)
+        token = criar_token_jwt(sub='user', sign_key=chave.assinatura, algorithm=algoritmo)
+        pem = chave.json()['publica']
+        carregar_chave_pem.cache_clear()
+        assert verifica_token_jwt(token, pem, algorithm=algoritmo)['valid']
+        assert verifica_token_jwt(token, pem, algorithm=algoritmo)['valid']
+        assert carregar_chave_pem.cache_info().misses == 1
+
+    def test_algorithm_confusion_rejected(self):
+        chave = ChaveAssinatura.gerar(EDDSA)
+        pem = chave.json()['publica']
+        # Token HS256 assinado com a chave pública como segredo
+        token = jwt.encode({'sub': 'user', 'exp': int(time()) + 60}, 'segredo', algorithm=HS256)
+        claims = verifica_token_jwt(token, pem, algorithm=EDDSA)
+        assert not claims['valid']
+
+    def test_wrong_key_type(self):
+        chave = ChaveAssinatura.gerar(ES256)
+        token = criar_token_jwt(sub='user', sign_key=chave.assinatura, algorithm=ES256)
+        pem = chave.json()['publica']
+        assert verifica_token_jwt(token, pem, algorithm=EDDSA)['reason'] == 'invalid_key'
+
+    def test_unknown_algorithm(self):
+        with pytest.raises(ValueError):
+            criar_token_jwt(sub='user', sign_key=b'key', algorithm='none')
+
+    @pytest.mark.parametrize('algoritmo', [EDDSA, ES256])
+    def test_public_key_ring(self, algoritmo, tmp_path):
+        chaveiro = Chaveiro()
+        chaveiro.gerar(kid='hs')
+        chaveiro.gerar(kid='asym', algoritmo=algoritmo)
+        token = criar_token_jwt(sub='user', chaveiro=chaveiro)
+        assert jwt.get_unverified_header(token) == {'alg': algoritmo, 'kid': 'asym',
+                                                    'typ': 'JWT'}
+
+        arquivo = tmp_path / 'publicas.json'
+        chaveiro.publico().salvar(arquivo)
+        assert 'PRIVATE' not in arquivo.read_text()
+        publico = Chaveiro.de_arquivo(arquivo)
+        assert publico.kids == ('asym',)
+        assert verifica_token_jwt(token, chaveiro=publico)['valid']
+        assert criar_token_jwt(sub='user', chaveiro=publico) is None
+
+        token_hs = criar_token_jwt(sub='user', sign_key=chaveiro.chave('hs').assinatura)
+        assert not verifica_token_jwt(token_hs, chaveiro=publico)['valid']
+
+    def test_key_ring_round_trip(self):
+        chaveiro = Chaveiro()
+        chaveiro.gerar(kid='ed', algoritmo=EDDSA)
+        chaveiro.gerar(kid='ec', algoritmo=ES256)
+        copia = Chaveiro.de_texto(chaveiro.texto)
+        assert copia.ativa[0] == 'ec'
+        for kid in ('ed', 'ec'):
+            assert copia.chave(kid) == chaveiro.chave(kid)
+        token = criar_token_jwt(sub='user', chaveiro=copia)
+        assert verifica_token_jwt(token, chaveiro=chaveiro)['valid']
+
+    def test_cache_with_asymmetric_key(self):
+        chaveiro = Chaveiro()
+        chaveiro.gerar(algoritmo=EDDSA)
+        token = criar_token_jwt(sub='user', chaveiro=chaveiro)
+        cache = CacheTokens()
+        assert cache.verificar(token, chaveiro=chaveiro)['valid']
+        assert cache.verificar(token, chaveiro=chaveiro)['valid']
+        assert cache.acertos == 1
+
+    def test_benchmark(self):
+        resultados = comparar_algoritmos(repeticoes=5)
+        assert [r[0] for r in resultados] == [HS256, EDDSA, ES256, 'HS256 (rápido)']
+        assert all(r[1] > 0 and r[2] > 0 for r in resultados)
+
+
+# Tests for ListaRevogacao
+class TestListaRevogacao:
+    def test_jti_generated(self, sign_key):
+        primeiro = verifica_token_jwt(criar_token_jwt(sub='user', sign_key=sign_key), sign_key)
+        segundo = verifica_token_jwt(criar_token_jwt(sub='user', sign_key=sign_key), sign_key)
+        assert primeiro['jti'] and primeiro['jti'] != segundo['jti']
+
+    def test_revoke_jti(self, sign_key):
+        revogacao = ListaRevogacao()
+        token = criar_token_jwt(sub='user', sign_key=sign_key)
+        outro = criar_token_jwt(sub='user', sign_key=sign_key)
+        claims = verifica_token_jwt(token, sign_key, revogacao=revogacao)
+        assert claims['valid']
+
+        revogacao.revogar(claims['jti'], claims['exp'])
+        assert verifica_token_jwt(token, sign_key, revogacao=revogacao) == \
+               {'valid': False, 'reason': 'revoked'}
+        assert verifica_token_jwt(outro, sign_key, revogacao=revogacao)['valid']
+
+    def test_revoke_sub(self, sign_key):
+        revogacao = ListaRevogacao()
+        antigo = criar_token_jwt(sub='user', sign_key=sign_key, issued_at=int(time()) - 10)
+        outro_usuario = criar_token_jwt(sub='other', sign_key=sign_key)
+        revogacao.revogar_sub('user', emitidos_ate=time() - 5)
+        novo = criar_token_jwt(sub='user', sign_key=sign_key)
+        assert verifica_token_jwt(antigo, sign_key, revogacao=revogacao)['reason'] == 'revoked'
+        assert verifica_token_jwt(novo, sign_key, revogacao=revogacao)['valid']
+        assert verifica_token_jwt(outro_usuario, sign_key, revogacao=revogacao)['valid']
+        assert len(revogacao) == 1
+
+    def test_new_token_after_revoke_same_second(self, sign_key):
+        revogacao = ListaRevogacao()
+        antigo = criar_token_jwt(sub='user', sign_key=sign_key)
+        sleep(0.01)
+        revogacao.revogar_sub('user')
+        sleep(0.01)
+        novo = criar_token_jwt(sub='user', sign_key=sign_key)
+        assert verifica_token_jwt(antigo, sign_key, revogacao=revogacao)['reason'] == 'revoked'
+        assert verifica_token_jwt(novo, sign_key, revogacao=revogacao)['valid']
+
+    def test_longer_tokens_than_retention_revoked(self, sign_key):
+        revogacao = ListaRevogacao(duracao_maxima=60)
+        curto = criar_token_jwt(sub='user', sign_key=sign_key, expires_in=60)
+        longo = criar_token_jwt(sub='user', sign_key=sign_key, expires_in=61)
+        assert verifica_token_jwt(curto, sign_key, revogacao=revogacao)['valid']
+        assert verifica_token_jwt(longo, sign_key, revogacao=revogacao)['reason'] == 'revoked'
+
+    def test_expired_entries_purged(self, tmp_path):
+        caminho = str(tmp_path / 'revogacoes.db')
+        revogacao = ListaRevogacao(caminho, duracao_maxima=1)
+        revogacao.revogar('a', time() + 1)
+        revogacao.revogar('b', time() + 60)
+        revogacao.revogar('c', time() - 1)
+        revogacao.revogar_sub('user')
+        assert len(revogacao) == 3
+        sleep(1.1)
+        revogacao.sincronizar()
+        assert len(revogacao) == 1
+        assert revogacao.revogado({'jti': 'b'})
+        assert not revogacao.revogado({'jti': 'a', 'sub': 'user', 'iat': 0})
+        linhas = revogacao._conn.execute('SELECT valor FROM revogacoes').fetchall()
+        assert linhas == [('b',)]
+
+    def test_shared_between_processes(self, tmp_path, sign_key):
+        caminho = str(tmp_path / 'revogacoes.db')
+        primeira = ListaRevogacao(caminho, intervalo=0)
+        segunda = ListaRevogacao(caminho, intervalo=0)
+        token = criar_token_jwt(sub='user', sign_key=sign_key)
+        claims = verifica_token_jwt(token, sign_key)
+        primeira.revogar(claims['jti'], claims['exp'])
+        assert verifica_token_jwt(token, sign_key, revogacao=segunda)['reason'] == 'revoked'
+        assert ListaRevogacao(caminho).revogado({'jti': claims['jti']})
+
+    def test_cache_checks_revocation(self, sign_key):
+        revogacao = ListaRevogacao()
+        cache = CacheTokens()
+        token = criar_token_jwt(sub='user', sign_key=sign_key)
+        claims = cache.verificar(token, sign_key, revogacao=revogacao)
+        assert cache.verificar(token, sign_key, revogacao=revogacao)['valid']
+        revogacao.revogar(claims['jti'], claims['exp'])
+        assert cache.verificar(token, sign_key, revogacao=revogacao)['reason'] == 'revoked'
+        revogacao.revogar_sub('user')
+        novo = criar_token_jwt(sub='user', sign_key=sign_key, issued_at=int(time()) - 1)
+        assert cache.verificar(novo, sign_key, revogacao=revogacao)['reason'] == 'revoked'
+
+
+# Tests for verifica_tokens_lote
+class TestVerificaTokensLote:
+    @pytest.fixture
+    def chaveiro(self):
+        chaveiro = Chaveiro()
+        chaveiro.gerar(kid='hs')
+        chaveiro.gerar(kid='ed', algoritmo=EDDSA)
+        return chaveiro
+
+    @pytest.mark.parametrize('max_threads', [None, 4])
+    def test_same_results_as_single(self, chaveiro, max_threads):
+        validos = [criar_token_jwt(sub=f'user{i}', chaveiro=chaveiro) for i in range(5)]
+        chaveiro.ativar('hs')
+        validos += [criar_token_jwt(sub=f'user{i}', chaveiro=chaveiro) for i in range(5)]
+        tokens = [
+            *validos,
+            validos[0],
+            criar_token_jwt(sub='user', chaveiro=chaveiro, expires_in=-10),
+            criar_token_jwt(sub='user', chaveiro=chaveiro, issued_at=int(time()) + 3600),
+            criar_token_jwt(sub='user', sign_key=b'other_key_with_32_bytes_or_more!'),
+            'invalid.token.here',
+        ]
+        resultados = verifica_tokens_lote(tokens, chaveiro, max_threads=max_threads)
+        esperados = [verifica_token_jwt(t, chaveiro=chaveiro) for t in tokens]
+        # A idade pode mudar entre as duas verificações
+        for resultado in resultados + esperados:
+            resultado.pop('age', None)
+        assert resultados == esperados
+        assert [r.get('reason') for r in resultados[-5:]] == \
+               [None, 'expired', 'immature', 'invalid_signature', 'invalid']
+
+    def test_duplicates_are_independent(self, chaveiro):
+        token = criar_token_jwt(sub='user', chaveiro=chaveiro)
+        primeiro, segundo = verifica_tokens_lote([token, token], chaveiro)
+        assert primeiro == segundo and primeiro is not segundo
+
+    def test_unknown_key_and_non_string(self, chaveiro):
+        outro = Chaveiro()
+        outro.gerar(kid='x')
+        token = criar_token_jwt(sub='user', chaveiro=outro)
+        assert verifica_tokens_lote([token, None], chaveiro) == \
+               [{'valid': False, 'reason': 'unknown_key'}, {'valid': False, 'reason': 'invalid'}]
+
+    def test_revoked(self, chaveiro):
+        revogacao = ListaRevogacao()
+        tokens = [criar_token_jwt(sub='user', chaveiro=chaveiro) for _ in range(2)]
+        claims = verifica_token_jwt(tokens[0], chaveiro=chaveiro)
+        revogacao.revogar(claims['jti'], claims['exp'])
+        resultados = verifica_tokens_lote(tokens, chaveiro, revogacao=revogacao)
+        assert [r['valid'] for r in resultados] == [False, True]
+
+    def test_empty(self, chaveiro):
+        assert verifica_tokens_lote([], chaveiro) == []
+
+
+# Tests for CodecHS256 against PyJWT
+def _b64(dados) -> str:
+    if not isinstance(dados, bytes):
+        dados = json.dumps(dados, separators=(',', ':')).encode()
+    return base64url_encode(dados).decode()
+
+
+def _montar(cabecalho, payload, chave: bytes) -> str:
+    mensagem = f'{_b64(cabecalho)}.{_b64(payload)}'
+    assinatura = hmac.new(chave, mensagem.encode(), hashlib.sha256).digest()
+    return f'{mensagem}.{_b64(assinatura)}'
+
+
+def _resultado_pyjwt(token, chave):
+    try:
+        return jwt.decode(token, chave, algorithms=['HS256'])
+    except Exception as e:
+        return type(e)
+
+
+def _resultado_codec(token, chave):
+    try:
+        return CodecHS256(chave).decodificar(token)
+    except Exception as e:
+        return type(e)
+
+
+class TestCodecHS256:
+    CHAVE = b'fast_path_secret_key_of_32_bytes'
+
+    @pytest.fixture
+    def codec_rapido(self):
+        definir_codec_rapido(True)
+        yield
+        definir_codec_rapido(None)
+
+    @pytest.mark.parametrize('payload', [
+        {'sub': 'user', 'iat': 1, 'exp': 2 ** 40},
+        {'sub': 'usuário', 'extra_data': {'role': 'admin', 'nome': 'José'}},
+        {'z': 1, 'a': [1, 2.5, None, True], 'm': 'x"y\\z'},
+        {},
+    ])
+    @pytest.mark.parametrize('kid', [None, 'k1', 'chave ção'])
+    def test_encode_matches_pyjwt(self, payload, kid):
+        esperado = jwt.encode(payload, self.CHAVE, algorithm='HS256',
+                              headers={'kid': kid} if kid else None)
+        assert CodecHS256(self.CHAVE).codificar(payload, kid) == esperado
+
+    def test_encode_rejects_non_string_iss(self):
+        with pytest.raises(TypeError):
+            CodecHS256(self.CHAVE).codificar({'iss': 1})
+
+    @pytest.mark.parametrize('cabecalho, payload', [
+        # Tokens no formato esperado
+        ({'alg': 'HS256', 'typ': 'JWT'}, {'sub': 'u', 'exp': 2 ** 40}),
+        ({'alg': 'HS256', 'kid': 'k', 'typ': 'JWT'}, {'sub': 'u', 'iat': 1, 'nbf': 1}),
+        ({'alg': 'HS256', 'typ': 'JWT'}, {'exp': 1}),
+        ({'alg': 'HS256', 'typ': 'JWT'}, {'nbf': 2 ** 40}),
+        ({'alg': 'HS256', 'typ': 'JWT'}, {'iat': 2 ** 40}),
+        ({'alg': 'HS256', 'typ': 'JWT'}, {'iat': 2 ** 40, 'exp': 1}),
+        # Formatos repassados ao PyJWT
+        ({'typ': 'JWT', 'alg': 'HS256'}, {'sub': 'u'}),
+        ({'alg': 'HS256'}, {'sub': 'u'}),
+        ({'alg': 'HS256', 'typ': 'JWT', 'crit': ['x']}, {'sub': 'u'}),
+        ({'alg': 'HS256', 'typ': 'JWT', 'b64': False}, {'sub': 'u'}),
+        ({'alg': 'HS256', 'kid': 1, 'typ': 'JWT'}, {'sub': 'u'}),
+        ({'alg': 'none', 'typ': 'JWT'}, {'sub': 'u'}),
+        ({'alg': 'HS512', 'typ': 'JWT'}, {'sub': 'u'}),
+        ({'alg': 'HS256', 'typ': 'JWT'}, {'exp': 1.5}),
+        ({'alg': 'HS256', 'typ': 'JWT'}, {'exp': 2 ** 40 + 0.5}),
+        ({'alg': 'HS256', 'typ': 'JWT'}, {'exp': '2000000000'}),
+        ({'alg': 'HS256', 'typ': 'JWT'}, {'exp': 'x'}),
+        ({'alg': 'HS256', 'typ': 'JWT'}, {'exp': True}),
+        ({'alg': 'HS256', 'typ': 'JWT'}, {'nbf': None}),
+        ({'alg': 'HS256', 'typ': 'JWT'}, {'iat': 1.5}),
+        ({'alg': 'HS256', 'typ': 'JWT'}, {'iat': 2 ** 40 + 0.5}),
+        ({'alg': 'HS256', 'typ': 'JWT'}, {'iat': float('inf')}),
+        ({'alg': 'HS256', 'typ': 'JWT'}, {'iat': float('nan')}),
+        ({'alg': 'HS256', 'typ': 'JWT'}, {'iat': 'x'}),
+        ({'alg': 'HS256', 'typ': 'JWT'}, {'iat': [1]}),
+        ({'alg': 'HS256', 'typ': 'JWT'}, {'sub': 1}),
+        ({'alg': 'HS256', 'typ': 'JWT'}, {'jti': 1}),
+        ({'alg': 'HS256', 'typ': 'JWT'}, {'aud': 'x'}),
+        ({'alg': 'HS256', 'typ': 'JWT'}, {'iss': 1}),
+        ({'alg': 'HS256', 'typ': 'JWT'}, [1, 2]),
+        ({'alg': 'HS256', 'typ': 'JWT'}, b'not json'),
+        (b'not json', {'sub': 'u'}),
+        ([1], {'sub': 'u'}),
+    ])
+    def test_decode_matches_pyjwt(self, cabecalho, payload):
+        token = _montar(cabecalho, payload, self.CHAVE)
+        assert _resultado_codec(token, self.CHAVE) == _resultado_pyjwt(token, self.CHAVE)
+        outra = b'another_secret_key_with_32_bytes'
+        assert _resultado_codec(token, outra) == _resultado_pyjwt(token, outra)
+
+    @pytest.mark.parametrize('token', [
+        '', 'a', 'a.b', 'a.b.c.d', '...', None, 'é.é.é',
+        'eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.e30.',
+        'eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.!!!.abc',
+        'eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.e30.!!!',
+    ])
+    def test_malformed_tokens(self, token):
+        assert _resultado_codec(token, self.CHAVE) == _resultado_pyjwt(token, self.CHAVE)
+
+    def test_mutated_tokens(self):
+        rng = random.Random(2025)
+        codec = CodecHS256(self.CHAVE)
+        token = codec.codificar({'sub': 'user', 'iat': int(time()), 'exp': int(time()) + 60,
+                                 'jti': 'abc'}, 'k1')
+        alfabeto = 'ABCabc019-_.=+/ '
+        for _ in range(500):
+            posicao = rng.randrange(len(token))
+            mutado = token[:posicao] + rng.choice(alfabeto) + token[posicao + 1:]
+            assert _resultado_codec(mutado, self.CHAVE) == _resultado_pyjwt(mutado, self.CHAVE)
+
+    def test_forged_kids_not_cached(self):
+        codec = CodecHS256(self.CHAVE)
+        real = codec.codificar({'sub': 'user'}, 'real')
+        outra = b'another_secret_key_with_32_bytes'
+        for i in range(2000):
+            forjado = _montar({'alg': 'HS256', 'kid': f'k{i}', 'typ': 'JWT'}, {'sub': 'u'}, outra)
+            with pytest.raises(jwt.InvalidSignatureError):
+                codec.decodificar(forjado)
+        assert set(codec._cabecalhos) == {'real'}
+        assert codec.decodificar(real) == {'sub': 'user'}
+
+        # Um token assinado com a chave tem o cabeçalho reconhecido dali em diante
+        assinado = _montar({'alg': 'HS256', 'kid': 'outro', 'typ': 'JWT'}, {'sub': 'u'},
+                           self.CHAVE)
+        assert codec.decodificar(assinado) == {'sub': 'u'}
+        assert set(codec._cabecalhos) == {'real', 'outro'}
+
+    def test_pem_key_rejected(self):
+        pem = ChaveAssinatura.gerar(EDDSA).json()['publica'].encode()
+        with pytest.raises(jwt.InvalidKeyError):
+            CodecHS256(pem)
+
+    def test_flag_used_by_module_api(self, codec_rapido, sign_key):
+        assert codec_rapido_ativo()
+        token = criar_token_jwt(sub='user', sign_key=self.CHAVE, action='login')
+        assert jwt.decode(token, self.CHAVE, algorithms=['HS256'])['action'] == 'login'
+        claims = verifica_token_jwt(token, self.CHAVE)
+        assert claims['valid'] and claims['sub'] == 'user'
+        assert verifica_token_jwt(token, sign_key)['reason'] == 'invalid_signature'
+        expirado = criar_token_jwt(sub='user', sign_key=self.CHAVE, expires_in=-1)
+        assert verifica_token_jwt(expirado, self.CHAVE)['reason'] == 'expired'
+        futuro = criar_token_jwt(sub='user', sign_key=self.CHAVE, issued_at=int(time()) + 60)
+        assert verifica_token_jwt(futuro, self.CHAVE)['reason'] == 'immature'
+
+    def test_flag_with_key_ring(self, codec_rapido):
+        chaveiro = Chaveiro()
+        kid = chaveiro.gerar()
+        token = criar_token_jwt(sub='user', chaveiro=chaveiro)
+        assert jwt.get_unverified_header(token)['kid'] == kid
+        definir_codec_rapido(False)
+        assert verifica_token_jwt(token, chaveiro=chaveiro)['valid']
+
+
+class TestSessoesRefresh:
+    @pytest.fixture
+    def pool(self, tmp_path):
+        pool = PoolConexoes(str(tmp_path / 'sessoes.db'))
+        with pool.conexao() as conn:
+            criar_tabela(conn)
+        yield pool
+        pool.fechar()
+
+    def test_rotation(self, pool):
+        sessoes = SessoesRefresh(pool)
+        token = sessoes.iniciar('user', {'role': 'admin'})
+        assert sessoes.consultar(token) == {'sub': 'user', 'dados': {'role': 'admin'}}
+
+        sessao, motivo = sessoes.renovar(token)
+        assert motivo is None
+        assert sessao['sub'] == 'user' and sessao['dados'] == {'role': 'admin'}
+        assert sessoes.consultar(token) is None
+        assert sessoes.consultar(sessao['refresh_token']) is not None
+        assert len(sessoes.sessoes('user')) == 1
+
+    def test_only_hash_stored(self, pool):
+        token = SessoesRefresh(pool).iniciar('user')
+        with pool.conexao() as conn:
+            gravado = conn.execute('SELECT token_hash FROM refresh_tokens').fetchone()[0]
+        assert gravado == hashlib.sha256(token.encode()).hexdigest()
+
+    def test_reuse_ends_family(self, pool):
+        sessoes = SessoesRefresh(pool)
+        token = sessoes.iniciar('user')
+        outra = sessoes.iniciar('user')
+        sessao, _ = sessoes.renovar(token)
+        assert sessoes.renovar(token) == (None, 'reused')
+        assert sessoes.renovar(sessao['refresh_token']) == (None, 'invalid')
+        assert sessoes.consultar(outra) is not None
+
+    def test_sliding_expiration(self, pool):
+        sessoes = SessoesRefresh(pool, validade=1, validade_maxima=60)
+        token = sessoes.iniciar('user')
+        sleep(0.6)
+        sessao, _ = sessoes.renovar(token)
+        sleep(0.6)
+        # A renovação estendeu a validade da sessão
+        sessao, motivo = sessoes.renovar(sessao['refresh_token'])
+        assert motivo is None
+        sleep(1.1)
+        assert sessoes.renovar(sessao['refresh_token']) == (None, 'expired')
+
+    def test_maximum_duration(self, pool):
+        sessoes = SessoesRefresh(pool, validade=60, validade_maxima=1)
+        token = sessoes.iniciar('user')
+        sessao, _ = sessoes.renovar(token)
+        sleep(1.1)
+        assert sessoes.renovar(sessao['refresh_token']) == (None, 'expired')
+
+    def test_end_sessions(self, pool):
+        sessoes = SessoesRefresh(pool)
+        primeira = sessoes.iniciar('user')
+        segunda = sessoes.iniciar('user')
+        assert sessoes.encerrar(primeira)
+        assert not sessoes.encerrar(primeira)
+        assert sessoes.consultar(segunda) is not None
+        assert sessoes.encerrar_sub('user') == 1
+        assert sessoes.sessoes('user') == []
+
+    def test_compact(self, pool):
+        sessoes = SessoesRefresh(pool, validade=0.5)
+        token = sessoes.iniciar('user')
+        sessoes.renovar(token)
+        ativa = SessoesRefresh(pool).iniciar('user')
+        sleep(0.6)
+        assert sessoes.compactar() == 2
+        assert sessoes.consultar(ativa) is not None
+
+
+class TestLimitadorTaxa:
+    def test_burst_then_refused(self):
+        limitador = LimitadorTaxa(capacidade=3, taxa=1)
+        assert [limitador.consumir('a')[0] for _ in range(4)] == [True, True, True, False]
+        permitido, espera = limitador.consumir('a')
+        assert not permitido and 0 < espera <= 1
+        # Cada chave tem o seu balde
+        assert limitador.consumir('b') == (True, 0.0)
+
+    def test_refill(self):
+        limitador = LimitadorTaxa(capacidade=1, taxa=10)
+        assert limitador.consumir('a')[0]
+        assert not limitador.consumir('a')[0]
+        sleep(0.15)
+        assert limitador.consumir('a')[0]
+
+    def test_reset(self):
+        limitador = LimitadorTaxa(capacidade=1, taxa=0.001)
+        limitador.consumir('a')
+        assert not limitador.consumir('a')[0]
+        limitador.limpar('a')
+        assert limitador.consumir('a')[0]
+
+    def test_max_keys(self):
+        limitador = LimitadorTaxa(capacidade=1, taxa=0.001, max_chaves=2)
+        for chave in 'abc':
+            limitador.consumir(chave)
+        assert len(limitador) == 2
+        # O balde usado há mais tempo foi descartado e volta cheio
+        assert limitador.consumir('a')[0]
+        assert not limitador.consumir('c')[0]
@@ -1,10 +1,22 @@
+import asyncio
+import hashlib
+import hmac
+import json
 import sqlite3
+import threading
 import time
 
 import pyotp
 import pytest
+from werkzeug.security import generate_password_hash
 
-from src.otp import criar_banco, criar_usuario, gerar_codigos_reserva, login
+import src.otp
+from src.otp import (ConfiguracaoHash, FilaCheiaError, ServicoHash, calibrar_hash,
+                     configuracao_hash, criar_banco, criar_usuario, criar_usuario_async,
+                     definir_chave_codigos, definir_configuracao_hash, gerar_codigos_reserva,
+                     importar_usuarios, ler_csv, ler_jsonl, login, login_async, migrar_banco)
+from src.otp.codigos import chave_codigos, lookup_codigo
+from src.senhas import FiltroSenhasVazadas, construir_filtro_senhas
 
 
 @pytest.fixture
@@ -58,6 +70,18 @@ def test_criar_usuario_existing_email(db_connection):
     assert usuario is None
 
 
+def test_criar_usuario_senha_vazada(db_connection, tmp_path):
+    """Test user creation with a leaked password"""
+    origem = tmp_path / "vazadas.txt"
+    origem.write_text("password123\nPassword1!\n")
+    construir_filtro_senhas(origem, tmp_path / "vazadas.bloom")
+    with FiltroSenhasVazadas(tmp_path / "vazadas.bloom") as vazadas:
+        assert criar_usuario(db_connection, "test@example.com", "password123",
+                             vazadas=vazadas) is None
+        assert criar_usuario(db_connection, "test@example.com", "S3nh@Inedita",
+                             vazadas=vazadas) is not None
+
+
 def test_login_no_user(db_connection):
     """Test login for non existing user"""
     criar_usuario(db_connection, "test@example.com", "password123")
@@ -120,6 +144,142 @@ class TestOTPFunctionality:
                              sample_user["password"], code)
 
 
+@pytest.mark.otp
+class TestBackupCodeLookup:
+    @pytest.fixture
+    def contador_hashes(self, monkeypatch):
+        chamadas = []
+        original = src.otp.check_password_hash
+
+        def check_password_hash(pwhash, password):
+            chamadas.append(pwhash)
+            return original(pwhash, password)
+
+        monkeypatch.setattr(src.otp, "check_password_hash", check_password_hash)
+        return chamadas
+
+    def test_codigo_errado_um_hash(self, sample_user, db_connection, contador_hashes):
+        """A wrong backup code costs only the password hash"""
+        gerar_codigos_reserva(db_connection, sample_user["email"], sample_user["password"], 20)
+        contador_hashes.clear()
+        assert not login(db_connection, sample_user["email"], sample_user["password"], "ZZZZZZ")
+        assert len(contador_hashes) == 1
+
+    def test_codigo_certo_dois_hashes(self, sample_user, db_connection, contador_hashes):
+        """A valid backup code costs the password hash plus one code hash"""
+        assert login(db_connection, sample_user["email"], sample_user["password"],
+                     sample_user["backup_codes"][-1])
+        assert len(contador_hashes) == 2
+
+    def test_codigos_regenerados(self, sample_user, db_connection):
+        novos = gerar_codigos_reserva(db_connection, sample_user["email"],
+                                      sample_user["password"], 3)
+        for code in novos + sample_user["backup_codes"]:
+            assert login(db_connection, sample_user["email"], sample_user["password"], code)
+
+    def test_migracao_codigos_legados(self, db_connection):
+        """Codes stored before the lookup column existed are invalidated by the migration"""
+        otp_secret, _, backup_codes = criar_usuario(db_connection, "test@example.com",
+                                                    "password123", use_otp=True)
+        # Rebuild the table with the old schema, keeping the existing rows without lookup
+        db_connection.executescript("""
+            CREATE TABLE backupkeys_old AS SELECT id, user_id, backup_code, used FROM backupkeys;
+            DROP TABLE backupkeys;
+            ALTER TABLE backupkeys_old RENAME TO backupkeys;
+        """)
+
+        assert migrar_banco(db_connection) == ["test@example.com"]
+        assert migrar_banco(db_connection) == []  # Idempotent
+
+        assert not login(db_connection, "test@example.com", "password123", backup_codes[0])
+        novos = gerar_codigos_reserva(db_connection, "test@example.com", "password123", 1)
+        assert login(db_connection, "test@example.com", "password123", novos[0])
+
+    def test_lookup_com_chave_do_servidor(self, sample_user, db_connection):
+        """The lookup depends on a key outside the database, not on the user's OTP secret"""
+        user_id, otp_secret = db_connection.execute(
+            "SELECT id, otp_secret FROM usuarios WHERE email = ?",
+            (sample_user["email"],)).fetchone()
+        code = sample_user["backup_codes"][0]
+        assert lookup_codigo(user_id, code) != \
+               hmac.new(otp_secret.encode(), code.encode(), hashlib.sha256).hexdigest()
+
+        chave = chave_codigos()
+        definir_chave_codigos(b"outra chave")
+        try:
+            assert not login(db_connection, sample_user["email"], sample_user["password"], code)
+        finally:
+            definir_chave_codigos(chave)
+        assert login(db_connection, sample_user["email"], sample_user["password"], code)
+
+
+class TestImportarUsuarios:
+    @pytest.fixture(autouse=True)
+    def hash_rapido(self):
+        definir_configuracao_hash(ConfiguracaoHash('pbkdf2', iteracoes=1000))
+        yield
+        definir_configuracao_hash(None)
+
+    def test_importar_csv(self, db_connection, tmp_path):
+        criar_usuario(db_connection, "existente@example.com", "password123")
+        legado = ConfiguracaoHash('pbkdf2', iteracoes=1000).gerar("legado123")
+        arquivo = tmp_path / "usuarios.csv"
+        arquivo.write_text("email,senha,senha_hash\n"
+                           "Um@example.com,senha1,\n"
+                           "dois@example.com,,%s\n"
+                           "existente@example.com,password123,\n"
+                           "um@example.com,outra,\n"
+                           ",semEmail,\n"
+                           "tres@example.com,,hash-invalido\n"
+                           "quatro@example.com,senha4,\n" % legado)
+
+        resultado = importar_usuarios(db_connection, ler_csv(arquivo), tamanho_lote=3,
+                                      max_processos=2)
+        assert resultado == {'importados': 3,
+                             'duplicados': ['existente@example.com', 'um@example.com'],
+                             'invalidos' : [4, 5]}
+
+        assert login(db_connection, "um@example.com", "senha1")
+        assert login(db_connection, "dois@example.com", "legado123")
+        assert login(db_connection, "quatro@example.com", "senha4")
+        cursor = db_connection.execute("SELECT senha_hash FROM usuarios WHERE email = ?",
+                                       ("dois@example.com",))
+        assert cursor.fetchone()[0] == legado
+
+    def test_importar_jsonl(self, db_connection, tmp_path):
+        arquivo = tmp_path / "usuarios.jsonl"
+        arquivo.write_text("\n".join(json.dumps({'email': f"u{i}@example.com",
+                                                 'senha': f"senha{i}",
+                                                 'otp_secret': "JBSWY3DPEHPK3PXP" if i else ""})
+                                     for i in range(50)) + "\n\n")
+        resultado = importar_usuarios(db_connection, ler_jsonl(arquivo), tamanho_lote=16)
+        assert resultado == {'importados': 50, 'duplicados': [], 'invalidos': []}
+        assert login(db_connection, "u0@example.com", "senha0")
+        totp = pyotp.TOTP("JBSWY3DPEHPK3PXP")
+        assert login(db_connection, "u7@example.com", "senha7", totp.now())
+
+    def test_importar_lotes_cheios(self, db_connection):
+        # Cada lote ocupa a fila inteira do serviço; o lote seguinte não pode encontrar vagas
+        # ainda presas pelo anterior
+        registros = ({'email': f"u{i}@example.com", 'senha': f"senha{i}"} for i in range(200))
+        resultado = importar_usuarios(db_connection, registros, tamanho_lote=8, max_processos=2)
+        assert resultado == {'importados': 200, 'duplicados': [], 'invalidos': []}
+        assert login(db_connection, "u199@example.com", "senha199")
+
+    def test_importar_tipos_invalidos(self, db_connection, tmp_path):
+        arquivo = tmp_path / "usuarios.jsonl"
+        arquivo.write_text("\n".join(json.dumps(registro) for registro in [
+            {'email': "um@example.com", 'senha': 12345678},
+            {'email': ["dois@example.com"], 'senha': "senha2"},
+            {'email': "tres@example.com", 'senha_hash': {'hash': "x"}},
+            {'email': "quatro@example.com", 'senha': "senha4", 'otp_secret': 7},
+            "cinco@example.com",
+            {'email': "seis@example.com", 'senha': "senha6"}]) + "\n")
+        resultado = importar_usuarios(db_connection, ler_jsonl(arquivo), max_processos=1)
+        assert resultado == {'importados': 1, 'duplicados': [], 'invalidos': [0, 1, 2, 3, 4]}
+        assert login(db_connection, "seis@example.com", "senha6")
+
+
 # Test database constraints
 @pytest.mark.database
 class TestDatabaseConstraints:
@@ -169,3 +329,133 @@ class TestSecurity:
         assert passwd_hash != password
         # Verify hash starts with expected algorithm identifier
         assert passwd_hash.startswith("scrypt:32768") or passwd_hash.startswith("pbkdf2:sha256")
+
+
+@pytest.mark.security
+class TestConfiguracaoHash:
+    @pytest.fixture(autouse=True)
+    def restaura_configuracao(self):
+        yield
+        definir_configuracao_hash(None)
+
+    @staticmethod
+    def _hash_armazenado(conn, email):
+        cursor = conn.cursor()
+        cursor.execute("SELECT senha_hash FROM usuarios WHERE email = ?", (email,))
+        return cursor.fetchone()[0]
+
+    @pytest.mark.parametrize("texto", ["scrypt:16384:8:1", "pbkdf2:sha256:1000"])
+    def test_texto(self, texto):
+        assert ConfiguracaoHash.de_texto(texto).texto == texto
+
+    def test_padrao(self):
+        assert configuracao_hash() == ConfiguracaoHash.de_texto("scrypt:32768:8:1")
+
+    def test_padrao_pbkdf2_do_werkzeug(self):
+        configuracao = ConfiguracaoHash.de_texto("pbkdf2")
+        assert configuracao == ConfiguracaoHash('pbkdf2')
+        assert not configuracao.desatualizado(generate_password_hash("senha", "pbkdf2"))
+
+    @pytest.mark.error
+    @pytest.mark.parametrize("texto", ["md5", "scrypt:1000:8:1"])
+    def test_texto_invalido(self, texto):
+        with pytest.raises(ValueError):
+            ConfiguracaoHash.de_texto(texto)
+
+    def test_criar_usuario_usa_configuracao(self, db_connection):
+        definir_configuracao_hash(ConfiguracaoHash('pbkdf2', iteracoes=1000))
+        criar_usuario(db_connection, "test@example.com", "password123")
+        assert self._hash_armazenado(db_connection,
+                                     "test@example.com").startswith("pbkdf2:sha256:1000$")
+
+    def test_rehash_no_login(self, db_connection):
+        definir_configuracao_hash(ConfiguracaoHash('pbkdf2', iteracoes=1000))
+        criar_usuario(db_connection, "test@example.com", "password123")
+
+        definir_configuracao_hash(ConfiguracaoHash('pbkdf2', iteracoes=2000))
+        assert not login(db_connection, "test@example.com", "password")
+        assert self._hash_armazenado(db_connection,
+                                     "test@example.com").startswith("pbkdf2:sha256:1000$")
+
+        assert login(db_connection, "test@example.com", "password123")
+        assert self._hash_armazenado(db_connection,
+                                     "test@example.com").startswith("pbkdf2:sha256:2000$")
+        assert login(db_connection, "test@example.com", "password123")
+
+    def test_calibrar(self):
+        configuracao = calibrar_hash(alvo_ms=1, metodo='pbkdf2')
+        assert configuracao.metodo == 'pbkdf2'
+        assert configuracao.iteracoes >= 1000
+
+        configuracao = calibrar_hash(alvo_ms=1, max_memoria=4 * 1024 * 1024)
+        assert configuracao.metodo == 'scrypt'
+        assert 128 * configuracao.n * configuracao.r <= 4 * 1024 * 1024
+
+
+class TestServicoHash:
+    @pytest.fixture(scope="class")
+    def servico(self):
+        with ServicoHash(max_processos=2) as servico:
+            yield servico
+
+    def test_futuros(self, servico):
+        senha_hash = servico.gerar("password123", "pbkdf2:sha256:1000").result()
+        assert senha_hash.startswith("pbkdf2:sha256:1000$")
+        assert servico.verificar(senha_hash, "password123").result() is True
+        assert servico.verificar(senha_hash, "password").result() is False
+
+    def test_criar_usuario_e_login_async(self, db_connection, servico):
+        async def fluxo():
+            otp_secret, _, backup_codes = await criar_usuario_async(
+                db_connection, "test@example.com", "password123", use_otp=True, servico=servico)
+            assert await criar_usuario_async(db_connection, "test@example.com", "password123",
+                                             servico=servico) is None
+            totp = pyotp.TOTP(otp_secret)
+            resultados = await asyncio.gather(
+                login_async(db_connection, "test@example.com", "password123", totp.now(),
+                            servico=servico),
+                login_async(db_connection, "test@example.com", "password", totp.now(),
+                            servico=servico),
+                login_async(db_connection, "test2@example.com", "password123",
+                            servico=servico))
+            assert resultados == [True, False, False]
+            assert await login_async(db_connection, "test@example.com", "password123",
+                                     backup_codes[0], servico=servico)
+            assert not await login_async(db_connection, "test@example.com", "password123",
+                                         backup_codes[0], servico=servico)
+
+        asyncio.run(fluxo())
+
+    def test_login_servico(self, db_connection, servico):
+        otp_secret, _, backup_codes = criar_usuario(db_connection, "test@example.com",
+                                                    "password123", use_otp=True)
+        totp = pyotp.TOTP(otp_secret)
+        assert login(db_connection, "test@example.com", "password123", totp.now(),
+                     servico=servico)
+        assert not login(db_connection, "test@example.com", "password", totp.now(),
+                         servico=servico)
+        assert login(db_connection, "test@example.com", "password123", backup_codes[0],
+                     servico=servico)
+        assert not login(db_connection, "test@example.com", "password123", backup_codes[0],
+                         servico=servico)
+
+    def test_fila_cheia(self):
+        with ServicoHash(max_processos=1, max_fila=1) as servico:
+            futuro = servico.gerar("password123", "scrypt:32768:8:1")
+            with pytest.raises(FilaCheiaError):
+                servico.gerar("password123", "scrypt:32768:8:1")
+            senha_hash = futuro.result()
+            # A vaga é liberada antes de o resultado ser entregue
+            for _ in range(50):
+                assert servico.verificar(senha_hash, "password123").result()
+
+    def test_vaga_liberada_antes_do_resultado(self):
+        class VagasLentas(threading.BoundedSemaphore):
+            def release(self, n=1):
+                time.sleep(0.05)
+                super().release(n)
+
+        with ServicoHash(max_processos=1, max_fila=1) as servico:
+            servico._vagas = VagasLentas(1)
+            for _ in range(3):
+                assert servico.gerar("password123", "pbkdf2:sha256:1000").result()
@@ -1,17 +1,105 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import pyotp
 import pytest
+from starlette.testclient import TestClient
 
-from src.jwtokens import criar_token_jwt
-from src.jwtokens.rest_server import app, init_db, SECRET_KEY
+from src.jwtokens import Chaveiro, criar_token_jwt, verifica_token_jwt
+from src.jwtokens.banco import PoolConexoes
+from src.jwtokens.cache import BackendMemoria, CacheRespostas
+from src.jwtokens.chaves import ES256
+from src.jwtokens.rest_server import (ACCESS_TOKEN_EXPIRES_IN, app, compact_changes, get_pool,
+                                      get_revocation_list, init_db, key_ring,
+                                      login_account_key, login_account_limiter,
+                                      login_ip_limiter, SECRET_KEY,
+                                      start_session, token_cache, user_cache)
+from src.jwtokens.rest_server_async import app as async_app, db as async_db
+from src.otp import criar_banco, criar_usuario
 
 
-@pytest.fixture
-def client():
+class AsgiResponse:
+    """Resposta do `TestClient` do Starlette com a interface da resposta do Flask"""
+
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.data = response.content
+
+    @property
+    def mimetype(self):
+        return self.headers.get('Content-Type', '').split(';')[0].strip()
+
+    @property
+    def json(self):
+        return json.loads(self.data) if self.mimetype == 'application/json' else None
+
+    def get_data(self, as_text=False):
+        return self.data.decode('utf-8') if as_text else self.data
+
+
+class AsgiClient:
+    """
+    `TestClient` do Starlette com a interface do `app.test_client()` do Flask, para que os
+    mesmos testes sirvam às duas versões do servidor
+    """
+
+    def __init__(self, asgi_app):
+        self.app = asgi_app
+        self.client = TestClient(asgi_app, client=('127.0.0.1', 50000))
+        self.remote_clients = {}
+
+    def __enter__(self):
+        self.client.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        self.client.__exit__(*args)
+
+    def _client_for(self, environ_base):
+        remote_addr = (environ_base or {}).get('REMOTE_ADDR')
+        if remote_addr is None:
+            return self.client
+        if remote_addr not in self.remote_clients:
+            self.remote_clients[remote_addr] = TestClient(self.app, client=(remote_addr, 50000))
+        return self.remote_clients[remote_addr]
+
+    def open(self, path, method='GET', headers=None, json=None, data=None, query_string=None,
+             environ_base=None):
+        client = self._client_for(environ_base)
+        return AsgiResponse(client.request(method, path, headers=headers, json=json,
+                                           content=data, params=query_string))
+
+    def get(self, path, **kwargs):
+        return self.open(path, method='GET', **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.open(path, method='POST', **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.open(path, method='PUT', **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.open(path, method='DELETE', **kwargs)
+
+
+@pytest.fixture(params=['flask', 'asgi'])
+def client(request):
+    """Os mesmos testes rodam no servidor Flask e na versão ASGI"""
     app.config['TESTING'] = True
     app.config['DATABASE'] = 'temp.db'
-    with app.test_client() as client:
-        with app.app_context():
-            init_db()
-        yield client
+    with app.app_context():
+        init_db()
+    if request.param == 'asgi':
+        with AsgiClient(async_app) as client:
+            yield client
+    else:
+        with app.test_client() as client:
+            yield client
 
 
 def create_jwt_token(action, role, expires_in: int = 30):
@@ -25,6 +113,59 @@ def test_list_users(client):
     assert response.json == []
 
 
+def _populate(count):
+    with get_pool().conexao() as conn:
+        conn.executemany('INSERT INTO users (email, name, telephone) VALUES (?, ?, ?)',
+                         [(f'user{i:04}@example.com', f'User {i}', f'555-{i:04}')
+                          for i in range(count)])
+        conn.commit()
+
+
+def test_list_users_paginated(client):
+    _populate(25)
+    emails = []
+    after = None
+    pages = 0
+    while True:
+        query = {'limit': 10} if after is None else {'limit': 10, 'after': after}
+        response = client.get('/users', query_string=query)
+        assert response.status_code == 200
+        emails += [user['email'] for user in response.json]
+        pages += 1
+        after = response.headers.get('X-Next-After')
+        if after is None:
+            break
+        assert 'rel="next"' in response.headers['Link']
+    assert pages == 3
+    assert emails == [f'user{i:04}@example.com' for i in range(25)]
+
+
+@pytest.mark.parametrize("limit", ['0', '-1', 'abc', '100000'])
+def test_list_users_invalid_limit(client, limit):
+    response = client.get('/users', query_string={'limit': limit})
+    assert response.status_code == 400
+
+
+def test_list_users_stream_ndjson(client):
+    _populate(1200)
+    response = client.get('/users', query_string={'stream': 'ndjson', 'after': 'user0009'})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    users = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert len(users) == 1191
+    assert users[0] == {'email': 'user0009@example.com', 'name': 'User 9',
+                        'telephone': '555-0009'}
+
+
+@pytest.mark.parametrize("count", [0, 1, 1200])
+def test_list_users_stream_json(client, count):
+    _populate(count)
+    response = client.get('/users', query_string={'stream': 'json'})
+    assert response.status_code == 200
+    assert [user['email'] for user in json.loads(response.get_data(as_text=True))] == \
+        [f'user{i:04}@example.com' for i in range(count)]
+
+
 def test_get_non_existing_user(client):
     response = client.get('/user/example@example.com')
     assert response.status_code == 404
@@ -207,3 +348,728 @@ def test_delete_user_no_auth(client):
     headers = {'Authorization': token}
     response = client.delete('/user/example@example.com', headers=headers)
     assert response.status_code == 403
+
+
+def test_token_cache_reused(client):
+    token = create_jwt_token("delete", 'admin')
+    headers = {'Authorization': token}
+    token_cache.limpar()
+    for _ in range(3):
+        assert client.delete('/user/example@example.com', headers=headers).status_code == 200
+    assert (token_cache.acertos, token_cache.falhas) == (2, 1)
+
+    token_cache.invalidar(token)
+    client.delete('/user/example@example.com', headers=headers)
+    assert token_cache.falhas == 2
+
+
+def test_token_signed_with_key_ring(client):
+    token = criar_token_jwt(sub='user@domain.tld', chaveiro=key_ring, action='delete',
+                            extra_data={'role': 'admin'})
+    response = client.delete('/user/example@example.com', headers={'Authorization': token})
+    assert response.status_code == 200
+
+
+def test_database_from_config(client):
+    assert get_pool().caminho == 'temp.db'
+    with get_pool().conexao() as conn:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+        assert conn.execute('PRAGMA busy_timeout').fetchone()[0] == 5000
+
+
+def test_connection_reused(client):
+    client.get('/users')
+    with get_pool().conexao() as first:
+        pass
+    client.get('/users')
+    with get_pool().conexao() as second:
+        assert second is first
+
+
+def test_pool_rolls_back_open_transaction(tmp_path):
+    pool = PoolConexoes(str(tmp_path / 'pool.db'), tamanho=1)
+    with pool.conexao() as conn:
+        conn.execute('CREATE TABLE t (x INTEGER)')
+        conn.commit()
+        conn.execute('INSERT INTO t VALUES (1)')
+    with pool.conexao() as conn:
+        assert not conn.in_transaction
+        assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+    pool.fechar()
+
+
+@pytest.fixture
+def own_database(client, tmp_path, monkeypatch):
+    """Banco só do teste, para dados que `init_db()` não descarta, como as revogações"""
+    monkeypatch.setitem(app.config, 'DATABASE', str(tmp_path / 'users.db'))
+    with app.app_context():
+        init_db()
+
+
+def test_revoked_token(client, own_database):
+    token = create_jwt_token("delete", 'admin')
+    headers = {'Authorization': token}
+    assert client.delete('/user/example@example.com', headers=headers).status_code == 200
+
+    claims = verifica_token_jwt(token, SECRET_KEY)
+    get_revocation_list().revogar(claims['jti'], claims['exp'])
+    response = client.delete('/user/example@example.com', headers=headers)
+    assert response.status_code == 403
+    assert response.json == {'valid': False, 'reason': 'revoked'}
+
+
+def test_revoked_sub(client, own_database):
+    sub = 'revoked@domain.tld'
+    token = criar_token_jwt(sub=sub, sign_key=SECRET_KEY, action='delete',
+                            extra_data={'role': 'admin'})
+    headers = {'Authorization': token}
+    assert client.delete('/user/example@example.com', headers=headers).status_code == 200
+
+    get_revocation_list().revogar_sub(sub)
+    assert client.delete('/user/example@example.com', headers=headers).status_code == 403
+
+
+def test_refresh_token_rotation(client):
+    refresh = start_session('user@domain.tld', 'admin', ['create', 'update'])
+    response = client.post('/token/refresh', json={'refresh_token': refresh, 'action': 'create'})
+    assert response.status_code == 200
+    assert response.json['expires_in'] == ACCESS_TOKEN_EXPIRES_IN
+    assert response.json['refresh_token'] != refresh
+
+    response = client.post('/new', headers={'Authorization': response.json['access_token']},
+                           json={'name': 'New User', 'email': 'new@example.com',
+                                 'telephone': '1234567890'})
+    assert response.status_code == 200
+
+
+def test_refresh_token_reused(client):
+    refresh = start_session('user@domain.tld', 'admin', ['create'])
+    response = client.post('/token/refresh', json={'refresh_token': refresh, 'action': 'create'})
+    rotated = response.json['refresh_token']
+
+    response = client.post('/token/refresh', json={'refresh_token': refresh, 'action': 'create'})
+    assert response.status_code == 401
+    assert response.json['reason'] == 'reused'
+    # A reutilização encerra a sessão inteira, inclusive o token legítimo mais recente
+    response = client.post('/token/refresh', json={'refresh_token': rotated, 'action': 'create'})
+    assert response.status_code == 401
+    assert response.json['reason'] == 'invalid'
+
+
+def test_refresh_token_action_not_allowed(client):
+    refresh = start_session('user@domain.tld', 'user', ['update'])
+    response = client.post('/token/refresh', json={'refresh_token': refresh, 'action': 'delete'})
+    assert response.status_code == 403
+    # O token não é consumido por uma requisição recusada
+    response = client.post('/token/refresh', json={'refresh_token': refresh, 'action': 'update'})
+    assert response.status_code == 200
+
+
+def test_refresh_token_missing_data(client):
+    assert client.post('/token/refresh', json={'action': 'create'}).status_code == 400
+    response = client.post('/token/refresh', json={'refresh_token': 'x', 'action': 'create'})
+    assert response.status_code == 401
+
+
+def test_revoke_refresh_token(client):
+    refresh = start_session('user@domain.tld', 'admin', ['create'])
+    response = client.post('/token/revoke', json={'refresh_token': refresh})
+    assert response.status_code == 200
+    assert client.post('/token/revoke', json={'refresh_token': refresh}).status_code == 401
+    response = client.post('/token/refresh', json={'refresh_token': refresh, 'action': 'create'})
+    assert response.status_code == 401
+
+
+@pytest.fixture
+def operator(client, tmp_path, monkeypatch):
+    auth_database = str(tmp_path / 'auth.db')
+    monkeypatch.setitem(app.config, 'AUTH_DATABASE', auth_database)
+    conn = criar_banco(auth_database)
+    otp_secret, _, backup_codes = criar_usuario(conn, 'operator@domain.tld', 'password123',
+                                                use_otp=True)
+    conn.close()
+
+    def reset_limiters():
+        for remote_addr in ('127.0.0.1', '10.0.0.1'):
+            login_ip_limiter.limpar(remote_addr)
+            login_account_limiter.limpar(login_account_key(remote_addr, 'operator@domain.tld'))
+
+    reset_limiters()
+    yield {'email': 'operator@domain.tld', 'password': 'password123',
+           'totp': pyotp.TOTP(otp_secret), 'backup_codes': backup_codes}
+    reset_limiters()
+
+
+def test_login(client, operator):
+    response = client.post('/login', json={'email'   : 'Operator@domain.tld',
+                                           'password': operator['password'],
+                                           'otp'     : operator['totp'].now(),
+                                           'actions' : ['create']})
+    assert response.status_code == 200
+    assert set(response.json['tokens']) == {'create'}
+    claims = verifica_token_jwt(response.json['tokens']['create'], chaveiro=key_ring)
+    assert claims['sub'] == 'operator@domain.tld'
+    assert claims['action'] == 'create'
+
+    response = client.post('/new', headers={'Authorization': response.json['tokens']['create']},
+                           json={'name': 'New User', 'email': 'new@example.com',
+                                 'telephone': '1234567890'})
+    assert response.status_code == 200
+
+
+def test_login_backup_code(client, operator):
+    data = {'email': operator['email'], 'password': operator['password'],
+            'otp': operator['backup_codes'][0]}
+    response = client.post('/login', json=data)
+    assert response.status_code == 200
+    assert set(response.json['tokens']) == {'create', 'update', 'delete'}
+    response = client.post('/token/refresh', json={'refresh_token': response.json['refresh_token'],
+                                                   'action': 'delete'})
+    assert response.status_code == 200
+    # Cada código de backup só pode ser usado uma vez
+    assert client.post('/login', json=data).status_code == 401
+
+
+@pytest.mark.parametrize('data', [
+    {'password': 'password123'},
+    {'email': 'operator@domain.tld', 'password': 'password123', 'actions': ['drop']},
+    {'email': 'operator@domain.tld', 'password': 'password123', 'actions': []},
+])
+def test_login_invalid_request(client, operator, data):
+    assert client.post('/login', json=data).status_code == 400
+
+
+def test_login_wrong_credentials(client, operator):
+    response = client.post('/login', json={'email': operator['email'], 'password': 'wrong',
+                                           'otp': operator['totp'].now()})
+    assert response.status_code == 401
+    response = client.post('/login', json={'email'   : operator['email'],
+                                           'password': operator['password']})
+    assert response.status_code == 401
+
+
+def test_login_account_rate_limited(client, operator):
+    data = {'email': operator['email'], 'password': 'wrong'}
+    for _ in range(login_account_limiter.capacidade):
+        assert client.post('/login', json=data).status_code == 401
+    # Com o balde vazio, nem a senha correta é verificada
+    data = {'email': operator['email'], 'password': operator['password'],
+            'otp': operator['totp'].now()}
+    response = client.post('/login', json=data)
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+
+
+def test_login_account_not_locked_from_other_address(client, operator):
+    attacker = {'REMOTE_ADDR': '10.0.0.1'}
+    data = {'email': operator['email'], 'password': 'wrong'}
+    for _ in range(login_account_limiter.capacidade):
+        assert client.post('/login', json=data, environ_base=attacker).status_code == 401
+    assert client.post('/login', json=data, environ_base=attacker).status_code == 429
+    # As tentativas de outro endereço não consomem as do dono da conta
+    response = client.post('/login', json={'email'   : operator['email'],
+                                           'password': operator['password'],
+                                           'otp'     : operator['totp'].now()})
+    assert response.status_code == 200
+
+
+def test_login_ip_rate_limited(client, operator):
+    for i in range(login_ip_limiter.capacidade):
+        response = client.post('/login', json={'email': f'unknown{i}@domain.tld',
+                                               'password': 'wrong'})
+        assert response.status_code == 401
+    response = client.post('/login', json={'email'   : operator['email'],
+                                           'password': operator['password'],
+                                           'otp'     : operator['totp'].now()})
+    assert response.status_code == 429
+
+
+def _public_ring():
+    ring = Chaveiro()
+    ring.gerar(algoritmo=ES256)
+    return ring.publico()
+
+
+@pytest.mark.parametrize('ring', [Chaveiro(), _public_ring()])
+def test_login_without_active_key(client, operator, monkeypatch, ring):
+    monkeypatch.setattr('src.jwtokens.rest_server.key_ring', ring)
+    response = client.post('/login', json={'email'   : operator['email'],
+                                           'password': operator['password'],
+                                           'otp'     : operator['totp'].now()})
+    assert response.status_code == 503
+    refresh = start_session('user@domain.tld', 'admin', ['create'])
+    response = client.post('/token/refresh', json={'refresh_token': refresh, 'action': 'create'})
+    assert response.status_code == 503
+
+    # O refresh token não é consumido enquanto não há chave para assinar
+    monkeypatch.undo()
+    response = client.post('/token/refresh', json={'refresh_token': refresh, 'action': 'create'})
+    assert response.status_code == 200
+
+
+def test_start_without_active_key(tmp_path):
+    ring_file = tmp_path / 'chaves.json'
+    _public_ring().salvar(ring_file)
+    env = {**os.environ, 'JWT_CHAVES_ARQUIVO': str(ring_file)}
+    result = subprocess.run([sys.executable, '-c', 'import src.jwtokens.rest_server'],
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert 'sem chave ativa para assinar' in result.stderr
+
+
+def test_asgi_errors():
+    with AsgiClient(async_app) as client:
+        response = client.get('/missing')
+        assert response.status_code == 404
+        assert response.json == {'error': 'Not Found'}
+        response = client.post('/users')
+        assert response.status_code == 405
+        assert 'GET' in response.headers['Allow']
+        headers = {'Authorization': create_jwt_token('create', 'admin')}
+        response = client.post('/new', data='not json', headers=headers)
+        assert response.status_code == 415
+        response = client.post('/new', data='{broken',
+                               headers={**headers, 'Content-Type': 'application/json'})
+        assert response.status_code == 400
+
+
+@pytest.mark.parametrize("content_type", ['application/json', 'application/x-ndjson'])
+def test_request_too_large(client, content_type):
+    max_size, app.config['MAX_CONTENT_LENGTH'] = app.config['MAX_CONTENT_LENGTH'], 64
+    try:
+        headers = {'Authorization': create_jwt_token('create', 'admin'),
+                   'Content-Type' : content_type}
+        user = {'email': 'a@example.com', 'name': 'A' * 100, 'telephone': '1'}
+        body = json.dumps([user] if content_type == 'application/json' else user)
+        assert client.post('/users/bulk', headers=headers, data=body).status_code == 413
+        if isinstance(client, AsgiClient):
+            # Corpo enviado em partes, sem Content-Length
+            response = client.post('/users/bulk', headers=headers,
+                                   data=iter([body[:50].encode(), body[50:].encode()]))
+            assert response.status_code == 413
+    finally:
+        app.config['MAX_CONTENT_LENGTH'] = max_size
+    assert client.get('/users').json == []
+
+
+def test_asgi_idle_connections_share_threads():
+    async def run():
+        release = asyncio.Event()
+        responses = []
+
+        async def request(i):
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                # Cliente lento: a resposta só é lida depois de todos estarem conectados
+                await release.wait()
+                if message['type'] == 'http.response.start':
+                    responses.append(message['status'])
+
+            await async_app({'type': 'http', 'method': 'GET', 'path': f'/user/{i}@x',
+                             'query_string': b'', 'headers': []}, receive, send)
+
+        tasks = [asyncio.ensure_future(request(i)) for i in range(2000)]
+        await asyncio.sleep(0.1)
+        threads = threading.active_count()
+        release.set()
+        await asyncio.gather(*tasks)
+        return threads, responses
+
+    app.config['DATABASE'] = 'temp.db'
+    with app.app_context():
+        init_db()
+    before = threading.active_count()
+    try:
+        threads, responses = asyncio.run(run())
+    finally:
+        async_db.encerrar()
+    # Só as threads do pool de acesso ao banco, não uma por conexão
+    assert threads <= before + async_db.max_threads
+    assert responses == [404] * 2000
+
+
+def _search(client, **query):
+    response = client.get('/search', query_string=query)
+    assert response.status_code == 200
+    return [user['email'] for user in response.json]
+
+
+def test_search(client):
+    with get_pool().conexao() as conn:
+        conn.executemany('INSERT INTO users (email, name, telephone) VALUES (?, ?, ?)',
+                         [('ana@example.com', 'Ana Souza', '(17) 3211-4455'),
+                          ('bruno@test.org', 'Bruno Anastácio', '+55 17 99876-1234'),
+                          ('carla@example.com', 'Carla "CJ" Lima', '17 3211 9988'),
+                          ('alvaro@exemplo.com.br', 'Álvaro Souza', '17 3344 5566'),
+                          ('joao@exemplo.com.br', 'João Pereira', '17 3344 7788')])
+        conn.commit()
+    assert _search(client, q='ana') == ['ana@example.com', 'bruno@test.org']
+    # Prefixo e substring ignoram maiúsculas também nas letras acentuadas
+    assert _search(client, q='álv', match='prefix') == ['alvaro@exemplo.com.br']
+    assert _search(client, q='álv') == ['alvaro@exemplo.com.br']
+    assert _search(client, q='JOÃO', field='name', match='prefix') == ['joao@exemplo.com.br']
+    assert _search(client, q='JOÃO') == ['joao@exemplo.com.br']
+    assert _search(client, q='STÁC', field='name') == ['bruno@test.org']
+    assert _search(client, q='souza', match='prefix') == []
+    assert _search(client, q='ANA', field='name', match='prefix') == ['ana@example.com']
+    assert _search(client, q='example', field='email') == ['ana@example.com',
+                                                           'carla@example.com']
+    assert _search(client, q='"CJ"') == ['carla@example.com']
+    assert _search(client, q='3211', field='telephone') == ['ana@example.com',
+                                                            'carla@example.com']
+    assert _search(client, q='(17) 32', field='telephone', match='prefix') == \
+        ['ana@example.com', 'carla@example.com']
+    assert _search(client, q='55', field='telephone', match='prefix') == ['bruno@test.org']
+    assert _search(client, q='ana', limit=1) == ['ana@example.com']
+
+
+def test_search_follows_changes(client):
+    headers = {'Authorization': create_jwt_token('create', 'admin')}
+    client.post('/new', headers=headers, json={'email': 'ana@example.com', 'name': 'Ana Souza',
+                                               'telephone': '3211-4455'})
+    assert _search(client, q='souza') == ['ana@example.com']
+
+    headers = {'Authorization': create_jwt_token('update', 'admin')}
+    client.put('/user/ana@example.com', headers=headers,
+               json={'name': 'Ana Lima', 'telephone': '9988-7766'})
+    assert _search(client, q='souza') == []
+    assert _search(client, q='lima') == ['ana@example.com']
+    assert _search(client, q='9988', field='telephone', match='prefix') == ['ana@example.com']
+    assert _search(client, q='3211', field='telephone', match='prefix') == []
+
+    headers = {'Authorization': create_jwt_token('delete', 'admin')}
+    client.delete('/user/ana@example.com', headers=headers)
+    assert _search(client, q='lima') == []
+    with get_pool().conexao() as conn:
+        # Falha com SQLITE_CORRUPT_VTAB se o índice divergir de `users`
+        conn.execute("INSERT INTO users_fts (users_fts, rank) VALUES ('integrity-check', 1)")
+
+
+@pytest.mark.parametrize('query', [{}, {'q': 'ab'}, {'q': 'abc', 'field': 'city'},
+                                   {'q': 'abc', 'match': 'exact'}, {'q': 'abc', 'limit': '0'},
+                                   {'q': 'x-y', 'field': 'telephone'}])
+def test_search_invalid(client, query):
+    assert client.get('/search', query_string=query).status_code == 400
+
+
+def test_bulk_create(client):
+    headers = {'Authorization': create_jwt_token('create', 'admin')}
+    _populate(1)
+    users = [{'email': f'user{i:04}@example.com', 'name': f'User {i}', 'telephone': f'555-{i:04}'}
+             for i in range(1200)]
+    users[10] = {'email': 'incomplete@example.com', 'name': 'No Phone'}
+    users.append(users[5])
+    users.append('not an object')
+    response = client.post('/users/bulk', headers=headers, json=users)
+    assert response.status_code == 200
+    results = response.json['results']
+    assert [r['index'] for r in results] == list(range(1202))
+    assert results[0] == {'index': 0, 'email': 'user0000@example.com', 'status': 'duplicate'}
+    assert results[1]['status'] == 'created'
+    assert results[10]['status'] == 'invalid'
+    assert results[1200]['status'] == 'duplicate'
+    assert results[1201] == {'index': 1201, 'email': None, 'status': 'invalid'}
+    assert response.json['summary'] == {'created': 1198, 'duplicate': 2, 'invalid': 2}
+    assert len(client.get('/users').json) == 1199
+    assert _search(client, q='user0999') == ['user0999@example.com']
+
+
+def test_bulk_non_string_fields(client):
+    headers = {'Authorization': create_jwt_token('create', 'admin')}
+    users = [{'email': f'user{i:04}@example.com', 'name': f'User {i}', 'telephone': '1'}
+             for i in range(600)]
+    users += [{'email': 'list@example.com', 'name': ['a'], 'telephone': '1'},
+              {'email': 'number@example.com', 'name': 'N', 'telephone': 5550000},
+              {'email': 7, 'name': 'N', 'telephone': '1'}]
+    response = client.post('/users/bulk', headers=headers, json=users)
+    assert response.status_code == 200
+    assert [r['status'] for r in response.json['results'][600:]] == ['invalid'] * 3
+    assert response.json['summary'] == {'created': 600, 'invalid': 3}
+
+    headers = {'Authorization': create_jwt_token('update', 'admin')}
+    response = client.put('/users/bulk', headers=headers,
+                          json=[{'email': 'user0000@example.com', 'name': {'a': 1},
+                                 'telephone': '1'}])
+    assert response.json['summary'] == {'invalid': 1}
+
+
+def test_bulk_ndjson(client):
+    _populate(3)
+    lines = [json.dumps({'email': 'user0001@example.com', 'name': 'Renamed', 'telephone': '1'}),
+             '',
+             '{broken',
+             json.dumps({'email': 'missing@example.com', 'name': 'Nobody', 'telephone': '2'})]
+    headers = {'Authorization': create_jwt_token('update', 'admin'),
+               'Content-Type': 'application/x-ndjson'}
+    response = client.put('/users/bulk', headers=headers, data='\n'.join(lines) + '\n')
+    assert response.status_code == 200
+    assert [r['status'] for r in response.json['results']] == ['updated', 'invalid', 'not_found']
+    assert client.get('/user/user0001@example.com').json['name'] == 'Renamed'
+
+    headers['Authorization'] = create_jwt_token('delete', 'admin')
+    body = '\n'.join(json.dumps({'email': e}) for e in
+                     ['user0000@example.com', 'user0000@example.com', 'nobody@example.com'])
+    response = client.delete('/users/bulk', headers=headers, data=body)
+    assert [r['status'] for r in response.json['results']] == ['deleted', 'not_found',
+                                                               'not_found']
+    assert [u['email'] for u in client.get('/users').json] == ['user0001@example.com',
+                                                               'user0002@example.com']
+
+
+def test_bulk_requires_token_for_action(client):
+    data = [{'email': 'a@example.com', 'name': 'A', 'telephone': '1'}]
+    headers = {'Authorization': create_jwt_token('create', 'admin')}
+    assert client.put('/users/bulk', headers=headers, json=data).status_code == 403
+    assert client.post('/users/bulk', json=data).status_code == 403
+    assert client.post('/users/bulk', headers=headers, json={'email': 'a'}).status_code == 400
+    assert client.get('/users').json == []
+
+
+def _age_changes(seconds):
+    # Recua as datas de alteração, sem disparar os gatilhos de `users`
+    with get_pool().conexao() as conn:
+        conn.execute('UPDATE users_meta SET updated_at = updated_at - ?', (seconds,))
+        conn.execute('UPDATE users SET updated_at = updated_at - ?', (seconds,))
+        conn.commit()
+
+
+def test_conditional_list_users(client):
+    _populate(3)
+    _age_changes(10)
+    response = client.get('/users')
+    etag = response.headers['ETag']
+    last_modified = response.headers['Last-Modified']
+    assert etag.startswith('"') and not etag.startswith('W/')
+    response = client.get('/users', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+    response = client.get('/users', headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 304
+    response = client.get('/users', headers={'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'})
+    assert response.status_code == 200
+
+    headers = {'Authorization': create_jwt_token('update', 'admin')}
+    client.put('/user/user0001@example.com', headers=headers,
+               json={'name': 'Renamed', 'telephone': '1'})
+    response = client.get('/users', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert len(response.json) == 3
+    # Uma alteração sem efeito não muda a versão
+    client.put('/user/missing@example.com', headers=headers,
+               json={'name': 'Nobody', 'telephone': '1'})
+    assert client.get('/users', headers={'If-None-Match': response.headers['ETag']}) \
+        .status_code == 304
+
+
+def test_conditional_get_user(client):
+    _populate(2)
+    response = client.get('/user/user0000@example.com')
+    etag = response.headers['ETag']
+    assert client.get('/user/user0000@example.com',
+                      headers={'If-None-Match': f'"other", {etag}'}).status_code == 304
+    assert client.get('/user/user0000@example.com',
+                      headers={'If-None-Match': f'W/{etag}'}).status_code == 304
+
+    # Alterar outro usuário não invalida o ETag deste
+    headers = {'Authorization': create_jwt_token('update', 'admin')}
+    client.put('/user/user0001@example.com', headers=headers,
+               json={'name': 'Renamed', 'telephone': '1'})
+    assert client.get('/user/user0000@example.com',
+                      headers={'If-None-Match': etag}).status_code == 304
+
+    client.put('/user/user0000@example.com', headers=headers,
+               json={'name': 'Renamed', 'telephone': '1'})
+    response = client.get('/user/user0000@example.com', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.json['name'] == 'Renamed'
+
+    headers = {'Authorization': create_jwt_token('delete', 'admin')}
+    client.delete('/user/user0000@example.com', headers=headers)
+    assert client.get('/user/user0000@example.com',
+                      headers={'If-None-Match': etag}).status_code == 404
+
+
+def test_last_modified_same_second(client):
+    _populate(1)
+    # Alteração recente: sem Last-Modified, que não distinguiria outra escrita no mesmo
+    # segundo; If-Modified-Since é ignorado
+    response = client.get('/user/user0000@example.com')
+    assert 'Last-Modified' not in response.headers
+    assert client.get('/user/user0000@example.com',
+                      headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'}) \
+        .status_code == 200
+
+    _age_changes(10)
+    user_cache.limpar()
+    last_modified = client.get('/user/user0000@example.com').headers['Last-Modified']
+    assert client.get('/user/user0000@example.com',
+                      headers={'If-Modified-Since': last_modified}).status_code == 304
+    # Uma escrita posterior é sempre mais nova que o Last-Modified enviado
+    headers = {'Authorization': create_jwt_token('update', 'admin')}
+    client.put('/user/user0000@example.com', headers=headers,
+               json={'name': 'Renamed', 'telephone': '1'})
+    response = client.get('/user/user0000@example.com',
+                          headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 200
+    assert response.json['name'] == 'Renamed'
+
+
+def test_version_follows_bulk_changes(client):
+    etag = client.get('/users').headers['ETag']
+    headers = {'Authorization': create_jwt_token('create', 'admin')}
+    client.post('/users/bulk', headers=headers,
+                json=[{'email': f'u{i}@example.com', 'name': 'U', 'telephone': '1'}
+                      for i in range(3)])
+    response = client.get('/users', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] == '"v3"'
+
+
+def test_user_cache(client):
+    _populate(2)
+    assert client.get('/user/user0000@example.com').status_code == 200
+    response = client.get('/user/user0000@example.com')
+    assert response.json == {'email': 'user0000@example.com', 'name': 'User 0',
+                             'telephone': '555-0000'}
+    assert response.mimetype == 'application/json'
+    # Os GETs condicionais também são atendidos pelo cache
+    assert client.get('/user/user0000@example.com',
+                      headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    assert (user_cache.acertos, user_cache.falhas) == (2, 1)
+    # Respostas 404 não são guardadas
+    client.get('/user/missing@example.com')
+    client.get('/user/missing@example.com')
+    assert user_cache.falhas == 3
+
+
+def test_user_cache_invalidated_by_writes(client):
+    _populate(2)
+    client.get('/user/user0000@example.com')
+    client.get('/user/user0001@example.com')
+
+    headers = {'Authorization': create_jwt_token('update', 'admin')}
+    client.put('/user/user0000@example.com', headers=headers,
+               json={'name': 'Renamed', 'telephone': '1'})
+    assert client.get('/user/user0000@example.com').json['name'] == 'Renamed'
+    client.put('/users/bulk', headers=headers,
+               json=[{'email': 'user0001@example.com', 'name': 'Bulk', 'telephone': '2'}])
+    assert client.get('/user/user0001@example.com').json['name'] == 'Bulk'
+
+    headers = {'Authorization': create_jwt_token('delete', 'admin')}
+    client.delete('/user/user0000@example.com', headers=headers)
+    assert client.get('/user/user0000@example.com').status_code == 404
+    client.delete('/users/bulk', headers=headers, json=[{'email': 'user0001@example.com'}])
+    assert client.get('/user/user0001@example.com').status_code == 404
+
+
+def test_user_cache_shared_backend(client):
+    _populate(1)
+    user_cache.backend = BackendMemoria()
+    try:
+        client.get('/user/user0000@example.com')
+        # Outro processo, com o mesmo backend, altera o usuário
+        other = CacheRespostas(backend=user_cache.backend)
+        assert other.obter('user0000@example.com') is not None
+        with get_pool().conexao() as conn:
+            conn.execute("UPDATE users SET name = 'Other' WHERE email = 'user0000@example.com'")
+            conn.commit()
+        other.invalidar('user0000@example.com')
+        assert client.get('/user/user0000@example.com').json['name'] == 'Other'
+        assert len(user_cache) == 0
+    finally:
+        user_cache.backend = None
+        user_cache.limpar()
+
+
+def _changes(client, since):
+    response = client.get('/changes', query_string={'since': since})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()], \
+        int(response.headers['X-Change-Seq'])
+
+
+def test_changes(client):
+    _populate(2)
+    response = client.get('/users')
+    since = int(response.headers['X-Change-Seq'])
+    assert since == 2
+    changes, head = _changes(client, 0)
+    assert [(change['seq'], change['op']) for change in changes] == [(1, 'insert'), (2, 'insert')]
+    assert _changes(client, since) == ([], 2)
+
+    headers = {'Authorization': create_jwt_token('update', 'admin')}
+    client.put('/user/user0000@example.com', headers=headers,
+               json={'name': 'Renamed', 'telephone': '1'})
+    headers = {'Authorization': create_jwt_token('delete', 'admin')}
+    client.delete('/user/user0001@example.com', headers=headers)
+    # Troca de email: remoção do antigo e inserção do novo
+    with get_pool().conexao() as conn:
+        conn.execute("UPDATE users SET email = 'new@example.com' "
+                     "WHERE email = 'user0000@example.com'")
+        conn.commit()
+    assert _changes(client, since) == ([
+        {'seq': 3, 'op': 'update', 'email': 'user0000@example.com', 'name': 'Renamed',
+         'telephone': '1'},
+        {'seq': 4, 'op': 'delete', 'email': 'user0001@example.com'},
+        {'seq': 5, 'op': 'delete', 'email': 'user0000@example.com'},
+        {'seq': 6, 'op': 'insert', 'email': 'new@example.com', 'name': 'Renamed',
+         'telephone': '1'}], 6)
+
+
+def test_changes_follow_bulk(client):
+    headers = {'Authorization': create_jwt_token('create', 'admin')}
+    client.post('/users/bulk', headers=headers,
+                json=[{'email': f'u{i}@example.com', 'name': 'U', 'telephone': '1'}
+                      for i in range(1200)])
+    changes, head = _changes(client, 0)
+    assert [change['seq'] for change in changes] == list(range(1, 1201))
+    assert head == 1200
+
+
+@pytest.mark.parametrize("since", ['-1', 'abc'])
+def test_changes_invalid_since(client, since):
+    response = client.get('/changes', query_string={'since': since})
+    assert response.status_code == 400
+    assert response.json == {'error': 'Invalid since'}
+
+
+def test_changes_compaction(client):
+    _populate(3)
+    headers = {'Authorization': create_jwt_token('update', 'admin')}
+    client.put('/user/user0000@example.com', headers=headers,
+               json={'name': 'Renamed', 'telephone': '1'})
+    headers = {'Authorization': create_jwt_token('delete', 'admin')}
+    client.delete('/user/user0001@example.com', headers=headers)
+
+    # Só a última alteração de cada email é mantida; remoções recentes também
+    with get_pool().conexao() as conn:
+        assert compact_changes(conn) == 2
+    changes, head = _changes(client, 0)
+    assert [(change['seq'], change['op']) for change in changes] == \
+        [(3, 'insert'), (4, 'update'), (5, 'delete')]
+
+    # Sem as remoções antigas, quem está antes delas precisa recomeçar por /users
+    with get_pool().conexao() as conn:
+        assert compact_changes(conn, retention=0) == 1
+    response = client.get('/changes', query_string={'since': 4})
+    assert response.status_code == 410
+    assert response.json == {'error': 'Changes compacted, resync from /users'}
+    assert _changes(client, 5) == ([], 5)
+    assert client.get('/users').headers['X-Change-Seq'] == '5'
+
+
+def test_compact_changes_command(client):
+    _populate(1)
+    with get_pool().conexao() as conn:
+        conn.execute('DELETE FROM users')
+        conn.commit()
+    result = app.test_cli_runner().invoke(args=['compact-changes', '--retention', '0'])
+    assert result.exit_code == 0
+    assert 'Registros descartados: 2' in result.output
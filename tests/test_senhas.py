@@ -1,9 +1,16 @@
+import hashlib
+import math
+import os
 from pathlib import Path
 from string import ascii_lowercase, ascii_uppercase, digits, punctuation
 
 import pytest
 
-from src.senhas import gerar_senha_aleatoria, gerar_senha_frase, validar_complexidade_senha
+from src.senhas import (PONTUACAO_MAXIMA_VAZADA, FiltroSenhasVazadas, ListaPalavras,
+                        PoliticaSenha, carregar_lista_palavras, construir_filtro_senhas,
+                        estimar_entropia, gerar_senha_aleatoria, gerar_senha_frase,
+                        gerar_senhas_em_lote, invalidar_lista_palavras, pontuar_senha,
+                        validar_complexidade_senha)
 
 
 @pytest.fixture
@@ -55,6 +62,38 @@ class TestGerarSenhaAleatoria:
                                      digitos=False, simbolos=False) is None
 
 
+class TestGerarSenhasEmLote:
+    def test_quantidade_e_tamanho(self):
+        senhas = list(gerar_senhas_em_lote(500, tamanho=12))
+        assert len(senhas) == 500
+        assert all(len(senha) == 12 for senha in senhas)
+        assert len(set(senhas)) == 500
+
+    def test_uma_de_cada_categoria(self):
+        for senha in gerar_senhas_em_lote(1000, tamanho=4):
+            assert any(c in ascii_uppercase for c in senha)
+            assert any(c in ascii_lowercase for c in senha)
+            assert any(c in digits for c in senha)
+            assert any(c in punctuation for c in senha)
+
+    @pytest.mark.caracteresconfusos
+    def test_remove_confusos(self):
+        for senha in gerar_senhas_em_lote(200, remove_confusos=True):
+            assert not any(c in 'Il1O0' for c in senha)
+
+    def test_categoria_unica(self):
+        for senha in gerar_senhas_em_lote(200, maiusculas=False, minusculas=False,
+                                          simbolos=False):
+            assert senha.isdigit()
+
+    @pytest.mark.error
+    def test_casos_invalidos(self):
+        assert gerar_senhas_em_lote(10, tamanho=2) is None
+        assert gerar_senhas_em_lote(10, maiusculas=False, minusculas=False,
+                                    digitos=False, simbolos=False) is None
+        assert list(gerar_senhas_em_lote(0)) == []
+
+
 class TestGerarSenhaFrase:
     @pytest.mark.parametrize("num_palavras", [2, 3, 4, 5])
     def test_diferentes_numeros_palavras(self, num_palavras):
@@ -86,6 +125,44 @@ class TestGerarSenhaFrase:
         assert separador in senha
 
 
+class TestListaPalavras:
+    @pytest.fixture
+    def arquivo_palavras(self, tmp_path):
+        arquivo = tmp_path / "palavras.lst"
+        arquivo.write_text("abacate\nabacaxi\nbanana\n")
+        yield arquivo
+        invalidar_lista_palavras()
+
+    def test_formas_completa_e_truncada(self, arquivo_palavras):
+        lista = carregar_lista_palavras(arquivo_palavras)
+        assert lista.palavras() == ('abacate', 'abacaxi', 'banana')
+        assert lista.palavras(completas=False) == ('abac', 'abac', 'bana')
+        assert len(lista) == 3
+
+    def test_carrega_uma_vez(self, arquivo_palavras):
+        primeira = carregar_lista_palavras(arquivo_palavras)
+        assert carregar_lista_palavras(arquivo_palavras) is primeira
+
+    def test_recarrega_quando_arquivo_muda(self, arquivo_palavras):
+        lista = carregar_lista_palavras(arquivo_palavras)
+        arquivo_palavras.write_text("cebola\n")
+        os.utime(arquivo_palavras, ns=(lista.mtime + 10**9, lista.mtime + 10**9))
+        nova = carregar_lista_palavras(arquivo_palavras)
+        assert nova is not lista
+        assert nova.palavras() == ('cebola',)
+
+    def test_invalidar(self, arquivo_palavras):
+        lista = carregar_lista_palavras(arquivo_palavras)
+        invalidar_lista_palavras(arquivo_palavras)
+        assert carregar_lista_palavras(arquivo_palavras) is not lista
+
+    def test_lista_pre_carregada(self, arquivo_palavras):
+        lista = ListaPalavras(arquivo_palavras)
+        senha = gerar_senha_frase(num_palavras=3, palavras_completas=False,
+                                  arquivo=Path("error.lst"), lista=lista)
+        assert all(p in ('abac', 'bana') for p in senha.split('-'))
+
+
 class TestValidarComplexidadeSenha:
     @pytest.mark.parametrize("senha,esperado", [
         ("Abc123#$", True),
@@ -111,3 +188,151 @@ class TestValidarComplexidadeSenha:
             valid_test_passwords['all_categories'],
             tamanho=tamanho
         ) is esperado
+
+
+class TestPoliticaSenha:
+    @pytest.mark.parametrize("senha,falhas", [
+        ("Abc123#$", []),
+        ("Ab1#", ['tamanho']),
+        ("abc123#$", ['maiusculas']),
+        ("ABC123#$", ['minusculas']),
+        ("AbcDef#$", ['digitos']),
+        ("Abcd1234", ['simbolos']),
+        ("abcdefgh", ['maiusculas', 'digitos', 'simbolos']),
+        ("Abcdef1é", ['simbolos']),
+        ("Abcdef١#", []),
+    ])
+    def test_regras_violadas(self, senha, falhas):
+        politica = PoliticaSenha()
+        assert politica.verificar(senha) == falhas
+        assert politica.valida(senha) is (not falhas)
+
+    def test_max_repeticoes(self):
+        politica = PoliticaSenha(max_repeticoes=2)
+        assert politica.valida("Abc1#aab")
+        assert politica.verificar("Abc1#aaab") == ['repeticoes']
+
+    def test_substrings_proibidas(self):
+        politica = PoliticaSenha(substrings_proibidas=['senha', 'empresa'])
+        assert politica.verificar("MinhaSENHA1#") == ['proibidas']
+        assert politica.valida("Outra123#$")
+
+    def test_sem_classes_exigidas(self):
+        politica = PoliticaSenha(tamanho=3, maiusculas=False, minusculas=False,
+                                 digitos=False, simbolos=False)
+        assert politica.valida("aaa")
+        assert politica.verificar("aa") == ['tamanho']
+
+    def test_validar_lote(self, valid_test_passwords):
+        politica = PoliticaSenha()
+        senhas = [valid_test_passwords['all_categories'],
+                  valid_test_passwords['no_symbols'],
+                  valid_test_passwords['minimal']]
+        assert list(politica.validar_lote(iter(senhas))) == [
+            (senhas[0], []),
+            (senhas[1], ['simbolos']),
+            (senhas[2], ['tamanho']),
+        ]
+
+
+class TestFiltroSenhasVazadas:
+    @pytest.fixture
+    def vazadas(self):
+        return [f"Senha{i}!" for i in range(1000)] + ["Password1!"]
+
+    @pytest.fixture
+    def filtro(self, tmp_path, vazadas):
+        origem = tmp_path / "vazadas.txt"
+        origem.write_text("\n".join(vazadas) + "\n")
+        destino = tmp_path / "vazadas.bloom"
+        assert construir_filtro_senhas(origem, destino) == len(vazadas)
+        with FiltroSenhasVazadas(destino) as filtro:
+            yield filtro
+
+    def test_sem_falsos_negativos(self, filtro, vazadas):
+        assert all(senha in filtro for senha in vazadas)
+
+    def test_poucos_falsos_positivos(self, filtro):
+        falsos = sum(1 for i in range(10000) if filtro.contem(f"Outra{i}#"))
+        assert falsos < 100
+
+    def test_lista_sha1(self, tmp_path, vazadas):
+        origem = tmp_path / "vazadas.sha1"
+        origem.write_text("".join(f"{hashlib.sha1(s.encode()).hexdigest().upper()}:{i}\n"
+                                  for i, s in enumerate(vazadas)))
+        destino = tmp_path / "sha1.bloom"
+        assert construir_filtro_senhas(origem, destino, formato='sha1') == len(vazadas)
+        with FiltroSenhasVazadas(destino) as filtro:
+            assert "Password1!" in filtro
+            assert filtro.contem_sha1(hashlib.sha1(b"Senha7!").digest())
+
+    @pytest.mark.error
+    def test_arquivo_invalido(self, tmp_path):
+        arquivo = tmp_path / "invalido.bloom"
+        arquivo.write_bytes(b"nao e um filtro" * 10)
+        with pytest.raises(ValueError):
+            FiltroSenhasVazadas(arquivo)
+
+    def test_validacao(self, filtro):
+        assert validar_complexidade_senha("Password1!")
+        assert not validar_complexidade_senha("Password1!", vazadas=filtro)
+        assert validar_complexidade_senha("Testando123#$", vazadas=filtro)
+        assert PoliticaSenha(vazadas=filtro).verificar("Password1!") == ['vazada']
+
+
+class TestEntropia:
+    def test_senha_vazia(self):
+        assert estimar_entropia("") == 0.0
+        assert pontuar_senha("") == 0
+
+    @pytest.mark.parametrize("fraca,forte", [
+        ("aaaaaaaaaa", "akqmzwpxnr"),  # repetição
+        ("abcdefghij", "akqmzwpxnr"),  # sequência
+        ("qwertyuiop", "akqmzwpxnr"),  # teclado
+        ("abacaxi", "akqmzwp"),  # palavra do dicionário
+    ])
+    def test_padroes_reduzem_entropia(self, fraca, forte):
+        assert estimar_entropia(fraca) < estimar_entropia(forte) / 2
+
+    def test_classes_aumentam_entropia(self):
+        assert estimar_entropia("xK#9mQ!2vL@p") > estimar_entropia("xkqmzwpvlanp")
+
+    def test_pontuacao(self):
+        assert pontuar_senha("123456") == 0
+        assert pontuar_senha("xK#9mQ!2vL@p") >= 3
+
+    @pytest.mark.parametrize("senha", ["Password1!", "P@ssw0rd", "s3nh4", "Qwerty!"])
+    def test_senhas_comuns(self, senha):
+        assert pontuar_senha(senha) <= 1
+
+    def test_leet_custa_bits(self):
+        assert estimar_entropia("password") < estimar_entropia("P@ssw0rd")
+        assert estimar_entropia("P@ssw0rd") < estimar_entropia("xK#9mQ!2") / 2
+
+    def test_pontuacao_vazada(self, tmp_path):
+        origem = tmp_path / "vazadas.txt"
+        origem.write_text("xK#9mQ!2vL@p\n")
+        construir_filtro_senhas(origem, tmp_path / "vazadas.bloom")
+        with FiltroSenhasVazadas(tmp_path / "vazadas.bloom") as filtro:
+            assert pontuar_senha("xK#9mQ!2vL@p", vazadas=filtro) == PONTUACAO_MAXIMA_VAZADA
+            assert pontuar_senha("yL$8nR?3wM#q", vazadas=filtro) >= 3
+
+    def test_entropia_senha_aleatoria(self):
+        senha, bits = gerar_senha_aleatoria(tamanho=4, maiusculas=False, minusculas=False,
+                                            simbolos=False, retornar_entropia=True)
+        assert len(senha) == 4
+        assert bits == pytest.approx(4 * math.log2(8))
+
+        senha, bits = gerar_senha_aleatoria(tamanho=12, retornar_entropia=True)
+        assert 12 * math.log2(88) > bits > 12 * math.log2(88) - 1
+
+    def test_entropia_senha_frase(self):
+        lista = carregar_lista_palavras(Path("palavras.lst"))
+        senha, bits = gerar_senha_frase(num_palavras=4, lista=lista, retornar_entropia=True)
+        assert len(senha.split('-')) == 4
+        assert bits == pytest.approx(4 * math.log2(len(lista)))
+
+        _, bits = gerar_senha_frase(num_palavras=4, lista=lista, palavras_completas=False,
+                                    maiuscula=True, retornar_entropia=True)
+        assert bits == pytest.approx(4 * lista.entropia(completas=False) + 2)
+        assert lista.entropia(completas=False) < lista.entropia()